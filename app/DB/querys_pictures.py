@@ -1,9 +1,13 @@
 # APP
-from app.models.picture import Picture, Free_picture
+from app.models.picture import Picture, Free_picture, Free_picture_day, RenderJob, JobStatus
 # SQLModel
-from sqlmodel import Session, select, func
+from sqlmodel import Session, select, update, func, or_, and_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import IntegrityError
 # Python
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from uuid import UUID
 
 class PictureDB:
     def add_picture_toDB(picture: Picture, db: Session):
@@ -16,6 +20,52 @@ class PictureDB:
             print("Error Creating a Picture register: "+str(e))
         return None
 
+    async def add_picture_toDB_async(picture: Picture, db: AsyncSession):
+        try:
+            db.add(picture)
+            await db.commit()
+            await db.refresh(picture)
+            return picture
+        except Exception as e:
+            await db.rollback()
+            print("Error Creating a Picture register: "+str(e))
+        return None
+
+    async def add_pictures_toDB_async(pictures: List[Picture], db: AsyncSession):
+        try:
+            db.add_all(pictures)
+            # the ids are needed by the callers
+            await db.flush()
+            await db.commit()
+            return pictures
+        except Exception as e:
+            await db.rollback()
+            print("Error Creating the Picture registers: "+str(e))
+        return None
+
+    async def get_user_picture_async(user_id: UUID, picture_id: int, db: AsyncSession) -> Optional[Picture]:
+        picture = await db.get(Picture, picture_id)
+        if picture is None or picture.user_id != user_id:
+            return None
+        return picture
+
+    async def get_user_pictures_async(user_id: UUID,
+                                      db: AsyncSession,
+                                      limit: int = 50,
+                                      before: Optional[Tuple[datetime, int]] = None) -> List[Picture]:
+        """
+        Returns the pictures of an user newest first. The pages are found by
+        keyset: `before` is the (initDate, id) of the last picture of the
+        previous page, so every page is a range scan of the user_id/initDate index.
+        """
+        statement = select(Picture).where(Picture.user_id == user_id)
+        if before is not None:
+            statement = statement.where(or_(Picture.initDate < before[0],
+                                            and_(Picture.initDate == before[0],
+                                                 Picture.id < before[1])))
+        statement = statement.order_by(Picture.initDate.desc(), Picture.id.desc()).limit(limit)
+        return (await db.exec(statement)).all()
+
 class FreePictureDB:
     def add_freePicture_toDB(picture: Free_picture, db: Session):
         try:
@@ -27,6 +77,61 @@ class FreePictureDB:
             print("Error Creating a Free Picture register: "+str(e))
         return None
 
+    async def add_freePicture_toDB_async(picture: Free_picture, db: AsyncSession):
+        try:
+            db.add(picture)
+            await db.commit()
+            await db.refresh(picture)
+            return picture
+        except Exception as e:
+            await db.rollback()
+            print("Error Creating a Free Picture register: "+str(e))
+        return None
+
+    async def add_freePictures_toDB_async(pictures: List[Free_picture], db: AsyncSession):
+        try:
+            db.add_all(pictures)
+            await db.commit()
+            return pictures
+        except Exception as e:
+            await db.rollback()
+            print("Error Creating the Free Picture registers: "+str(e))
+        return None
+
+    def rollup_free_pictures(before: datetime, db: Session) -> int:
+        """
+        Rolls the Free_picture rows of the days before `before` up into per-day and
+        per-ip counts on Free_picture_day and deletes them. Each day is done in
+        its own transaction, a day already rolled up by another process fails on
+        the primary key of Free_picture_day and is skipped.
+
+        Returns:
+            int: The number of Free_picture rows deleted.
+        """
+        # whole days only, a day is never split between two roll ups
+        before = datetime.combine(before.date(), datetime.min.time())
+        deleted = 0
+        while True:
+            oldest = db.exec(select(func.min(Free_picture.date)).where(Free_picture.date < before)).one()
+            if oldest is None:
+                return deleted
+            start = datetime.combine(oldest, datetime.min.time())
+            end = min(start + timedelta(days=1), before)
+            in_day = and_(Free_picture.date >= start, Free_picture.date < end)
+            counts = db.exec(select(Free_picture.ip, Free_picture.quality, func.count())
+                             .where(in_day)
+                             .group_by(Free_picture.ip, Free_picture.quality)).all()
+            try:
+                db.add_all([Free_picture_day(day=start.date(), ip=ip, quality=quality, count=count)
+                            for ip, quality, count in counts])
+                db.flush()
+                deleted += db.query(Free_picture).filter(in_day).delete(synchronize_session=False)
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                print(f"Free pictures of {start.date()} already rolled up")
+                return deleted
+
     def get_picture_ip(ip: str, db: Session):
         statement = select(Free_picture).where(Free_picture.ip == ip)
         freePicture_db = db.exec(statement).all()
@@ -42,3 +147,73 @@ class FreePictureDB:
                                                     ).scalar()
 
         return record_count
+
+    async def get_picture_ip_async(ip: str, db: AsyncSession):
+        statement = select(Free_picture).where(Free_picture.ip == ip)
+        return (await db.exec(statement)).all()
+
+    async def get_count_ip_date_async(ip: str, date: datetime, db: AsyncSession):
+        start_date = datetime.combine(date, datetime.min.time())
+        end_date = datetime.combine(date, datetime.max.time())
+        statement = select(func.count()).where(Free_picture.ip == ip,
+                                               Free_picture.date >= start_date,
+                                               Free_picture.date <= end_date)
+        return (await db.exec(statement)).one()
+
+class RenderJobDB:
+    async def add_job_toDB_async(job: RenderJob, db: AsyncSession):
+        try:
+            db.add(job)
+            await db.commit()
+            await db.refresh(job)
+            return job
+        except Exception as e:
+            await db.rollback()
+            print("Error Creating a Render Job register: "+str(e))
+        return None
+
+    async def update_job_async(job: RenderJob, db: AsyncSession, **values):
+        for name, value in values.items():
+            setattr(job, name, value)
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        return job
+
+    async def get_job_async(job_id: UUID, db: AsyncSession) -> Optional[RenderJob]:
+        return await db.get(RenderJob, job_id)
+
+    async def claim_job_async(job_id: UUID, started: datetime, db: AsyncSession) -> Optional[RenderJob]:
+        """
+        Moves a QUEUED job to RUNNING in a single conditional UPDATE, so only
+        one worker of all the app processes can claim it.
+
+        Returns:
+            Optional[RenderJob]: The job if this call claimed it, None if it is
+            not QUEUED anymore or does not exist.
+        """
+        statement = update(RenderJob).where(RenderJob.id == job_id,
+                                            RenderJob.status == JobStatus.QUEUED
+                                            ).values(status=JobStatus.RUNNING, startDate=started)
+        result = await db.execute(statement)
+        await db.commit()
+        if result.rowcount != 1:
+            return None
+        return await db.get(RenderJob, job_id, populate_existing=True)
+
+    async def requeue_stale_jobs_async(stale_before: datetime, db: AsyncSession) -> List[RenderJob]:
+        """
+        Puts back in QUEUED the RUNNING jobs started before `stale_before`, the
+        worker running them is gone.
+
+        Returns:
+            List[RenderJob]: All the QUEUED jobs, oldest first.
+        """
+        statement = update(RenderJob).where(RenderJob.status == JobStatus.RUNNING,
+                                            or_(RenderJob.startDate == None,  # noqa: E711
+                                                RenderJob.startDate < stale_before)
+                                            ).values(status=JobStatus.QUEUED, startDate=None)
+        await db.execute(statement)
+        await db.commit()
+        statement = select(RenderJob).where(RenderJob.status == JobStatus.QUEUED).order_by(RenderJob.initDate)
+        return (await db.exec(statement)).all()
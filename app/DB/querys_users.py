@@ -2,7 +2,13 @@
 from app.models.user import User
 # SQLModel
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, or_
+# Python
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple
+from uuid import UUID
 
 def add_user_to_db(user: User,session: Session):
     """
@@ -25,6 +31,22 @@ def add_user_to_db(user: User,session: Session):
         print("Error Creating User:"+str(e))
     return None
 
+async def add_user_to_db_async(user: User, session: AsyncSession):
+    """
+    Async version of `add_user_to_db`.
+    """
+    try:
+        session.add(user)
+        await session.commit()
+        return user
+    except IntegrityError as e:
+        await session.rollback()
+        print("Error: User already exists:"+str(e))
+    except Exception as e:
+        await session.rollback()
+        print("Error Creating User:"+str(e))
+    return None
+
 def get_userDB_by_email(username: str, session: Session):
     """
     Retrieves a user's database object by their email address.
@@ -41,4 +63,47 @@ def get_userDB_by_email(username: str, session: Session):
     # with Session(engine) as session:
     #     statement = select(User).where(User.email == username)
     #     user_db = session.exec(statement).first()
-    # return user_db
\ No newline at end of file
+    # return user_db
+
+async def get_userDB_by_email_async(username: str, session: AsyncSession):
+    """
+    Async version of `get_userDB_by_email`.
+    """
+    statement = select(User).where(User.email == username)
+    return (await session.exec(statement)).first()
+
+def users_statement(after: Optional[Tuple[datetime, UUID]] = None,
+                    userType: Optional[str] = None,
+                    is_active: Optional[bool] = None,
+                    country: Optional[str] = None):
+    """
+    Returns the select of the users matching the filters, oldest first. `after`
+    is the (initDate, id) of the last user of the previous page.
+    """
+    statement = select(User)
+    if after is not None:
+        statement = statement.where(or_(User.initDate > after[0],
+                                        and_(User.initDate == after[0], User.id > after[1])))
+    if userType is not None:
+        statement = statement.where(User.userType == userType)
+    if is_active is not None:
+        statement = statement.where(User.is_active == is_active)
+    if country is not None:
+        statement = statement.where(User.country == country)
+    return statement.order_by(User.initDate, User.id)
+
+async def get_users_async(session: AsyncSession, limit: int = 100, **filters):
+    """
+    Returns a page of at most `limit` users, `filters` are the ones of `users_statement`.
+    """
+    statement = users_statement(**filters).limit(limit)
+    return (await session.exec(statement)).all()
+
+async def stream_users_async(session: AsyncSession, **filters) -> AsyncIterator[User]:
+    """
+    Yields all the users matching `filters` from a server-side cursor, so the
+    whole table is never loaded at once.
+    """
+    result = await session.stream_scalars(users_statement(**filters).execution_options(yield_per=500))
+    async for user in result:
+        yield user
@@ -0,0 +1,111 @@
+# APP
+from app.DB import db as database
+# SQLModel
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+# Python
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+import os
+
+WRITER_BATCH_SIZE = int(os.getenv('WRITER_BATCH_SIZE', 500))  # Rows
+WRITER_BATCH_DELAY = int(os.getenv('WRITER_BATCH_DELAY', 20)) / 1000  # Milliseconds
+WRITER_QUEUE_SIZE = int(os.getenv('WRITER_QUEUE_SIZE', 10000))  # Rows
+
+
+class BatchWriter:
+    """
+    Single writer of rows that nobody reads back at once, like the logs. The
+    requests only queue their rows and one task writes them, so SQLite gets one
+    transaction every `batch_delay` seconds instead of one commit per request
+    fighting for the write lock.
+
+    `write` gets the rows and the session of the batch and commits them, the
+    rows of a batch that fails are put back for the next one, up to
+    `queue_size` rows.
+    """
+
+    def __init__(self,
+                 write: Callable[[List[SQLModel], AsyncSession], Awaitable],
+                 batch_size: int = WRITER_BATCH_SIZE,
+                 batch_delay: float = WRITER_BATCH_DELAY,
+                 queue_size: int = WRITER_QUEUE_SIZE,
+                 session_factory: Optional[Callable[[], AsyncSession]] = None) -> None:
+        self.write = write
+        self.batch_size = max(1, batch_size)
+        self.batch_delay = batch_delay
+        self.queue_size = queue_size
+        self.session_factory = session_factory or (lambda: AsyncSession(database.async_engine))
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: List[SQLModel] = []
+        self._stats = {'rows': 0, 'batches': 0, 'dropped': 0}
+
+    async def add(self, row: SQLModel) -> None:
+        """
+        Queues a row. Before `start` or after `shutdown` the row is written at once.
+        """
+        if self._queue is None:
+            await self._write([row])
+        elif self._queue.qsize() >= self.queue_size:
+            # the writer is behind, the row is not worth slowing the request
+            self._stats['dropped'] += 1
+        else:
+            self._queue.put_nowait(row)
+
+    async def _write(self, rows: List[SQLModel]) -> None:
+        async with self.session_factory() as db:
+            await self.write(rows, db)
+        self._stats['rows'] += len(rows)
+        self._stats['batches'] += 1
+
+    async def _write_batch(self, rows: List[SQLModel]) -> None:
+        try:
+            await self._write(rows)
+        except Exception as e:
+            print(f"Error writing {len(rows)} rows: {e}")
+            # kept for the next batch
+            kept = rows[:max(0, self.queue_size - len(self._pending))]
+            self._stats['dropped'] += len(rows) - len(kept)
+            self._pending = kept + self._pending
+
+    async def _run(self) -> None:
+        while True:
+            self._pending.append(await self._queue.get())
+            await asyncio.sleep(self.batch_delay)
+            while len(self._pending) < self.batch_size and not self._queue.empty():
+                self._pending.append(self._queue.get_nowait())
+            # out of _pending while written, shutdown only writes the rows of failed batches
+            rows, self._pending = self._pending, []
+            batch = asyncio.ensure_future(self._write_batch(rows))
+            try:
+                await asyncio.shield(batch)
+            except asyncio.CancelledError:
+                # a batch cancelled mid-write could be committed already, it
+                # finishes before shutdown writes the rest
+                await batch
+                raise
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        """
+        Stops the writer and writes the rows still queued.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._queue is not None:
+            rows, self._pending = self._pending, []
+            while not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            self._queue = None
+            if rows:
+                await self._write(rows)
+
+    def stats(self) -> dict:
+        return {'depth': self._queue.qsize() if self._queue is not None else 0,
+                **self._stats}
@@ -0,0 +1,133 @@
+# APP
+from app.DB.db import BASE_DIR
+# Python
+from typing import Dict, List, Optional, Tuple
+import tempfile
+import asyncio
+import heapq
+import time
+import os
+
+TEMP_DIR = os.getenv('TEMP_DIR', os.path.join(BASE_DIR, 'cache', 'tmp'))
+TEMP_TTL = int(os.getenv('TEMP_TTL', 10 * 60))  # Seconds a temporary file can live
+TEMP_SWEEP_INTERVAL = 30  # Seconds
+
+
+class TempArtifacts:
+    """
+    Owner of the temporary files of the requests, like the spooled uploads.
+    They are created on `directory`, removed with `release` when they are not
+    needed anymore and, in case a request never releases its files, removed
+    by a single task once they are `ttl` seconds old.
+
+    The files are kept on a min-heap by expiry, so the task only looks at the
+    ones that are due. Files released before are left on the heap and skipped,
+    even if a new file got the same name.
+    `sweep_orphans` removes the files left by a previous run of the app.
+    """
+
+    def __init__(self, directory: str = TEMP_DIR, ttl: float = TEMP_TTL,
+                 interval: float = TEMP_SWEEP_INTERVAL) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.interval = interval
+        self._heap: List[Tuple[float, str]] = []
+        self._expiries: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {'created': 0, 'released': 0, 'expired': 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def new_file(self, suffix: str = '') -> Tuple[int, str]:
+        """
+        Creates a temporary file that will be removed at most `ttl` seconds later.
+
+        Returns:
+            Tuple[int, str]: The file descriptor and the path of the file, like `tempfile.mkstemp`.
+        """
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+        expires = time.monotonic() + self.ttl
+        self._expiries[path] = expires
+        heapq.heappush(self._heap, (expires, path))
+        self._stats['created'] += 1
+        return fd, path
+
+    def release(self, path: str) -> None:
+        self._expiries.pop(path, None)
+        try:
+            os.remove(path)
+            self._stats['released'] += 1
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Removes the files that expired.
+
+        Returns:
+            int: The number of files removed.
+        """
+        now = time.monotonic() if now is None else now
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires, path = heapq.heappop(self._heap)
+            if self._expiries.get(path) != expires:
+                continue
+            del self._expiries[path]
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self._stats['expired'] += removed
+        return removed
+
+    def sweep_orphans(self) -> int:
+        """
+        Removes the files older than `ttl` seconds that are not tracked, left by
+        a worker process that died. The files of the other running workers are
+        younger than that.
+
+        Returns:
+            int: The number of files removed.
+        """
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.path not in self._expiries and entry.stat().st_mtime < time.time() - self.ttl:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error removing the temporary files: {e}")
+
+    def start(self) -> int:
+        """
+        Removes the orphans and starts the task that removes the expired files.
+
+        Returns:
+            int: The number of orphans removed.
+        """
+        removed = self.sweep_orphans()
+        self._task = asyncio.create_task(self._run())
+        return removed
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.sweep(now=float('inf'))
+
+    def stats(self) -> dict:
+        return {'tracked': len(self._expiries), **self._stats}
+
+
+temp_artifacts = TempArtifacts()
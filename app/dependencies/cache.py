@@ -0,0 +1,232 @@
+# APP
+from app.DB.db import BASE_DIR
+# Python
+from collections import OrderedDict
+from typing import Any, Optional
+import tempfile
+import hashlib
+import shutil
+import time
+import os
+
+RENDER_CACHE_DIR = os.getenv('RENDER_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'renders'))
+RENDER_CACHE_MAX_MB = int(os.getenv('RENDER_CACHE_MAX_MB', 256))
+STAGE_CACHE_DIR = os.getenv('STAGE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'stages'))
+STAGE_CACHE_MAX_MB = int(os.getenv('STAGE_CACHE_MAX_MB', 512))
+# Seconds an entry is kept after its last use whatever the size of the cache
+RENDER_CACHE_HOLD = float(os.getenv('RENDER_CACHE_HOLD', 60))
+# Files being written, the entries are named after their key (hex) and suffix
+TEMP_PREFIX = 'tmp'
+
+
+class RenderCache:
+    """
+    Size-bounded LRU of files on a local directory shared by every worker.
+
+    The files are named after their key and their mtime is their last use, so
+    all the workers agree on the recency of the entries. Each worker counts
+    the size of the directory from its last scan plus what it wrote since, and
+    scans the directory again before evicting and every 1/8 of `max_bytes`
+    written, so the entries of every worker count towards `max_bytes`.
+
+    Entries used in the last `hold` seconds are never evicted, the paths
+    returned by `get` stay valid while their response is sent. The directory
+    can go over `max_bytes` for as long as that.
+
+    The files get `suffix` unless another one is given for an entry (e.g. the
+    extension of its format), the same one must be given to find it again.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = '.png',
+                 hold: float = RENDER_CACHE_HOLD) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hold = hold
+        self.hits = 0
+        self.misses = 0
+        self._entries = 0
+        self._size = 0
+        self._written = 0  # Bytes written by this worker since the last scan
+        os.makedirs(self.directory, exist_ok=True)
+        self._evict()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Returns a key for the given parts, they must be already normalized
+        (e.g. colors as hex) so equal renders get equal keys.
+        """
+        text = '|'.join('' if part is None else str(part) for part in parts)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            # evicted by another worker
+            return False
+
+    def _scan(self) -> list:
+        """
+        Returns the (mtime, path, size) of every entry on the directory, least
+        recently used first, and removes the leftovers of interrupted puts.
+        """
+        entries = []
+        expired = time.time() - self.hold
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if not entry.name.startswith(TEMP_PREFIX):
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+            elif stat.st_mtime < expired:
+                # the puts of the other workers in progress are recent
+                self._remove(entry.path)
+        entries.sort()
+        self._entries = len(entries)
+        self._size = sum(size for _, _, size in entries)
+        self._written = 0
+        return entries
+
+    def path(self, key: str, suffix: Optional[str] = None) -> str:
+        return os.path.join(self.directory, key + (self.suffix if suffix is None else suffix))
+
+    def get(self, key: str, suffix: Optional[str] = None) -> Optional[str]:
+        """
+        Returns the path of the entry `key` or None if it is not cached.
+        """
+        path = self.path(key, suffix)
+        try:
+            # the last use, for every worker
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key: str, src_path: str, suffix: Optional[str] = None) -> str:
+        """
+        Copies the file `src_path` into the cache as the entry `key`.
+
+        Returns:
+            str: The path of the cached entry.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=TEMP_PREFIX)
+        with os.fdopen(fd, 'wb') as f, open(src_path, 'rb') as src:
+            shutil.copyfileobj(src, f)
+        return self._commit(key, temp_path, suffix)
+
+    def put_bytes(self, key: str, data: bytes, suffix: Optional[str] = None) -> str:
+        """
+        Writes `data` into the cache as the entry `key`.
+
+        Returns:
+            str: The path of the cached entry.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=TEMP_PREFIX)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self._commit(key, temp_path, suffix)
+
+    def _commit(self, key: str, temp_path: str, suffix: Optional[str]) -> str:
+        path = self.path(key, suffix)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        self._entries += 1
+        self._size += size
+        self._written += size
+        if self._size > self.max_bytes or self._written > self.max_bytes // 8:
+            self._evict()
+        return path
+
+    def delete(self, key: str, suffix: Optional[str] = None) -> None:
+        path = self.path(key, suffix)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        if self._remove(path):
+            self._entries -= 1
+            self._size -= size
+
+    def _evict(self) -> None:
+        held = time.time() - self.hold
+        for mtime, path, size in self._scan():
+            if self._size <= self.max_bytes or self._entries <= 1 or mtime > held:
+                break
+            if self._remove(path):
+                self._entries -= 1
+                self._size -= size
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': self._entries,
+            'size_bytes': self._size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class TTLCache:
+    """
+    In-memory LRU of at most `max_items` entries that expire `ttl` seconds
+    after being set. Every worker process has its own, so the entries must be
+    dropped with `pop` when their source changes and `ttl` bounds how stale the
+    other workers can be.
+    """
+
+    def __init__(self, max_items: int, ttl: float) -> None:
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Any, tuple]' = OrderedDict()
+
+    def get(self, key) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        """
+        Caches `value` as `key` for `ttl` seconds, or the `ttl` of the cache if
+        it is None or longer.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'max_items': self.max_items,
+        }
+
+
+render_cache = RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_MB * 1024 * 1024)
+# Segmented faces (face crop with the rembg matte as alpha) by render id
+stage_cache = RenderCache(STAGE_CACHE_DIR, STAGE_CACHE_MAX_MB * 1024 * 1024)
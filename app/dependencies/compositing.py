@@ -0,0 +1,168 @@
+# Python
+from PIL import Image, ImageDraw, ImageFilter
+from functools import lru_cache
+from typing import Optional, Tuple
+import numpy as np
+import os
+
+RGB = Tuple[int, int, int]
+
+# Width of the border and of the edge blur, in thousandths of the picture side
+BORDER_WIDTH = 25
+BLUR = 30
+# Picture sizes whose gradient and masks are kept, the qualities and a few fullsizes
+COMPOSITING_CACHE_SIZE = int(os.getenv('COMPOSITING_CACHE_SIZE', 16))
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    # the cached fields are shared by every render of their size
+    array.setflags(write=False)
+    return array
+
+
+def circle_mask(size: Tuple[int, int], inset: float = 0) -> Image.Image:
+    width, height = size
+    mask = Image.new('L', size, 0)
+    ImageDraw.Draw(mask).ellipse((inset, inset, width - 1 - inset, height - 1 - inset), fill=255)
+    return mask
+
+
+def edge_width(size: Tuple[int, int], thousandths: int) -> int:
+    return max(1, min(size) * thousandths // 1000)
+
+
+@lru_cache(maxsize=COMPOSITING_CACHE_SIZE)
+def gradient_field(width: int, height: int) -> np.ndarray:
+    """
+    Position of every pixel on the radial gradient, 0 on the center and 1 on
+    the inscribed circle and outside it.
+
+    Returns:
+        np.ndarray: float32 array of shape (height, width).
+    """
+    y, x = np.ogrid[:height, :width]
+    distance = np.hypot(np.float32(x - (width - 1) / 2), np.float32(y - (height - 1) / 2))
+    return _frozen(np.clip(distance / np.float32(min(width, height) / 2), 0, 1))
+
+
+@lru_cache(maxsize=COMPOSITING_CACHE_SIZE)
+def contour_mask(width: int, height: int) -> np.ndarray:
+    return _frozen(np.asarray(circle_mask((width, height))).copy())
+
+
+@lru_cache(maxsize=COMPOSITING_CACHE_SIZE)
+def ring_pixels(width: int, height: int, inset: int) -> np.ndarray:
+    """
+    Flat indices of the pixels of the border drawn `inset` pixels inside the
+    circle, indexing with them is several times faster than with a mask.
+    """
+    ring = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(ring).ellipse((inset, inset, width - 1 - inset, height - 1 - inset),
+                                 outline=255, width=edge_width((width, height), BORDER_WIDTH))
+    return _frozen(np.flatnonzero(np.asarray(ring)))
+
+
+@lru_cache(maxsize=COMPOSITING_CACHE_SIZE)
+def blur_mask(width: int, height: int, blur: int) -> np.ndarray:
+    radius = edge_width((width, height), blur)
+    mask = circle_mask((width, height), inset=radius / 2).filter(ImageFilter.GaussianBlur(radius / 4))
+    return _frozen(np.asarray(mask).copy())
+
+
+@lru_cache(maxsize=COMPOSITING_CACHE_SIZE)
+def composed_alpha(width: int, height: int, border_inset: Optional[int]) -> np.ndarray:
+    """
+    Alpha of a composed picture: the contour, the border if `border_inset` is
+    given, and the blur of the edge.
+    """
+    alpha = contour_mask(width, height).copy()
+    if border_inset is not None:
+        alpha.reshape(-1)[ring_pixels(width, height, border_inset)] = 255
+    np.minimum(alpha, blur_mask(width, height, BLUR), out=alpha)
+    return _frozen(alpha)
+
+
+def _over_gradient(face: np.ndarray, center: RGB, outer: RGB, out: np.ndarray) -> None:
+    """
+    Writes on `out` the RGB of the RGBA `face` put over the gradient from
+    `center` to `outer`. Works one channel at a time, numpy is much slower on
+    the last axis of 3 items of an RGB array than on whole planes.
+    """
+    height, width = face.shape[:2]
+    gradient = gradient_field(width, height)
+    alpha = face[..., 3].astype(np.uint16)
+    inverse = 255 - alpha
+    background = np.empty((height, width), np.float32)
+    blend = np.empty((height, width), np.uint16)
+    weighted = np.empty((height, width), np.uint16)
+    for channel in range(3):
+        np.multiply(gradient, np.float32(outer[channel] - center[channel]), out=background)
+        background += np.float32(center[channel])
+        # the background is 8 bits before the face is put over it
+        np.multiply(background.astype(np.uint16), inverse, out=weighted)
+        np.multiply(face[..., channel], alpha, out=blend, dtype=np.uint16)
+        blend += weighted
+        # rounded division by 255, 255 * 255 fits on 16 bits
+        blend += 127
+        blend //= 255
+        out[..., channel] = blend
+
+
+def add_background(face: Image.Image, center: RGB, outer: RGB) -> Image.Image:
+    """
+    Puts the RGBA `face` over a radial gradient from `center` to `outer`.
+    """
+    face = np.asarray(face.convert('RGBA'))
+    picture = np.empty(face.shape, np.uint8)
+    _over_gradient(face, center, outer, picture)
+    picture[..., 3] = 255
+    return Image.fromarray(picture, 'RGBA')
+
+
+def set_contour(picture: Image.Image) -> Image.Image:
+    """
+    Makes everything outside the circle inscribed in `picture` transparent.
+    """
+    picture = np.array(picture.convert('RGBA'))
+    picture[..., 3] = contour_mask(picture.shape[1], picture.shape[0])
+    return Image.fromarray(picture, 'RGBA')
+
+
+def set_border(picture: Image.Image, color: RGB, inset: int = 0) -> Image.Image:
+    """
+    Draws a ring of `color` along the edge of the circle, `inset` pixels inside it.
+    """
+    picture = np.array(picture.convert('RGBA'))
+    picture.reshape(-1, 4)[ring_pixels(picture.shape[1], picture.shape[0], inset)] = color + (255,)
+    return Image.fromarray(picture, 'RGBA')
+
+
+def set_blur(picture: Image.Image, blur: int = BLUR) -> Image.Image:
+    """
+    Softens the edge of the circle with a gaussian blur of its alpha channel.
+    """
+    picture = np.array(picture.convert('RGBA'))
+    alpha = picture[..., 3]
+    np.minimum(alpha, blur_mask(picture.shape[1], picture.shape[0], blur), out=alpha)
+    return Image.fromarray(picture, 'RGBA')
+
+
+def compose(face: Image.Image,
+            colors: Tuple[RGB, RGB],
+            border: Optional[RGB] = None) -> Image.Image:
+    """
+    Runs the compositing steps over a segmented face: background, contour,
+    border and blur, in a single pass. Same result as running `add_background`,
+    `set_contour`, `set_border` and `set_blur` one after the other, but the
+    masks of the contour, border and blur are merged once per picture size.
+    """
+    face = np.asarray(face.convert('RGBA'))
+    height, width = face.shape[:2]
+    # inside the edge that the blur fades out
+    inset = edge_width((width, height), BLUR) // 2 if border is not None else None
+    picture = np.empty(face.shape, np.uint8)
+    _over_gradient(face, colors[0], colors[1], picture)
+    if border is not None:
+        picture.reshape(-1, 4)[ring_pixels(width, height, inset), :3] = border
+    picture[..., 3] = composed_alpha(width, height, inset)
+    return Image.fromarray(picture, 'RGBA')
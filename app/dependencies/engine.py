@@ -0,0 +1,171 @@
+# Python
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+import multiprocessing
+import asyncio
+import weakref
+import os
+
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1))
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', 32))  # Jobs waiting or running
+RENDER_JOB_TIMEOUT = float(os.getenv('RENDER_JOB_TIMEOUT', 60))  # Seconds
+RENDER_MAX_JOBS_PER_WORKER = int(os.getenv('RENDER_MAX_JOBS_PER_WORKER', 200))
+# Forking a process that already runs the threads of onnxruntime or of the
+# event loop can deadlock the children, the workers start from scratch
+RENDER_START_METHOD = os.getenv('RENDER_START_METHOD', 'spawn')
+
+
+class EngineBusyException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class RenderTimeoutException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class RenderCrashedException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class RenderEngine:
+    """
+    Runs CPU-heavy picture jobs on a process pool so the event loop stays free.
+
+    The number of jobs waiting or running is bounded by `queue_size`, every job
+    is limited to `job_timeout` seconds and the whole pool is replaced after its
+    workers have processed `max_jobs_per_worker` jobs each on average, which
+    releases the memory that image libraries tend to keep around.
+
+    The workers are started with `start_method`, with `spawn` (the default)
+    they import only what their jobs need.
+
+    A job that times out takes its whole pool down, the other jobs running on
+    it are submitted once more to the new pool.
+    """
+
+    def __init__(self,
+                 workers: int = RENDER_WORKERS,
+                 queue_size: int = RENDER_QUEUE_SIZE,
+                 job_timeout: float = RENDER_JOB_TIMEOUT,
+                 max_jobs_per_worker: int = RENDER_MAX_JOBS_PER_WORKER,
+                 initializer: Optional[Callable] = None,
+                 start_method: str = RENDER_START_METHOD) -> None:
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max(1, max_jobs_per_worker)
+        self.initializer = initializer
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # pools killed after a timeout, their other jobs did nothing wrong
+        self._terminated: 'weakref.WeakSet[ProcessPoolExecutor]' = weakref.WeakSet()
+        self._jobs_submitted = 0
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(self.start_method),
+                                                 initializer=self.initializer)
+            self._jobs_submitted = 0
+        return self._executor
+
+    def _recycle(self, executor: ProcessPoolExecutor, terminate: bool = False) -> None:
+        """
+        Replaces `executor` by a fresh pool on the next submission. Jobs already
+        running on the old pool are allowed to finish, unless `terminate` is
+        set: then its processes are killed, a stuck job would keep its worker
+        busy forever otherwise.
+        """
+        if terminate:
+            self._terminated.add(executor)
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False)
+
+    async def run(self, func: Callable, *args):
+        """
+        Runs `func(*args)` on a worker process and returns its result.
+
+        Raises:
+            EngineBusyException: If the queue of pending jobs is full.
+            RenderTimeoutException: If the job takes more than `job_timeout` seconds.
+            RenderCrashedException: If the worker of the job died.
+        """
+        if self._pending >= self.queue_size:
+            raise EngineBusyException(
+                "The server is busy processing other pictures. Try again later")
+        self._pending += 1
+        try:
+            resubmitted = False
+            while True:
+                executor = self._get_executor()
+                future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+                self._jobs_submitted += 1
+                if self._jobs_submitted >= self.workers * self.max_jobs_per_worker:
+                    self._recycle(executor)
+                try:
+                    return await asyncio.wait_for(future, timeout=self.job_timeout)
+                except asyncio.TimeoutError:
+                    # the worker is stuck on this job, its pool is killed and new
+                    # jobs go to a fresh one
+                    self._recycle(executor, terminate=True)
+                    raise RenderTimeoutException(
+                        f"The picture took more than {self.job_timeout} seconds to process")
+                except BrokenProcessPool:
+                    self._recycle(executor)
+                    if executor in self._terminated and not resubmitted:
+                        # killed because of the timeout of another job
+                        resubmitted = True
+                        continue
+                    raise RenderCrashedException(
+                        "The picture could not be processed, a render worker stopped. Try again later")
+        finally:
+            self._pending -= 1
+
+    async def start(self) -> list:
+        """
+        Starts the workers and waits for their initializer, so the first
+        request does not pay for it.
+
+        Returns:
+            list: The `sessions.load_stats()` of every worker that answered.
+        """
+        stats = await asyncio.gather(*(self.run(load_stats)
+                                       for _ in range(min(self.workers, self.queue_size))))
+        return list({stat['pid']: stat for stat in stats}.values())
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+def preload() -> None:
+    """
+    Initializer of the render workers, loads their rembg sessions. rembg and
+    onnxruntime are only imported here, never on the API process.
+    """
+    from app.dependencies import sessions
+    sessions.preload()
+
+
+def load_stats() -> dict:
+    from app.dependencies import sessions
+    return sessions.load_stats()
+
+
+render_engine = RenderEngine(initializer=preload)
@@ -0,0 +1,146 @@
+# OpenCV
+import cv2
+# Python
+from PIL import Image, ImageOps
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+import numpy as np
+import math
+import os
+
+# Side of the square crop around a face, relative to the side of the detected box
+FACE_MARGIN = 2.0
+# Faces are detected on a copy of the upload that fits in this size
+FACE_PROXY_MAX_SIDE = int(os.getenv('FACE_PROXY_MAX_SIDE', 1024))  # Pixels
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+_cascade = None
+
+
+class Box(NamedTuple):
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+    def scale(self, factor: float) -> 'Box':
+        return Box(*(round(value * factor) for value in self))
+
+
+def _get_cascade() -> cv2.CascadeClassifier:
+    global _cascade
+    if _cascade is None:
+        _cascade = cv2.CascadeClassifier(cv2.data.haarcascades +
+                                         'haarcascade_frontalface_default.xml')
+    return _cascade
+
+
+def oriented_size(image: Image.Image) -> Tuple[int, int]:
+    """
+    Returns the size of `image` once its EXIF rotation is applied, without decoding it.
+    """
+    if image.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+        return image.height, image.width
+    return image.size
+
+
+def open_oriented(path: str, min_size: Optional[Tuple[int, int]] = None, mode: str = 'RGB') -> Image.Image:
+    """
+    Decodes the picture on `path` with its EXIF rotation applied. JPEGs are
+    decoded at the smallest 1/2, 1/4 or 1/8 scale still bigger than `min_size`
+    (in oriented coordinates), which is much faster than a full decode.
+    """
+    image = Image.open(path)
+    if min_size is not None and image.format == 'JPEG':
+        if image.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+            min_size = (min_size[1], min_size[0])
+        image.draft(mode, min_size)
+    return ImageOps.exif_transpose(image).convert(mode)
+
+
+def detect_faces(image: Image.Image) -> List[Box]:
+    """
+    Detects the faces of `image` and returns the square crop of every face, left
+    to right, in the coordinates of `image`.
+    """
+    gray = np.asarray(image.convert('L'))
+    found = _get_cascade().detectMultiScale(gray,
+                                            scaleFactor=1.1,
+                                            minNeighbors=5,
+                                            minSize=(30, 30))
+    boxes = [face_crop_box(int(x), int(y), int(w), int(h), image.width, image.height)
+             for (x, y, w, h) in found]
+    return sorted(boxes, key=lambda box: box.left)
+
+
+def detect_faces_proxy(path: str, max_side: int = FACE_PROXY_MAX_SIDE) -> List[Box]:
+    """
+    Detects the faces of the picture on `path` on a downsampled proxy of at most
+    `max_side` pixels and maps the boxes back to the full resolution.
+    """
+    with Image.open(path) as image:
+        full_width, full_height = oriented_size(image)
+    scale = min(1, max_side / max(full_width, full_height))
+    proxy = open_oriented(path,
+                          (math.ceil(full_width * scale), math.ceil(full_height * scale)),
+                          mode='L')
+    if max(proxy.size) > max_side:
+        proxy.thumbnail((max_side, max_side), Image.BILINEAR)
+    boxes = [box.scale(full_width / proxy.width) for box in detect_faces(proxy)]
+    return [Box(max(0, box.left), max(0, box.top), min(full_width, box.right), min(full_height, box.bottom))
+            for box in boxes]
+
+
+def crop_face(path: str, box: Box, size: Optional[int] = None) -> Image.Image:
+    """
+    Crops `box` (full resolution coordinates) from the picture on `path` and
+    resizes it to `size` pixels wide. Only the scale needed for `size` is decoded.
+    """
+    with Image.open(path) as image:
+        full_width, full_height = oriented_size(image)
+    box_width = box.right - box.left
+    if size is None or size >= box_width:
+        image = open_oriented(path)
+    else:
+        scale = size / box_width
+        image = open_oriented(path, (math.ceil(full_width * scale), math.ceil(full_height * scale)))
+    face = image.crop(box.scale(image.width / full_width))
+    if size is not None and face.width != size:
+        face = face.resize((size, round(face.height * size / face.width)), Image.LANCZOS)
+    return face
+
+
+class LazyFaces(Sequence):
+    """
+    The faces detected on the picture on `path`. Detection only gives boxes,
+    the crop of a face is decoded when it is indexed, so the faces that are
+    not used cost nothing.
+    """
+
+    def __init__(self, path: str, size: Optional[int] = None,
+                 max_side: int = FACE_PROXY_MAX_SIDE) -> None:
+        self.path = path
+        self.size = size
+        self.boxes = detect_faces_proxy(path, max_side)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Image.Image, List[Image.Image]]:
+        if isinstance(index, slice):
+            return [crop_face(self.path, box, self.size) for box in self.boxes[index]]
+        return crop_face(self.path, self.boxes[index], self.size)
+
+
+def face_crop_box(x: int, y: int, w: int, h: int, width: int, height: int) -> Box:
+    """
+    Returns the square around the face box (x, y, w, h) scaled by FACE_MARGIN.
+    Near the edges of an image of `width` x `height` the square is moved to
+    stay inside it, it is only made smaller when the image is, never smaller
+    than the face.
+    """
+    side = int(min(max(w, h) * FACE_MARGIN, width, height))
+    left = min(max(0, int(x + w / 2 - side / 2)), width - side)
+    top = min(max(0, int(y + h / 2 - side / 2)), height - side)
+    return Box(left, top, left + side, top + side)
@@ -0,0 +1,84 @@
+# FastAPI
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+# APP
+from app.dependencies.artifacts import temp_artifacts
+# Python
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, NamedTuple, Tuple
+import hashlib
+import os
+
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+
+class UploadTooLargeException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class SpooledUpload(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+
+
+def too_large(limit_bytes: int) -> UploadTooLargeException:
+    return UploadTooLargeException(f'File size is too large, the limit is {limit_bytes // (1024 * 1024)}MB')
+
+
+def copy_upload(src: BinaryIO, fd: int, limit_bytes: int) -> Tuple[str, int]:
+    """
+    Copies `src` to the file `fd` chunk by chunk and hashes it on the way.
+
+    Returns:
+        Tuple[str, int]: The sha256 and the size of the copy.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    src.seek(0)
+    with os.fdopen(fd, 'wb') as f:
+        while chunk := src.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > limit_bytes:
+                raise too_large(limit_bytes)
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest(), size
+
+
+async def spool_upload(pic_file: UploadFile, limit_bytes: int) -> SpooledUpload:
+    """
+    Copies an upload to a temporary file the render workers can open, hashing
+    it on the way. The upload is already spooled by Starlette to an anonymous
+    file, so it is copied on a thread and not on the event loop. At most one
+    chunk is held in memory and the copy stops as soon as the upload is bigger
+    than `limit_bytes`. The file is removed by `temp_artifacts` if it is not
+    released before TEMP_TTL.
+
+    Raises:
+        UploadTooLargeException: If the upload is bigger than `limit_bytes`.
+    """
+    if pic_file.size is not None and pic_file.size > limit_bytes:
+        raise too_large(limit_bytes)
+    suffix = '.'+pic_file.filename.split(".")[-1]
+    fd, path = temp_artifacts.new_file(suffix=suffix)
+    try:
+        sha256, size = await run_in_threadpool(copy_upload, pic_file.file, fd, limit_bytes)
+    except BaseException:
+        temp_artifacts.release(path)
+        raise
+    return SpooledUpload(path, sha256, size)
+
+
+@asynccontextmanager
+async def spooled_upload(pic_file: UploadFile, limit_bytes: int) -> AsyncIterator[SpooledUpload]:
+    """
+    Context manager version of `spool_upload`, the file is removed on exit.
+    """
+    upload = await spool_upload(pic_file, limit_bytes)
+    try:
+        yield upload
+    finally:
+        temp_artifacts.release(upload.path)
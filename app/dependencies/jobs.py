@@ -0,0 +1,264 @@
+# APP
+from app.DB import db as database
+from app.DB.querys_pictures import RenderJobDB
+from app.models.picture import JobStatus, QualityType, RenderJob
+from app.models.user import User, UserClaims
+from app.dependencies.engine import EngineBusyException, RenderCrashedException, RenderTimeoutException
+from app.dependencies.ingest import SpooledUpload
+from app.dependencies.service import MakePicture, NoFaceException, FaceIndexException
+# FastAPI
+from fastapi.concurrency import run_in_threadpool
+# SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+# Python
+from pydantic.color import Color
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Union
+from uuid import UUID
+import asyncio
+import shutil
+import time
+import os
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))  # Jobs rendered at the same time
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', 100))  # Jobs waiting
+JOB_BUSY_RETRY = 1  # Seconds to wait when the render engine is busy
+JOBS_DIR = os.getenv('JOBS_DIR', os.path.join(database.BASE_DIR, 'cache', 'jobs'))
+# Jobs RUNNING for longer are taken as lost by a stopped app process
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 600))  # Seconds
+
+
+class JobQueueFullException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+def move_upload(path: str, job_path: str) -> None:
+    os.makedirs(os.path.dirname(job_path), exist_ok=True)
+    shutil.move(path, job_path)
+
+
+def remove_upload(job_path: str) -> None:
+    if os.path.exists(job_path):
+        os.remove(job_path)
+
+
+class JobQueue:
+    """
+    Renders user pictures in the background. The jobs live on the RenderJob
+    table, only their ids are queued here, so the jobs that were queued when
+    the app stopped, or running for longer than JOB_STALE_AFTER, are queued
+    again by `start`.
+
+    `workers` tasks take jobs from the queue and run them through the render
+    engine, which keeps the CPU work off the event loop. Every app process has
+    its own queue, a job queued on several of them is run by the one that
+    claims it first on the DB.
+    """
+
+    def __init__(self,
+                 workers: int = JOB_WORKERS,
+                 queue_size: int = JOB_QUEUE_SIZE,
+                 session_factory: Optional[Callable[[], AsyncSession]] = None,
+                 stale_after: float = JOB_STALE_AFTER) -> None:
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.stale_after = stale_after
+        self.session_factory = session_factory or (lambda: AsyncSession(database.async_engine,
+                                                                        expire_on_commit=False))
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._finished: Dict[UUID, asyncio.Event] = {}
+        self._stats = {'submitted': 0, 'done': 0, 'failed': 0,
+                       'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                       'run_seconds': 0.0, 'max_run_seconds': 0.0}
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> int:
+        """
+        Starts the worker tasks and queues again the QUEUED jobs and the stale
+        RUNNING ones. The RUNNING jobs of the other app processes are left alone.
+
+        Returns:
+            int: The number of jobs queued again.
+        """
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        async with self.session_factory() as db:
+            jobs = await RenderJobDB.requeue_stale_jobs_async(datetime.now() - timedelta(seconds=self.stale_after),
+                                                              db)
+        for job in jobs:
+            self._queue.put_nowait(job.id)
+        return len(jobs)
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def create_job(self,
+                         db: AsyncSession,
+                         user: Union[User, UserClaims],
+                         upload: SpooledUpload,
+                         colorsModel: tuple[Color],
+                         BorderColor: Optional[Color] = None,
+                         quality: QualityType = QualityType.PREVIEW,
+                         index: int = 0) -> RenderJob:
+        """
+        Moves the upload to JOBS_DIR, saves its job on the DB and queues it.
+        If it can't be queued the job is saved as FAILED.
+
+        Raises:
+            JobQueueFullException: If there are `queue_size` jobs waiting.
+        """
+        if self.depth >= self.queue_size:
+            raise JobQueueFullException("Too many pictures waiting to be rendered, try again later")
+        job = RenderJob(user_id=user.id,
+                        quality=quality,
+                        colorCenter=Color(colorsModel[0]).as_hex(),
+                        colorOuter=Color(colorsModel[1]).as_hex(),
+                        colorBorder=Color(BorderColor).as_hex() if BorderColor is not None else None,
+                        face_index=index,
+                        upload_path='',
+                        upload_sha256=upload.sha256)
+        job.upload_path = os.path.join(JOBS_DIR, f'{job.id}{os.path.splitext(upload.path)[1]}')
+        await run_in_threadpool(move_upload, upload.path, job.upload_path)
+        if await RenderJobDB.add_job_toDB_async(job, db) is None:
+            await run_in_threadpool(remove_upload, job.upload_path)
+            raise Exception("The render job could not be saved")
+        try:
+            self.submit(job)
+        except JobQueueFullException as e:
+            # it would wait for the next start otherwise
+            await RenderJobDB.update_job_async(job, db, status=JobStatus.FAILED, endDate=datetime.now(),
+                                               error=e.message, error_code=503)
+            await run_in_threadpool(remove_upload, job.upload_path)
+            raise
+        return job
+
+    def submit(self, job: RenderJob) -> None:
+        """
+        Queues a job already saved on the DB.
+
+        Raises:
+            JobQueueFullException: If there are `queue_size` jobs waiting.
+        """
+        if self._queue is None:
+            raise JobQueueFullException("The render jobs are not running")
+        if self._queue.qsize() >= self.queue_size:
+            raise JobQueueFullException("Too many pictures waiting to be rendered, try again later")
+        self._stats['submitted'] += 1
+        self._queue.put_nowait(job.id)
+
+    async def wait(self, job_id: UUID, timeout: float) -> RenderJob:
+        """
+        Waits until the job is finished or `timeout` seconds passed and returns
+        it. The DB is checked every second too, the job could be running on
+        another worker process of the app.
+        """
+        deadline = time.monotonic() + timeout
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        try:
+            while True:
+                async with self.session_factory() as db:
+                    job = await RenderJobDB.get_job_async(job_id, db)
+                remaining = deadline - time.monotonic()
+                if job is None or job.status in (JobStatus.DONE, JobStatus.FAILED) or remaining <= 0:
+                    return job
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(1, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if not event.is_set():
+                self._finished.pop(job_id, None)
+
+    def stats(self) -> dict:
+        finished = self._stats['done'] + self._stats['failed']
+        return {
+            'workers': self.workers,
+            'depth': self.depth,
+            'queue_size': self.queue_size,
+            **self._stats,
+            'avg_wait_seconds': self._stats['wait_seconds'] / finished if finished else 0.0,
+            'avg_run_seconds': self._stats['run_seconds'] / finished if finished else 0.0,
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Error running the render job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: UUID) -> None:
+        async with self.session_factory() as db:
+            started = datetime.now()
+            job = await RenderJobDB.claim_job_async(job_id, started, db)
+            if job is None:
+                # finished or taken by another worker
+                return
+            user = await db.get(User, job.user_id)
+            wait = (started - job.initDate).total_seconds()
+            values = {}
+            try:
+                if user is None:
+                    # deleted since the job was queued, nobody would own the picture
+                    values = {'status': JobStatus.FAILED,
+                              'error': "The user of the picture does not exist anymore",
+                              'error_code': 410}
+                    return
+                size = await run_in_threadpool(os.path.getsize, job.upload_path)
+                while True:
+                    try:
+                        render = await MakePicture(user).make_user_picture(
+                            db=db,
+                            upload=SpooledUpload(job.upload_path, job.upload_sha256, size),
+                            colorsModel=(Color(job.colorCenter), Color(job.colorOuter)),
+                            BorderColor=Color(job.colorBorder) if job.colorBorder is not None else None,
+                            quality=job.quality,
+                            index=job.face_index)
+                        break
+                    except EngineBusyException:
+                        await asyncio.sleep(JOB_BUSY_RETRY)
+                values = {'status': JobStatus.DONE,
+                          'filename': render.content_key,
+                          'render_id': render.render_id}
+            except NoFaceException as e:
+                values = {'status': JobStatus.FAILED, 'error': e.message, 'error_code': 409}
+            except FaceIndexException as e:
+                values = {'status': JobStatus.FAILED, 'error': e.message, 'error_code': 422}
+            except RenderTimeoutException as e:
+                values = {'status': JobStatus.FAILED, 'error': e.message, 'error_code': 504}
+            except RenderCrashedException as e:
+                values = {'status': JobStatus.FAILED, 'error': e.message, 'error_code': 503}
+            except Exception as e:
+                print(str(e))
+                values = {'status': JobStatus.FAILED,
+                          'error': "there was an error processing your request. Try again later",
+                          'error_code': 500}
+            finally:
+                ended = datetime.now()
+                if values:
+                    await RenderJobDB.update_job_async(job, db, endDate=ended, **values)
+                    await run_in_threadpool(remove_upload, job.upload_path)
+                    self._record(values['status'], wait, (ended - started).total_seconds())
+                    self._finished.pop(job_id, asyncio.Event()).set()
+
+    def _record(self, status: JobStatus, wait: float, run: float) -> None:
+        self._stats['done' if status == JobStatus.DONE else 'failed'] += 1
+        self._stats['wait_seconds'] += wait
+        self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], wait)
+        self._stats['run_seconds'] += run
+        self._stats['max_run_seconds'] = max(self._stats['max_run_seconds'], run)
+
+
+job_queue = JobQueue()
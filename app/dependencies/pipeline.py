@@ -0,0 +1,230 @@
+# APP
+from app.models.picture import PictureFormat, QualityType
+from app.dependencies import compositing, faces
+# Python
+from pydantic.color import Color
+from PIL import Image, ImageOps
+from typing import List, NamedTuple, Optional, Union
+import math
+import io
+
+# Width in pixels of each quality, FULLSIZE keeps the size of the face found
+QUALITY_SIZES = {
+    QualityType.THUMBNAIL: 150,
+    QualityType.PREVIEW: 300,
+    QualityType.MEDIUM: 600,
+    QualityType.HIGH: 1000,
+}
+
+
+
+class EncodeProfile(NamedTuple):
+    png_level: int  # zlib level, 1 is the fastest and 9 the smallest
+    webp_quality: int
+    webp_lossless: bool
+    webp_method: int  # 0 is the fastest and 6 the smallest
+    jpeg_quality: int
+
+
+# Small pictures are cheap to compress hard, the big ones take most of the
+# encode time at high levels for a few percent of size. WebP method 6 is
+# several times slower than 4 for ~10% less, it is not used. FULLSIZE is the
+# picture without loss, its WebP is lossless: ~10x the lossy size but ~10%
+# under the PNG, and method 0 is about as fast as the lossy one
+# (see benchmarks/bench_encode.py)
+ENCODE_PROFILES = {
+    QualityType.THUMBNAIL: EncodeProfile(png_level=6, webp_quality=82, webp_lossless=False, webp_method=4, jpeg_quality=85),
+    QualityType.PREVIEW: EncodeProfile(png_level=6, webp_quality=82, webp_lossless=False, webp_method=4, jpeg_quality=85),
+    QualityType.MEDIUM: EncodeProfile(png_level=3, webp_quality=85, webp_lossless=False, webp_method=2, jpeg_quality=88),
+    QualityType.HIGH: EncodeProfile(png_level=2, webp_quality=85, webp_lossless=False, webp_method=1, jpeg_quality=90),
+    QualityType.FULLSIZE: EncodeProfile(png_level=1, webp_quality=88, webp_lossless=True, webp_method=0, jpeg_quality=92),
+}
+# Intermediate pictures (the faces of the stage cache) favor speed
+INTERMEDIATE_PNG_LEVEL = 1
+# JPEG has no alpha, the transparent parts get this color
+JPEG_BACKGROUND = (255, 255, 255)
+
+# The functions of this module run on the worker processes of the RenderEngine,
+# their arguments and results must be picklable. Pictures travel between them
+# as encoded PNG bytes and every stage works on decoded images in memory, the
+# only files read are the spooled upload and the stage cache.
+
+
+class NoFaceException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class FaceIndexException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+def decode(source: Union[str, bytes]) -> Image.Image:
+    """
+    Decodes a picture from a path or from its bytes, applying its EXIF rotation.
+    """
+    image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+    return ImageOps.exif_transpose(image)
+
+
+def quality_of(image: Image.Image) -> QualityType:
+    """
+    Returns the smallest quality that is as wide as `image`.
+    """
+    for quality, size in sorted(QUALITY_SIZES.items(), key=lambda item: item[1]):
+        if image.width <= size:
+            return quality
+    return QualityType.FULLSIZE
+
+
+def encode(image: Image.Image,
+           format: PictureFormat = PictureFormat.PNG,
+           profile: Optional[EncodeProfile] = None,
+           png_level: Optional[int] = None) -> bytes:
+    """
+    Encodes a picture with the profile of its quality, unless `profile` is given.
+    """
+    profile = profile or ENCODE_PROFILES[quality_of(image)]
+    buffer = io.BytesIO()
+    if format == PictureFormat.WEBP:
+        image.save(buffer, format='WEBP', quality=profile.webp_quality,
+                   lossless=profile.webp_lossless, method=profile.webp_method)
+    elif format == PictureFormat.JPEG:
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, JPEG_BACKGROUND)
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        image.save(buffer, format='JPEG', quality=profile.jpeg_quality)
+    else:
+        image.save(buffer, format='PNG',
+                   compress_level=profile.png_level if png_level is None else png_level)
+    return buffer.getvalue()
+
+
+def transcode(picture: Union[str, bytes], format: PictureFormat) -> bytes:
+    """
+    Encodes a rendered PNG picture as `format`.
+    """
+    return encode(decode(picture), format)
+
+
+def resize_to_quality(image: Image.Image, quality: QualityType) -> Image.Image:
+    size = QUALITY_SIZES.get(quality)
+    if size is None or size == image.width:
+        return image
+    return image.resize((size, round(image.height * size / image.width)), Image.LANCZOS)
+
+
+def largest_quality(qualities: List[QualityType]) -> QualityType:
+    """
+    Returns the biggest of `qualities`, FULLSIZE is bigger than all of them.
+    """
+    return max(qualities, key=lambda quality: QUALITY_SIZES.get(quality, math.inf))
+
+
+def remove_background(image: Image.Image) -> Image.Image:
+    # rembg is imported by the workers that use it, see engine.preload
+    from app.dependencies import sessions
+    from rembg import remove
+    return remove(image, session=sessions.get_session())
+
+
+def segment_face(src_path: str,
+                 quality: QualityType = QualityType.PREVIEW,
+                 index: int = 0) -> bytes:
+    """
+    Detects the faces of the picture on `src_path`, crops the face `index`,
+    resizes it to `quality` and removes its background. These are the expensive
+    steps, their result is kept on the stage cache so other colors only need
+    `compose_face`.
+
+    Returns:
+        bytes: The face as a PNG, the rembg matte is its alpha channel.
+    """
+    return segment_faces(src_path, [quality], index)[0]
+
+
+def segment_faces(src_path: str,
+                  qualities: List[QualityType],
+                  index: int = 0) -> List[bytes]:
+    """
+    Like `segment_face` for several qualities at once: the faces are detected
+    once, the face `index` is segmented once at the biggest quality and the
+    smaller ones are downsampled from it. Detection runs on a downsampled proxy
+    and gives boxes, only the face `index` is cropped.
+
+    Returns:
+        List[bytes]: The face as a PNG for every quality, in the same order.
+    """
+    sizes = [QUALITY_SIZES.get(quality) for quality in qualities]
+    biggest = None if None in sizes else max(sizes)
+    detected = faces.LazyFaces(src_path, biggest)
+    if (len(detected) == 0):
+        raise NoFaceException(
+            "No Faces detected in the picture 'image/jpeg'")
+    if index >= len(detected):
+        raise FaceIndexException(
+            f"The face {index + 1} was requested but only {len(detected)} faces were detected")
+    face = remove_background(detected[index])
+    return [encode(resize_to_quality(face, quality), png_level=INTERMEDIATE_PNG_LEVEL) for quality in qualities]
+
+
+def compose_face(segment: Union[str, bytes],
+                 colorsModel: tuple[Color],
+                 BorderColor: Optional[Color] = None) -> bytes:
+    """
+    Adds the background, contour, border and blur to a face from `segment_face`.
+
+    Returns:
+        bytes: The rendered picture as a PNG.
+    """
+    picture = compositing.compose(decode(segment),
+                                  (Color(colorsModel[0]).as_rgb_tuple(alpha=False),
+                                   Color(colorsModel[1]).as_rgb_tuple(alpha=False)),
+                                  Color(BorderColor).as_rgb_tuple(alpha=False) if BorderColor is not None else None)
+    return encode(picture)
+
+
+def compose_faces(jobs: List[tuple]) -> List[bytes]:
+    """
+    Runs `compose_face` for every (segment, colorsModel, BorderColor) of `jobs`
+    in a single worker call.
+    """
+    return [compose_face(*job) for job in jobs]
+
+
+def derive_pictures(picture: Union[str, bytes],
+                    qualities: List[QualityType]) -> List[bytes]:
+    """
+    Downsamples a rendered picture to smaller qualities. The border and blur
+    are relative to the picture side, so a derivative looks like a render at
+    its own quality without running the pipeline again.
+
+    Returns:
+        List[bytes]: The picture as a PNG for every quality, in the same order.
+    """
+    image = decode(picture)
+    return [encode(resize_to_quality(image, quality)) for quality in qualities]
+
+
+def removeBG_picture(src_path: str,
+                     quality: QualityType = QualityType.PREVIEW) -> bytes:
+    """
+    Removes the background of the picture on `src_path`.
+
+    Returns:
+        bytes: The output picture as a PNG.
+    """
+    size = QUALITY_SIZES.get(quality)
+    if size is None:
+        image = faces.open_oriented(src_path)
+    else:
+        with Image.open(src_path) as original:
+            width, height = faces.oriented_size(original)
+        image = resize_to_quality(faces.open_oriented(src_path, (size, math.ceil(height * size / width))),
+                                  quality)
+    return encode(remove_background(image))
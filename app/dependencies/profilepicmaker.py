@@ -0,0 +1,115 @@
+# APP
+from app.models.picture import QualityType
+from app.dependencies.pipeline import QUALITY_SIZES, NoFaceException, FaceIndexException
+# Python
+from pydantic.color import Color
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Union
+import tempfile
+import os
+
+# Adapters of the ProfilePicMaker pipeline (the ProfilePicMaker submodule) with
+# the signatures of the stages of `pipeline`, so the service runs either of
+# them the same way. Like the rest of the stages they run on the render
+# workers, ProfilePicMaker is only imported there. BigPic and FacePic work on
+# files, every picture they save is read back and removed at once.
+
+BLUR = 30
+
+
+def _read_saved(picture) -> bytes:
+    picture.save()
+    path = picture.get_path()
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+@contextmanager
+def _face_pic(source: Union[str, bytes]) -> Iterator:
+    """
+    Yields a FacePic of a picture given as a path or as its bytes, the bytes
+    are on a temporary file until the end of the block.
+    """
+    from ProfilePicMaker.app.models.pictures import FacePic
+    if isinstance(source, str):
+        yield FacePic(path=source)
+        return
+    fd, path = tempfile.mkstemp(suffix='.png')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(source)
+        yield FacePic(path=path)
+    finally:
+        os.remove(path)
+
+
+def segment_face(src_path: str,
+                 quality: QualityType = QualityType.PREVIEW,
+                 index: int = 0) -> bytes:
+    return segment_faces(src_path, [quality], index)[0]
+
+
+def segment_faces(src_path: str,
+                  qualities: List[QualityType],
+                  index: int = 0) -> List[bytes]:
+    """
+    Detects the faces of the picture on `src_path` with BigPic, resizes the
+    face `index` to every quality and removes its background. FacePic resizes
+    in place, the faces are detected again for every quality.
+
+    Returns:
+        List[bytes]: The face as saved by FacePic for every quality, in the same order.
+    """
+    from ProfilePicMaker.app.models.pictures import BigPic
+    segments = []
+    for quality in qualities:
+        faces = BigPic(src_path).get_faces()
+        if (len(faces) == 0):
+            raise NoFaceException(
+                "No Faces detected in the picture 'image/jpeg'")
+        if index >= len(faces):
+            raise FaceIndexException(
+                f"The face {index + 1} was requested but only {len(faces)} faces were detected")
+        face = faces[index]
+        size = QUALITY_SIZES.get(quality)
+        if size is not None:
+            face.resize(size)
+        face.removeBG()
+        segments.append(_read_saved(face))
+    return segments
+
+
+def compose_face(segment: Union[str, bytes],
+                 colorsModel: tuple[Color],
+                 BorderColor: Optional[Color] = None) -> bytes:
+    """
+    Adds the background, contour, border and blur of FacePic to a face from
+    `segment_face`.
+    """
+    with _face_pic(segment) as face:
+        face.addBG((Color(colorsModel[0]), Color(colorsModel[1])))
+        face.set_contour()
+        if BorderColor is not None:
+            face.setBorder(Color(BorderColor))
+        face.setBlur(BLUR)
+        return _read_saved(face)
+
+
+def compose_faces(jobs: List[tuple]) -> List[bytes]:
+    return [compose_face(*job) for job in jobs]
+
+
+def removeBG_picture(src_path: str,
+                     quality: QualityType = QualityType.PREVIEW) -> bytes:
+    """
+    Removes the background of the picture on `src_path` with FacePic.
+    """
+    with _face_pic(src_path) as face:
+        size = QUALITY_SIZES.get(quality)
+        if size is not None:
+            face.resize(size)
+        face.removeBG()
+        return _read_saved(face)
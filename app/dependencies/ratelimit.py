@@ -0,0 +1,344 @@
+# APP
+from app.DB import db as database
+from app.DB.querys_pictures import FreePictureDB
+from app.DB.writer import BatchWriter
+# Python
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import threading
+import asyncio
+import sqlite3
+import time
+import os
+
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'sqlite')  # sqlite, memory or redis
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', os.path.join(database.BASE_DIR, 'cache', 'ratelimit.sqlite'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+RATE_LIMIT_FLUSH_INTERVAL = float(os.getenv('RATE_LIMIT_FLUSH_INTERVAL', 1))  # Seconds
+# Counters not used for longer are read again from the shared backend
+RATE_LIMIT_KEEP = int(os.getenv('RATE_LIMIT_KEEP', 60))  # Seconds
+FREE_PICTURES_WINDOW = 24 * 60 * 60  # Seconds
+
+Counter = Tuple[str, int]  # Key and window
+
+
+class CounterBackend:
+    """
+    Store of the counters of the rate limiter. A counter is the number of hits
+    of a key in a fixed window, `incr` must be atomic for the limiter to be
+    consistent across the processes sharing the backend.
+    """
+
+    def incr(self, key: str, window: int, amount: int, ttl: int) -> int:
+        """
+        Adds `amount` to the counter of `key` in `window` and returns its new
+        value. The counter can be forgotten `ttl` seconds later.
+        """
+        raise NotImplementedError
+
+    def get(self, key: str, windows: Sequence[int]) -> List[int]:
+        raise NotImplementedError
+
+    def incr_many(self, amounts: Dict[Counter, Tuple[int, int]]) -> Dict[Counter, int]:
+        """
+        Adds the (amount, ttl) of every counter and returns their new values.
+        """
+        return {(key, window): self.incr(key, window, amount, ttl)
+                for (key, window), (amount, ttl) in amounts.items()}
+
+    def get_many(self, counters: Iterable[Counter]) -> Dict[Counter, int]:
+        return {(key, window): self.get(key, [window])[0] for key, window in counters}
+
+    def start(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class MemoryBackend(CounterBackend):
+    """
+    Counters on a dict, only consistent inside a single process.
+    """
+
+    def __init__(self) -> None:
+        self._counters: Dict[Tuple[str, int], List[float]] = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def incr(self, key: str, window: int, amount: int, ttl: int) -> int:
+        now = time.time()
+        with self._lock:
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                self._counters = {k: v for k, v in self._counters.items() if v[1] > now}
+            counter = self._counters.setdefault((key, window), [0, now + ttl])
+            counter[0] += amount
+            return int(counter[0])
+
+    def get(self, key: str, windows: Sequence[int]) -> List[int]:
+        with self._lock:
+            return [int(self._counters.get((key, window), (0,))[0]) for window in windows]
+
+
+class SQLiteBackend(CounterBackend):
+    """
+    Counters on a SQLite file, shared by all the workers of the host. Every
+    update is done inside an immediate transaction, which SQLite serializes
+    across processes. Its calls block, use it behind a BatchedBackend.
+    """
+
+    def __init__(self, path: str = RATE_LIMIT_DB) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=5, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        # the counters are not worth an fsync per commit, WAL keeps them consistent
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS counter ('
+                                 'key TEXT NOT NULL, window INTEGER NOT NULL, '
+                                 'count INTEGER NOT NULL, expires REAL NOT NULL, '
+                                 'PRIMARY KEY (key, window))')
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def incr(self, key: str, window: int, amount: int, ttl: int) -> int:
+        return self.incr_many({(key, window): (amount, ttl)})[(key, window)]
+
+    def incr_many(self, amounts: Dict[Counter, Tuple[int, int]]) -> Dict[Counter, int]:
+        now = time.time()
+        counts = {}
+        with self._lock:
+            self._calls += 1
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                if self._calls % 1000 == 0:
+                    self._connection.execute('DELETE FROM counter WHERE expires < ?', (now,))
+                for (key, window), (amount, ttl) in amounts.items():
+                    self._connection.execute('INSERT INTO counter (key, window, count, expires) VALUES (?, ?, ?, ?) '
+                                             'ON CONFLICT (key, window) DO UPDATE SET count = count + excluded.count',
+                                             (key, window, amount, now + ttl))
+                    counts[(key, window)] = self._connection.execute(
+                        'SELECT count FROM counter WHERE key = ? AND window = ?', (key, window)).fetchone()[0]
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return counts
+
+    def get(self, key: str, windows: Sequence[int]) -> List[int]:
+        with self._lock:
+            rows = dict(self._connection.execute(
+                f'SELECT window, count FROM counter WHERE key = ? AND window IN ({",".join("?" * len(windows))})',
+                (key, *windows)).fetchall())
+        return [rows.get(window, 0) for window in windows]
+
+
+class RedisBackend(CounterBackend):
+    """
+    Counters on a Redis-like store, shared by every host using it. Works with
+    any client that has `incrby`, `expire` and `mget`.
+    """
+
+    def __init__(self, client=None) -> None:
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(REDIS_URL)
+        self.client = client
+
+    @staticmethod
+    def _name(key: str, window: int) -> str:
+        return f'picmaker:rate:{key}:{window}'
+
+    def incr(self, key: str, window: int, amount: int, ttl: int) -> int:
+        name = self._name(key, window)
+        count = self.client.incrby(name, amount)
+        self.client.expire(name, ttl)
+        return int(count)
+
+    def get(self, key: str, windows: Sequence[int]) -> List[int]:
+        return [int(count or 0) for count in self.client.mget([self._name(key, window) for window in windows])]
+
+    def get_many(self, counters: Iterable[Counter]) -> Dict[Counter, int]:
+        counters = list(counters)
+        if not counters:
+            return {}
+        counts = self.client.mget([self._name(key, window) for key, window in counters])
+        return {counter: int(count or 0) for counter, count in zip(counters, counts)}
+
+
+class BatchedBackend(CounterBackend):
+    """
+    Counters kept in memory and merged into a `shared` backend every
+    `interval` seconds by a background task, on a thread, so the requests
+    never wait for the shared store.
+
+    Every flush adds the hits counted here since the previous one and reads
+    back the counters used in the last `keep` seconds, so each worker sees the
+    hits of the others at most `interval` seconds late. A key can go over its limit
+    by the hits the other workers let in during that time. The counters that
+    are not in memory, new to this worker or unused for `keep` seconds, are
+    read from `shared` on their first use, a single read per key. Before
+    `start` and after `shutdown` the counters go straight to `shared`.
+    """
+
+    def __init__(self, shared: CounterBackend, interval: float = RATE_LIMIT_FLUSH_INTERVAL,
+                 keep: float = RATE_LIMIT_KEEP) -> None:
+        self.shared = shared
+        self.interval = interval
+        self.keep = keep
+        self._pending: Dict[Counter, List[int]] = {}  # Amount and ttl
+        self._counts: Dict[Counter, int] = {}  # As of the last flush
+        self._used: Dict[Counter, float] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _load(self, counters: List[Counter]) -> None:
+        """
+        Reads from `shared` the counters that are not in memory, their hits
+        of the other workers and of the past must be counted from the start.
+        """
+        with self._lock:
+            cold = [counter for counter in counters if counter not in self._counts]
+        if not cold:
+            return
+        counts = self.shared.get_many(cold)
+        with self._lock:
+            for counter, count in counts.items():
+                # a flush in the meantime has a newer count, it includes the pending hits
+                self._counts.setdefault(counter, count)
+
+    def incr(self, key: str, window: int, amount: int, ttl: int) -> int:
+        if self._task is None:
+            return self.shared.incr(key, window, amount, ttl)
+        counter = (key, window)
+        self._load([counter])
+        with self._lock:
+            pending = self._pending.setdefault(counter, [0, ttl])
+            pending[0] += amount
+            self._used[counter] = time.monotonic()
+            return self._counts.get(counter, 0) + pending[0]
+
+    def get(self, key: str, windows: Sequence[int]) -> List[int]:
+        if self._task is None:
+            return self.shared.get(key, windows)
+        self._load([(key, window) for window in windows])
+        now = time.monotonic()
+        counts = []
+        with self._lock:
+            for window in windows:
+                counter = (key, window)
+                self._used[counter] = now
+                counts.append(self._counts.get(counter, 0) + self._pending.get(counter, (0,))[0])
+        return counts
+
+    def flush(self) -> None:
+        """
+        Adds the pending hits to the shared backend and reads back the other
+        counters in use. It blocks, the background
+        task runs it on a thread.
+        """
+        with self._lock:
+            unused = time.monotonic() - self.keep
+            for counter in [counter for counter, used in self._used.items() if used < unused]:
+                if counter not in self._pending:
+                    del self._used[counter]
+                    self._counts.pop(counter, None)
+            pending, self._pending = self._pending, {}
+            wanted = set(self._used).difference(pending)
+        try:
+            counts = self.shared.incr_many({counter: tuple(value) for counter, value in pending.items()})
+            counts.update(self.shared.get_many(wanted))
+        except BaseException:
+            with self._lock:
+                # kept for the next flush
+                for counter, (amount, ttl) in pending.items():
+                    self._pending.setdefault(counter, [0, ttl])[0] += amount
+            raise
+        with self._lock:
+            self._counts.update(counts)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.flush)
+            except Exception as e:
+                print(f"Error writing the rate limit counters: {e}")
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        """
+        Stops the background task and writes the pending hits.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+
+class SlidingWindowLimiter:
+    """
+    Allows `limit` hits per key in any `window` seconds. The hits of the
+    current fixed window are counted exactly and the ones of the previous
+    window are weighted by how much of it is still inside the sliding window,
+    so every check reads two counters no matter how many hits there were.
+    """
+
+    def __init__(self, backend: CounterBackend, limit: int, window: int) -> None:
+        self.backend = backend
+        self.limit = limit
+        self.window = window
+
+    def _windows(self, now: float) -> Tuple[int, int, float]:
+        current = int(now // self.window)
+        weight = 1 - (now % self.window) / self.window
+        return current, current - 1, weight
+
+    def count(self, key: str, now: Optional[float] = None) -> int:
+        current, previous, weight = self._windows(time.time() if now is None else now)
+        current_count, previous_count = self.backend.get(key, [current, previous])
+        return int(current_count + previous_count * weight)
+
+    def acquire(self, key: str, now: Optional[float] = None) -> Tuple[bool, int]:
+        """
+        Counts a hit of `key` if it is under the limit. The hit is added before
+        the check, so concurrent requests of other workers can't all pass.
+
+        Returns:
+            Tuple[bool, int]: If the hit was allowed and the hits left.
+        """
+        current, previous, weight = self._windows(time.time() if now is None else now)
+        previous_count = self.backend.get(key, [previous])[0]
+        used = int(self.backend.incr(key, current, 1, 2 * self.window) + previous_count * weight)
+        if used > self.limit:
+            self.backend.incr(key, current, -1, 2 * self.window)
+            return False, 0
+        return True, self.limit - used
+
+    def release(self, key: str, now: Optional[float] = None) -> None:
+        """
+        Gives back a hit of `acquire`, for requests that failed.
+        """
+        current, _, _ = self._windows(time.time() if now is None else now)
+        self.backend.incr(key, current, -1, 2 * self.window)
+
+    def start(self) -> None:
+        self.backend.start()
+
+    async def shutdown(self) -> None:
+        await self.backend.shutdown()
+
+
+def get_backend(name: str = RATE_LIMIT_BACKEND) -> CounterBackend:
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'redis':
+        return BatchedBackend(RedisBackend())
+    return BatchedBackend(SQLiteBackend())
+
+
+# the Free_picture rows are only the record of the renders, the quota is checked on the limiter
+free_picture_log = BatchWriter(FreePictureDB.add_freePictures_toDB_async)
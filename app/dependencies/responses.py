@@ -0,0 +1,132 @@
+# Starlette
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+import anyio
+# Python
+from typing import Mapping, Optional, Tuple
+import stat
+import re
+import os
+
+RANGE_REGEX = re.compile(r'^bytes=(\d*)-(\d*)$')
+ETAG_REGEX = re.compile(r'(W/)?("[^"]*")')
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Returns if `etag` is one of the entity tags of an `If-None-Match` header.
+    The comparison is the weak one of RFC 9110, `W/` is ignored on both sides,
+    and `*` matches any current representation.
+    """
+    if if_none_match.strip() == '*':
+        return True
+    match = ETAG_REGEX.fullmatch(etag.strip())
+    return match is not None and match.group(2) in [tag for _, tag in ETAG_REGEX.findall(if_none_match)]
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the first and last byte of a single `bytes=` range of a file of
+    `size` bytes. Several ranges or a wrong syntax return None, the whole file
+    is sent then as HTTP allows.
+
+    Raises:
+        ValueError: If the range is not satisfiable.
+    """
+    match = RANGE_REGEX.match(range_header.strip())
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    if match.group(1) == '':
+        # suffix range, the last N bytes
+        start, end = max(0, size - int(match.group(2))), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start >= size or start > end:
+        raise ValueError(f'Range {range_header} not satisfiable for {size} bytes')
+    return start, end
+
+
+class RangeFileResponse(FileResponse):
+    """
+    FileResponse that answers single `Range` requests with a 206, the file is
+    read in big chunks. Servers that advertise the ASGI zero-copy send
+    extension get the file instead, uvicorn doesn't, so behind it the chunks
+    are the only path.
+
+    `If-Range` is honored against the ETag or Last-Modified of the response,
+    a changed file is sent whole. Weak ETags never match it, ranges of
+    different versions can't be mixed.
+    """
+    chunk_size = 256 * 1024
+
+    def __init__(self,
+                 path: str,
+                 request_headers: Optional[Mapping[str, str]] = None,
+                 headers: Optional[Mapping[str, str]] = None,
+                 media_type: Optional[str] = None,
+                 filename: Optional[str] = None,
+                 method: Optional[str] = None) -> None:
+        super().__init__(path, headers=headers, media_type=media_type, filename=filename, method=method)
+        request_headers = request_headers or {}
+        self.range_header = request_headers.get('range')
+        self.if_range = request_headers.get('if-range')
+        self.headers['accept-ranges'] = 'bytes'
+
+    def _range(self, size: int) -> Optional[Tuple[int, int]]:
+        if self.range_header is None:
+            return None
+        etag = self.headers.get('etag')
+        validators = [self.headers.get('last-modified')]
+        if etag is not None and not etag.startswith('W/'):
+            validators.append(etag)
+        if self.if_range is not None and self.if_range.strip() not in validators:
+            return None
+        return parse_range(self.range_header, size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            raise RuntimeError(f"File at path {self.path} does not exist.")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise RuntimeError(f"File at path {self.path} is not a file.")
+        self.set_stat_headers(stat_result)
+        size = stat_result.st_size
+        try:
+            byte_range = self._range(size)
+        except ValueError:
+            self.status_code = 416
+            self.headers['content-range'] = f'bytes */{size}'
+            self.headers['content-length'] = '0'
+            await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            return
+        start, end = byte_range if byte_range is not None else (0, size - 1)
+        count = end - start + 1
+        if byte_range is not None:
+            self.status_code = 206
+            self.headers['content-range'] = f'bytes {start}-{end}/{size}'
+            self.headers['content-length'] = str(count)
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if self.send_header_only or count <= 0:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        elif 'http.response.zerocopy' in scope.get('extensions', {}):
+            with open(self.path, 'rb') as file:
+                await send({'type': 'http.response.zerocopy', 'file': file,
+                            'offset': start, 'count': count, 'more_body': False})
+        else:
+            async with await anyio.open_file(self.path, mode='rb') as file:
+                await file.seek(start)
+                remaining = count
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+                if remaining > 0:
+                    # the file got shorter meanwhile, close the body anyway
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,56 @@
+# APP
+from app.DB import db as database
+from app.DB.querys_pictures import FreePictureDB
+# SQLModel
+from sqlmodel import Session
+# Python
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+import asyncio
+import os
+
+FREE_PICTURE_RETENTION_DAYS = int(os.getenv('FREE_PICTURE_RETENTION_DAYS', 7))
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 60 * 60))  # Seconds
+
+
+class RetentionJob:
+    """
+    Keeps the Free_picture log bounded: every `interval` seconds the rows
+    older than `days` days are rolled up into Free_picture_day and deleted.
+    """
+
+    def __init__(self,
+                 days: int = FREE_PICTURE_RETENTION_DAYS,
+                 interval: float = RETENTION_INTERVAL,
+                 session_factory: Optional[Callable[[], Session]] = None) -> None:
+        self.days = days
+        self.interval = interval
+        self.session_factory = session_factory or (lambda: Session(database.engine))
+        self._task: Optional[asyncio.Task] = None
+
+    def run_once(self) -> int:
+        with self.session_factory() as db:
+            return FreePictureDB.rollup_free_pictures(datetime.now() - timedelta(days=self.days), db)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # the roll up is blocking DB work, keep it off the event loop
+                deleted = await asyncio.get_running_loop().run_in_executor(None, self.run_once)
+                if deleted:
+                    print(f"Free pictures rolled up: {deleted}")
+            except Exception as e:
+                print(f"Error rolling up the free pictures: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+retention_job = RetentionJob()
@@ -1,166 +1,395 @@
 # FastAPI
-from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 # APP
 from app.DB.db import BASE_DIR
 from app.DB.querys_pictures import PictureDB
-from app.models.picture import Picture, QualityType
-from app.models.user import User
+from app.models.picture import Picture, PictureFormat, QualityType, RenderSpec
+from app.models.user import User, UserClaims
+from app.dependencies import pipeline, profilepicmaker
+from app.dependencies.engine import render_engine
+from app.dependencies.cache import RenderCache, render_cache, stage_cache
+from app.dependencies.ingest import SpooledUpload
+from app.dependencies.storage import is_content_key, picture_store
+from app.dependencies.pipeline import NoFaceException, FaceIndexException  # noqa: F401
 # SQLModel
-from sqlmodel import Session
-# ProfilePicMaker
-from ProfilePicMaker.app.models.pictures import BigPic, FacePic
+from sqlmodel.ext.asyncio.session import AsyncSession
 # Python
 from pydantic.color import Color
-from typing import Optional
-import tempfile
-import shutil
+from typing import List, NamedTuple, Optional, Tuple, Union
 import os
 
-TEMPORARY_DURATION = 5  # Seconds
+
+class RenderExpiredException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
 
 
-class NoFaceException(Exception):
+class PictureNotSavedException(Exception):
     def __init__(self, message: str) -> None:
+        super().__init__(message)
         self.message = message
 
 
+class Render(NamedTuple):
+    """
+    A rendered picture, either encoded in memory (`data`) when it was just
+    rendered or on disk (`path`) when it comes from the render cache.
+    """
+    key: str
+    render_id: Optional[str]
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+    picture_id: Optional[int] = None
+    content_key: Optional[str] = None
+
+
+RENDER_ID_REGEX = r'^(thumbnail|preview|medium|high|fullsize)-[0-9a-f]{64}$'
+
+# Which pipeline detects, segments and composes the faces: the adapters of
+# ProfilePicMaker or the in-memory `pipeline` (native). Both have the same stages
+PICTURE_PIPELINE = os.getenv('PICTURE_PIPELINE', 'profilepicmaker')
+stages = pipeline if PICTURE_PIPELINE == 'native' else profilepicmaker
+
+
 class MakePicture:
-    def __init__(self, user: User) -> None:
+    def __init__(self, user: Union[User, UserClaims]) -> None:
         self.user = user
 
     async def make_user_picture(self,
-                                db: Session,
-                                pic_file: UploadFile,
+                                db: AsyncSession,
+                                upload: SpooledUpload,
                                 colorsModel: tuple[Color],
                                 BorderColor: Optional[Color] = None,
                                 quality: QualityType = QualityType.PREVIEW,
-                                index: Optional[int] = 0) -> str:
-        print('lets create a picture for a user')
-        print(self.user)
-        print(self.user.id)
-        user_path_directory = os.path.join(os.path.dirname(BASE_DIR),
-                                           'resources',
-                                           str(self.user.id))
-        print(f'user_path_directory: {user_path_directory}')
-        # check if the user has a folder_user if not create it whit id of user
-        # if not os.path.exists(user_path_directory):
-        os.makedirs(user_path_directory, exist_ok=True)
+                                index: Optional[int] = 0,
+                                derivatives: Optional[List[QualityType]] = None) -> Render:
+        """
+        Renders a picture for the user and stores it on the picture store. With
+        `derivatives` the picture is rendered once at the biggest quality of
+        `quality` and `derivatives`, the other ones are downsampled from it and
+        stored too, each one with its own Picture.
 
+        Returns:
+            Render: The stored picture at `quality`.
+        """
+        qualities = list(dict.fromkeys([quality] + (derivatives or [])))
+        top_quality = pipeline.largest_quality(qualities)
         # make the pic and save it into the folder whit the user idname
-        pic_file = await MakePicture.make_temp_picture(pic_file=pic_file,
-                                                       colorsModel=colorsModel,
-                                                       BorderColor=BorderColor,
-                                                       quality=quality,
-                                                       index=index,
-                                                       temp=False)
-        sequence = 0
-        pic_file_parts = os.path.splitext(os.path.basename(pic_file))
-        pic_filename = f"{pic_file_parts[0]}_{quality}_{sequence}{pic_file_parts[1]}"
-        new_pic_path = os.path.join(user_path_directory, pic_filename)
-        shutil.move(pic_file, new_pic_path)
-        # create db log of the picture
-        pictureDB = Picture(filename=pic_filename,
-                            user_id=self.user.id,
-                            type_picture=quality)
-
-        PictureDB.add_picture_toDB(pictureDB, db)
-        return new_pic_path
+        render = await MakePicture.make_temp_picture(upload=upload,
+                                                     colorsModel=colorsModel,
+                                                     BorderColor=BorderColor,
+                                                     quality=top_quality,
+                                                     index=index)
+        renders = [render] + await MakePicture.derive_pictures(render,
+                                                               [derived for derived in qualities
+                                                                if derived != top_quality])
+        qualities.remove(top_quality)
+        stored = await self.store_user_pictures(db, list(zip(renders, [top_quality] + qualities)))
+        return stored[0 if quality == top_quality else qualities.index(quality) + 1]
+
+    async def recolor_user_picture(self,
+                                   db: AsyncSession,
+                                   render_id: str,
+                                   colorsModel: tuple[Color],
+                                   BorderColor: Optional[Color] = None) -> Render:
+        render = await MakePicture.recolor_picture(render_id=render_id,
+                                                   colorsModel=colorsModel,
+                                                   BorderColor=BorderColor)
+        return await self.store_user_picture(db, render, MakePicture.render_quality(render_id))
+
+    async def make_user_pictures(self,
+                                 db: AsyncSession,
+                                 upload: SpooledUpload,
+                                 specs: List[RenderSpec],
+                                 index: Optional[int] = 0) -> List[Render]:
+        renders = await MakePicture.make_temp_pictures(upload=upload,
+                                                       specs=specs,
+                                                       index=index)
+        return await self.store_user_pictures(db, [(render, spec.quality)
+                                                   for render, spec in zip(renders, specs)])
+
+    def user_directory(self) -> str:
+        """
+        Folder of the pictures stored before the object store, by user.
+        """
+        return os.path.join(os.path.dirname(BASE_DIR),
+                            'resources',
+                            str(self.user.id))
+
+    def picture_path(self, filename: str) -> Optional[str]:
+        """
+        Returns the local path of a stored picture or None if it is missing.
+        `filename` is the content key of the picture on the object store, or
+        the name of its file on the folder of the user for the older ones.
+        """
+        if is_content_key(filename):
+            return picture_store.get_path(filename)
+        path = os.path.join(self.user_directory(), filename)
+        return path if os.path.exists(path) else None
+
+    async def store_user_picture(self, db: AsyncSession, render: Render, quality: QualityType) -> Render:
+        """
+        Writes a rendered picture into the picture store and logs it on the DB.
+
+        Returns:
+            Render: The picture with the path of its file and the id of its Picture.
+        """
+        return (await self.store_user_pictures(db, [(render, quality)]))[0]
+
+    async def store_user_pictures(self, db: AsyncSession, renders: List[Tuple[Render, QualityType]]) -> List[Render]:
+        """
+        Writes rendered pictures into the picture store and logs all of them
+        on the DB with a single commit.
+
+        Returns:
+            List[Render]: The pictures with the paths of their files, the ids of their Pictures and their content keys.
+
+        Raises:
+            PictureNotSavedException: If the Pictures could not be logged on the DB.
+        """
+        keys = []
+        picturesDB = []
+        for render, quality in renders:
+            # equal pictures get equal keys, the store keeps a single copy
+            if render.data is not None:
+                key = await run_in_threadpool(picture_store.put_bytes, render.data)
+            else:
+                key = await run_in_threadpool(picture_store.put_file, render.path)
+            keys.append(key)
+            # create db log of the picture
+            picturesDB.append(Picture(filename=key,
+                                      user_id=self.user.id,
+                                      type_picture=quality))
+
+        saved = await PictureDB.add_pictures_toDB_async(picturesDB, db)
+        if saved is None:
+            # the stored objects are kept, other Pictures may have the same content key
+            raise PictureNotSavedException("The pictures could not be saved. Try again later")
+        return [render._replace(data=None,
+                                path=picture_store.get_path(key),
+                                picture_id=picture.id,
+                                content_key=key)
+                for (render, _), key, picture in zip(renders, keys, picturesDB)]
+
+    @staticmethod
+    def make_render_id(upload_hash: str, quality: QualityType, index: int) -> str:
+        """
+        Returns the id of the face `index` of an upload at `quality`. It is the
+        key of the segmented face on the stage cache, the quality goes in clear
+        so recolors know it without the upload. The pictures of each pipeline
+        get their own ids.
+        """
+        return f"{quality.value}-{RenderCache.make_key(upload_hash, quality.value, index, PICTURE_PIPELINE)}"
+
+    @staticmethod
+    def render_quality(render_id: str) -> QualityType:
+        return QualityType(render_id.split('-', 1)[0])
+
+    @staticmethod
+    def render_key(render_id: str,
+                   colorsModel: tuple[Color],
+                   BorderColor: Optional[Color] = None) -> str:
+        """
+        Returns the key of a render on the render cache.
+        """
+        # the colors are str when they are the defaults of the query parameters
+        return RenderCache.make_key(render_id,
+                                    'face',
+                                    Color(colorsModel[0]).as_hex(),
+                                    Color(colorsModel[1]).as_hex(),
+                                    Color(BorderColor).as_hex() if BorderColor is not None else None)
+
+    @staticmethod
+    async def encode_picture(render: Render, format: PictureFormat) -> Render:
+        """
+        Returns a rendered picture encoded as `format`. Renders are PNGs, the
+        other formats are encoded on the render engine and kept on the render
+        cache by the key of the render and the format.
+        """
+        if format == PictureFormat.PNG:
+            return render
+        key = RenderCache.make_key(render.key, 'format', format.value)
+        suffix = f'.{format.value}'
+        path = render_cache.get(key, suffix)
+        if path is not None:
+            return render._replace(key=key, data=None, path=path)
+        data = await render_engine.run(pipeline.transcode,
+                                       render.data if render.data is not None else render.path,
+                                       format)
+        await run_in_threadpool(render_cache.put_bytes, key, data, suffix)
+        return render._replace(key=key, data=data, path=None)
 
     @staticmethod
-    async def make_temp_picture(pic_file: UploadFile,
+    async def make_temp_picture(upload: SpooledUpload,
                                 colorsModel: tuple[Color],
                                 BorderColor: Optional[Color] = None,
                                 quality: Optional[QualityType] = QualityType.PREVIEW,
-                                index: Optional[int] = 0,
-                                temp: bool = True) -> str:
+                                index: Optional[int] = 0) -> Render:
         """
         Creates a temporary picture with the specified parameters.
+        The picture is rendered on a worker process of the render engine, unless
+        the same upload was already rendered with the same parameters. When only
+        the colors change, the segmented face of the stage cache is reused.
 
         Parameters:
-            pic_file (File): The picture file to be used.
-            Acolor (Color): The color for the A component.
-            Bcolor (Color): The color for the B component.
+            upload (SpooledUpload): The uploaded picture, already on disk.
+            colorsModel (tuple[Color]): The center and outer colors of the background.
             BorderColor (Optional[Color], optional): The color for the border. Defaults to None.
             quality (Optional[QualityType], optional): The quality type of the picture. Defaults to QualityType.PREVIEW.
             index (Optional[int], optional): The index of the face. Defaults to 0.
 
         Returns:
-            str: The path of the temporary picture.
-        """
-        print(
-            f'test Colors {colorsModel} {str(colorsModel[0])} {str(colorsModel[1])}')
-        suffix = '.'+pic_file.filename.split(".")[-1]
-        with tempfile.NamedTemporaryFile(delete=True,
-                                         suffix=suffix) as temp_file:
-            with open(temp_file.name, "wb") as f:
-                f.write(await pic_file.read())
-            faces = BigPic(temp_file.name).get_faces()
-            if (len(faces) == 0):
-                raise NoFaceException(
-                    "No Faces detected in the picture 'image/jpeg'")
-
-            if quality == QualityType.THUMBNAIL:
-                faces[index].resize(150)
-            elif quality == QualityType.PREVIEW:
-                faces[index].resize(300)
-            elif quality == QualityType.MEDIUM:
-                faces[index].resize(600)
-            elif quality == QualityType.HIGH:
-                faces[index].resize(1000)
-
-            faces[index].removeBG()
-            # faces[index].addBG(Acolor,Bcolor)
-            faces[index].addBG(colorsModel)
-            faces[index].set_contour()
-            if BorderColor is not None:
-                faces[index].setBorder(BorderColor)
-            faces[index].setBlur(30)
-            if temp:
-                # save the pic on a temp file during 5 sec
-                faces[index].save(tol=TEMPORARY_DURATION)
-            else:
-                faces[index].save()
-            return faces[index].get_path()
+            Render: The rendered picture and its render id.
+        """
+        render_id = MakePicture.make_render_id(upload.sha256, quality, index)
+        segment = stage_cache.get(render_id)
+        if segment is None:
+            segment = await render_engine.run(stages.segment_face,
+                                              upload.path,
+                                              quality,
+                                              index)
+            await run_in_threadpool(stage_cache.put_bytes, render_id, segment)
+        return await MakePicture.recolor_picture(render_id=render_id,
+                                                 colorsModel=colorsModel,
+                                                 BorderColor=BorderColor,
+                                                 segment=segment)
+
+    @staticmethod
+    async def make_temp_pictures(upload: SpooledUpload,
+                                 specs: List[RenderSpec],
+                                 index: Optional[int] = 0) -> List[Render]:
+        """
+        Renders several qualities and colors of the same face in one go. The
+        face is detected and segmented once for all the qualities missing on
+        the stage cache, and all the renders missing on the render cache are
+        composed in a single worker call.
+
+        Parameters:
+            upload (SpooledUpload): The uploaded picture, already on disk.
+            specs (List[RenderSpec]): The quality and colors of every picture.
+            index (Optional[int], optional): The index of the face. Defaults to 0.
+
+        Returns:
+            List[Render]: The rendered pictures, in the order of `specs`.
+        """
+        qualities = list(dict.fromkeys(spec.quality for spec in specs))
+        render_ids = {quality: MakePicture.make_render_id(upload.sha256, quality, index)
+                      for quality in qualities}
+        segments = {quality: stage_cache.get(render_ids[quality]) for quality in qualities}
+        missing = [quality for quality in qualities if segments[quality] is None]
+        if missing:
+            new_segments = await render_engine.run(stages.segment_faces,
+                                                   upload.path,
+                                                   missing,
+                                                   index)
+            for quality, segment in zip(missing, new_segments):
+                await run_in_threadpool(stage_cache.put_bytes, render_ids[quality], segment)
+                segments[quality] = segment
+
+        renders: List[Render] = []
+        missing_renders = []
+        for spec in specs:
+            colorsModel = (spec.colorCenter, spec.colorOuter)
+            render_id = render_ids[spec.quality]
+            key = MakePicture.render_key(render_id, colorsModel, spec.colorBorder)
+            renders.append(Render(key, render_id, path=render_cache.get(key)))
+            if renders[-1].path is None:
+                missing_renders.append((len(renders) - 1,
+                                        (segments[spec.quality], colorsModel, spec.colorBorder)))
+        if missing_renders:
+            pictures = await render_engine.run(stages.compose_faces,
+                                               [job for _, job in missing_renders])
+            for (position, _), data in zip(missing_renders, pictures):
+                await run_in_threadpool(render_cache.put_bytes, renders[position].key, data)
+                renders[position] = renders[position]._replace(data=data)
+        return renders
 
     @staticmethod
-    async def removeBG_picture(pic_file: UploadFile,
-                               quality: Optional[QualityType] = QualityType.PREVIEW,
-                               temp: bool = True) -> str:
+    async def derive_pictures(render: Render, qualities: List[QualityType]) -> List[Render]:
+        """
+        Downsamples `render` to every quality of `qualities` in a single worker
+        call, the derivatives already on the render cache are not made again.
+        Derivatives have no render id, recolors start from the render they come
+        from.
+
+        Returns:
+            List[Render]: The derivatives, in the order of `qualities`.
+        """
+        renders = [Render(key, None, path=render_cache.get(key))
+                   for key in (RenderCache.make_key(render.key, 'derived', quality.value)
+                               for quality in qualities)]
+        missing = [position for position, derived in enumerate(renders) if derived.path is None]
+        if missing:
+            pictures = await render_engine.run(pipeline.derive_pictures,
+                                               render.data if render.data is not None else render.path,
+                                               [qualities[position] for position in missing])
+            for position, data in zip(missing, pictures):
+                await run_in_threadpool(render_cache.put_bytes, renders[position].key, data)
+                renders[position] = renders[position]._replace(data=data)
+        return renders
+
+    @staticmethod
+    async def recolor_picture(render_id: str,
+                              colorsModel: tuple[Color],
+                              BorderColor: Optional[Color] = None,
+                              segment: Optional[Union[bytes, str]] = None) -> Render:
+        """
+        Renders again a previous picture with other colors, only the compositing
+        steps run because the segmented face comes from the stage cache.
+
+        Parameters:
+            render_id (str): The render id of the previous picture.
+            colorsModel (tuple[Color]): The center and outer colors of the background.
+            BorderColor (Optional[Color], optional): The color for the border. Defaults to None.
+            segment (Optional[Union[bytes, str]], optional): The segmented face if the caller already has it.
+
+        Returns:
+            Render: The rendered picture and its render id.
+
+        Raises:
+            RenderExpiredException: If the segmented face is not on the stage cache anymore.
+        """
+        key = MakePicture.render_key(render_id, colorsModel, BorderColor)
+        cached_path = render_cache.get(key)
+        if cached_path is not None:
+            return Render(key, render_id, path=cached_path)
+
+        if segment is None:
+            segment = stage_cache.get(render_id)
+        if segment is None:
+            raise RenderExpiredException(
+                "The picture is not available anymore, please upload it again")
+        data = await render_engine.run(stages.compose_face,
+                                       segment,
+                                       colorsModel,
+                                       BorderColor)
+        await run_in_threadpool(render_cache.put_bytes, key, data)
+        return Render(key, render_id, data=data)
+
+    @staticmethod
+    async def removeBG_picture(upload: SpooledUpload,
+                               quality: Optional[QualityType] = QualityType.PREVIEW) -> Render:
         """
         Removes the background from a picture file.
+        The picture is processed on a worker process of the render engine, unless
+        the same upload was already processed with the same quality.
 
         Args:
-            pic_file (File): The picture file to remove the background from.
-            quality (Optional[QualityType], optional): The desired quality of the output picture. 
+            upload (SpooledUpload): The uploaded picture, already on disk.
+            quality (Optional[QualityType], optional): The desired quality of the output picture.
                 Defaults to QualityType.PREVIEW.
-            temp (bool, optional): Whether to save the output picture as a temporary file. 
-                Defaults to True.
 
         Returns:
-            str: The path of the output picture file.
-        """
-        suffix = '.'+pic_file.filename.split(".")[-1]
-        with tempfile.NamedTemporaryFile(delete=True,
-                                         suffix=suffix) as temp_file:
-            with open(temp_file.name, "wb") as f:
-                f.write(await pic_file.read())
-
-            face = FacePic(path=temp_file.name)
-
-            if quality == QualityType.THUMBNAIL:
-                face.resize(150)
-            elif quality == QualityType.PREVIEW:
-                face.resize(300)
-            elif quality == QualityType.MEDIUM:
-                face.resize(600)
-            elif quality == QualityType.HIGH:
-                face.resize(1000)
-
-            face.removeBG()
-
-            if temp:
-                # save the pic on a temp file during 5 sec
-                face.save(tol=TEMPORARY_DURATION)
-            else:
-                face.save()
-            return face.get_path()
+            Render: The output picture.
+        """
+        key = RenderCache.make_key(upload.sha256, 'removebg', quality.value, PICTURE_PIPELINE)
+        cached_path = render_cache.get(key)
+        if cached_path is not None:
+            return Render(key, None, path=cached_path)
+
+        data = await render_engine.run(stages.removeBG_picture,
+                                       upload.path,
+                                       quality)
+        await run_in_threadpool(render_cache.put_bytes, key, data)
+        return Render(key, None, data=data)
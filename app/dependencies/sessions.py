@@ -0,0 +1,88 @@
+# rembg
+import rembg
+import rembg.bg
+from rembg.sessions import sessions_class
+from rembg.sessions.base import BaseSession
+from rembg.sessions.u2net import U2netSession
+# onnxruntime
+import onnxruntime as ort
+# Python
+from typing import Dict
+import resource
+import time
+import os
+
+REMBG_MODELS = os.getenv('REMBG_MODELS', 'u2net').split(',')
+# There is one render worker per core by default, so one thread per session
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', 1))
+ONNX_INTER_OP_THREADS = int(os.getenv('ONNX_INTER_OP_THREADS', 1))
+
+# Sessions built on this process, one per model
+_sessions: Dict[str, BaseSession] = {}
+_load_stats = {'models': [], 'seconds': 0.0}
+
+
+def build_session(model_name: str, providers=None, *args, **kwargs) -> BaseSession:
+    """
+    Builds a rembg session like `rembg.new_session` does, but with the thread
+    settings of this module for onnxruntime.
+    """
+    session_class = U2netSession
+    for sc in sessions_class:
+        if sc.name() == model_name:
+            session_class = sc
+            break
+
+    sess_opts = ort.SessionOptions()
+    sess_opts.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    sess_opts.inter_op_num_threads = ONNX_INTER_OP_THREADS
+    sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+
+    return session_class(model_name, sess_opts, providers, *args, **kwargs)
+
+
+def get_session(model_name: str = 'u2net', providers=None, *args, **kwargs) -> BaseSession:
+    """
+    Returns the session of `model_name` for this process, building it only the first time.
+    It has the signature of `rembg.new_session` so it can take its place.
+    """
+    session = _sessions.get(model_name)
+    if session is None:
+        session = build_session(model_name, providers, *args, **kwargs)
+        _sessions[model_name] = session
+    return session
+
+
+def install() -> None:
+    """
+    Makes rembg reuse the sessions of this registry. `rembg.remove()` called
+    without a session, as FacePic.removeBG() does, looks up `new_session` on
+    `rembg.bg` each time, so replacing it there is enough.
+    """
+    rembg.bg.new_session = get_session
+    rembg.new_session = get_session
+
+
+def preload() -> None:
+    """
+    Builds the sessions of REMBG_MODELS. It is the initializer of the render
+    engine workers so every worker loads its models once, before its first job.
+    """
+    install()
+    start = time.perf_counter()
+    for model_name in REMBG_MODELS:
+        get_session(model_name)
+    _load_stats['models'] = list(_sessions)
+    _load_stats['seconds'] = time.perf_counter() - start
+
+
+def load_stats() -> dict:
+    """
+    Returns the models loaded on this process, the time it took and its peak RSS in MB.
+    """
+    return {
+        'pid': os.getpid(),
+        'models': _load_stats['models'],
+        'seconds': _load_stats['seconds'],
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
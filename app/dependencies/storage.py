@@ -0,0 +1,167 @@
+# APP
+from app.DB.db import BASE_DIR
+from app.dependencies.cache import RenderCache
+# Python
+from typing import Optional
+import tempfile
+import hashlib
+import re
+import os
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')  # local or s3
+STORAGE_DIR = os.getenv('STORAGE_DIR', os.path.join(BASE_DIR, 'storage', 'pictures'))
+STORAGE_BUCKET = os.getenv('STORAGE_BUCKET', 'picmaker-pictures')
+STORAGE_CACHE_DIR = os.getenv('STORAGE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'objects'))
+STORAGE_CACHE_MAX_MB = int(os.getenv('STORAGE_CACHE_MAX_MB', 512))
+
+CONTENT_KEY_REGEX = re.compile(r'^[0-9a-f]{64}$')
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_content_key(name: str) -> bool:
+    return CONTENT_KEY_REGEX.match(name) is not None
+
+
+class ObjectStore:
+    """
+    Store of the user pictures. Objects are addressed by the sha256 of their
+    content, so storing the same picture twice keeps a single copy.
+    """
+
+    def put_bytes(self, data: bytes) -> str:
+        """
+        Stores `data` unless an equal object is already stored.
+
+        Returns:
+            str: The key of the object.
+        """
+        raise NotImplementedError
+
+    def put_file(self, src_path: str) -> str:
+        with open(src_path, 'rb') as f:
+            return self.put_bytes(f.read())
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def get_path(self, key: str) -> Optional[str]:
+        """
+        Returns a local path with the object `key` or None if it is not stored.
+        """
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class LocalObjectStore(ObjectStore):
+    """
+    Objects on a local directory, sharded by the first 4 characters of their
+    key (`ab/cd/abcd...`) so no folder gets more than a few hundred files even
+    with millions of objects. Objects are written to a temporary file and
+    renamed into place, readers never see a partial object.
+    """
+
+    def __init__(self, directory: str = STORAGE_DIR) -> None:
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:4], key)
+
+    def put_bytes(self, data: bytes) -> str:
+        key = content_key(data)
+        if not self.exists(key):
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+            os.replace(temp_path, self._path(key))
+        return key
+
+    def put_file(self, src_path: str) -> str:
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f, open(src_path, 'rb') as src:
+            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        key = digest.hexdigest()
+        if self.exists(key):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+            os.replace(temp_path, self._path(key))
+        return key
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get_path(self, key: str) -> Optional[str]:
+        return self._path(key) if self.exists(key) else None
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3ObjectStore(ObjectStore):
+    """
+    Objects on an S3-compatible bucket. Works with any client that has
+    `put_object`, `head_object`, `get_object` and `delete_object` like boto3
+    ones. Objects are downloaded to a local LRU cache to be served.
+    """
+
+    def __init__(self, client=None, bucket: str = STORAGE_BUCKET, cache: Optional[RenderCache] = None) -> None:
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+        self.client = client
+        self.bucket = bucket
+        self.cache = cache or RenderCache(STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_MB * 1024 * 1024)
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return f'{key[:2]}/{key[2:4]}/{key}'
+
+    def put_bytes(self, data: bytes) -> str:
+        key = content_key(data)
+        if not self.exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self._name(key), Body=data,
+                                   ContentType='image/png')
+        return key
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._name(key))
+            return True
+        except Exception:
+            return False
+
+    def get_path(self, key: str) -> Optional[str]:
+        path = self.cache.get(key)
+        if path is None:
+            try:
+                data = self.client.get_object(Bucket=self.bucket, Key=self._name(key))['Body'].read()
+            except Exception:
+                return None
+            path = self.cache.put_bytes(key, data)
+        return path
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._name(key))
+        self.cache.delete(key)
+
+
+def get_store(name: str = STORAGE_BACKEND) -> ObjectStore:
+    if name == 's3':
+        return S3ObjectStore()
+    return LocalObjectStore()
+
+
+picture_store = get_store()
@@ -0,0 +1,55 @@
+# FastAPI
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+# Starlette
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+# Python
+from typing import Dict, Optional
+
+
+class BodySizeLimitMiddleware:
+    """
+    Rejects request bodies bigger than the limit of their path prefix before
+    they are parsed. Bodies with a `Content-Length` are rejected right away,
+    the others are counted while they are received.
+    """
+
+    def __init__(self, app: ASGIApp, limits: Dict[str, int]) -> None:
+        self.app = app
+        # longest prefixes first so the most specific limit wins
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _limit_for(self, path: str) -> Optional[int]:
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limit = self._limit_for(scope['path']) if scope['type'] == 'http' else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f'Request body is too large, the limit is {limit // (1024 * 1024)}MB'
+        content_length = dict(scope['headers']).get(b'content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({'detail': detail},
+                                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    # FastAPI lets HTTPExceptions raised while parsing the body through
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -1,10 +1,13 @@
 # SQLModel
 from . import MyModels
 from sqlmodel import Field
+from sqlalchemy import Index
 # Python
+from pydantic.color import Color
+from typing import List, Optional
 from enum import Enum
-from uuid import UUID
-from datetime import datetime
+from uuid import UUID, uuid4
+from datetime import date, datetime
 
 class QualityType(str, Enum):
     THUMBNAIL = 'thumbnail'
@@ -18,7 +21,24 @@ class FreeQualityType(str, Enum):
     PREVIEW = 'preview'
     MEDIUM = 'medium'
 
+class PictureFormat(str, Enum):
+    PNG = 'png'
+    WEBP = 'webp'
+    JPEG = 'jpeg'
+
+    @property
+    def media_type(self) -> str:
+        return f'image/{self.value}'
+
+class JobStatus(str, Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
 class Picture(MyModels, table=True):
+    # the pictures of an user are listed newest first
+    __table_args__ = (Index('ix_picture_user_id_initDate', 'user_id', 'initDate', 'id'),)
     id: int = Field(primary_key=True)
     filename : str = Field(nullable=False)
     type_picture: QualityType = Field(nullable=False, 
@@ -27,13 +47,109 @@ class Picture(MyModels, table=True):
                                 nullable=False)
     user_id: UUID = Field(nullable=False,foreign_key="user.id")
 
+class PictureFB(MyModels):
+    id: int
+    type_picture: QualityType
+    initDate: datetime
+    url: str
+    class Config:
+        schema_extra = {
+            'example': {
+                'id'           : 1,
+                'type_picture' : 'preview',
+                'initDate'     : '2023-10-01T10:00:00',
+                'url'          : 'http://localhost:8000/pictures/mine/1',
+            }
+        }
+
+class PicturePage(MyModels):
+    pictures: List[PictureFB]
+    next_cursor: Optional[str] = None
+
 class Free_picture(MyModels, table=True):
+    # quotas look up the pictures of an ip by date, the retention job old ones by date
+    __table_args__ = (Index('ix_free_picture_ip_date', 'ip', 'date'),)
     id: int = Field(primary_key=True)
     ip: str = Field(nullable=False)
     quality: FreeQualityType = Field(nullable=False, 
                                           default=QualityType.PREVIEW) 
     date : datetime = Field(default_factory = datetime.now,
-                            nullable=False)
+                            nullable=False,
+                            index=True)
     # user_id: UUID = Field(nullable=True,
     #                       default=None,
-    #                       foreign_key="user.id")
\ No newline at end of file
+    #                       foreign_key="user.id")
+
+class Free_picture_day(MyModels, table=True):
+    day: date = Field(primary_key=True)
+    ip: str = Field(primary_key=True)
+    quality: FreeQualityType = Field(primary_key=True)
+    count: int = Field(nullable=False, default=0)
+
+class RenderSpec(MyModels):
+    quality: QualityType = Field(default=QualityType.PREVIEW)
+    colorCenter: Color = Field(default=Color('black'))
+    colorOuter: Color = Field(default=Color('white'))
+    colorBorder: Optional[Color] = Field(default=None)
+    class Config:
+        schema_extra = {
+            'example': {
+                'quality'     : 'preview',
+                'colorCenter' : 'black',
+                'colorOuter'  : 'white',
+                'colorBorder' : 'Border Color [Optional]',
+            }
+        }
+
+class RenderJobBase(MyModels):
+    quality: QualityType = Field(nullable=False,
+                                 default=QualityType.PREVIEW)
+    colorCenter: str = Field(nullable=False)
+    colorOuter: str = Field(nullable=False)
+    colorBorder: Optional[str] = Field(default=None)
+    face_index: int = Field(default=0, nullable=False)
+
+class RenderJob(RenderJobBase, table=True):
+    id: UUID = Field(default_factory=uuid4,
+                     primary_key=True,
+                     nullable=False)
+    user_id: UUID = Field(nullable=False, foreign_key="user.id", index=True)
+    status: JobStatus = Field(nullable=False,
+                              default=JobStatus.QUEUED,
+                              index=True)
+    upload_path: str = Field(nullable=False)
+    upload_sha256: str = Field(nullable=False)
+    filename: Optional[str] = Field(default=None)
+    render_id: Optional[str] = Field(default=None)
+    error: Optional[str] = Field(default=None)
+    error_code: Optional[int] = Field(default=None)
+    initDate: datetime = Field(default_factory=datetime.now,
+                               nullable=False)
+    startDate: Optional[datetime] = Field(default=None)
+    endDate: Optional[datetime] = Field(default=None)
+
+class RenderJobFB(RenderJobBase):
+    id: UUID
+    status: JobStatus
+    render_id: Optional[str]
+    error: Optional[str]
+    initDate: datetime
+    startDate: Optional[datetime]
+    endDate: Optional[datetime]
+    class Config:
+        schema_extra = {
+            'example': {
+                'id'          : 'id of the job',
+                'status'      : 'queued',
+                'quality'     : 'high',
+                'colorCenter' : '#000000',
+                'colorOuter'  : '#ffffff',
+                'colorBorder' : None,
+                'face_index'  : 0,
+                'render_id'   : None,
+                'error'       : None,
+                'initDate'    : '2023-10-01T10:00:00',
+                'startDate'   : None,
+                'endDate'     : None,
+            }
+        }
@@ -1,9 +1,10 @@
 # SQLModel
 from . import MyModels
 from sqlmodel import Field
+from sqlalchemy import Index
 # Python
 from uuid import UUID, uuid4
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from pydantic import SecretStr, EmailStr
 
@@ -14,6 +15,8 @@ class UserBase(MyModels):
     country : Optional[str] = Field(default= None, min_length=3, max_length=50)
 
 class User(UserBase, table=True):
+    # the admin listing pages the users by date
+    __table_args__ = (Index('ix_user_initDate_id', 'initDate', 'id'),)
     id : UUID = Field(default_factory=uuid4,
                            primary_key=True,
                            index=True,
@@ -55,6 +58,10 @@ class UserFB(UserBase):
             }
         }
 
+class UserPage(MyModels):
+    users: List[UserFB]
+    next_cursor: Optional[str] = None
+
 class UserUpdate(MyModels):
     name  : Optional[str] = Field(min_length=3, max_length=50) 
     country : Optional[str] = Field(default= None, min_length=3, max_length=50)
@@ -67,3 +74,13 @@ class UserUpdate(MyModels):
                 'city'    : 'City to change',
             }
         }
+
+class UserClaims(MyModels):
+    """
+    The user as the claims of a verified access token tell it, for the routes
+    that only need to authorize the request and don't query the user.
+    """
+    id : UUID
+    email : EmailStr
+    userType : str
+    is_active : bool
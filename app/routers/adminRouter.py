@@ -1,68 +1,151 @@
 #FastAPI
 from fastapi import APIRouter, status, HTTPException
 from fastapi import Depends, Query, Path
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 # SQLModel
-from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 # Python
 from pydantic import EmailStr
 from typing import Annotated
-from typing import List
+from typing import AsyncIterator, Tuple, Union
+from datetime import datetime
+from enum import Enum
 from uuid import UUID
+import base64
+import csv
+import io
 # APP
-from app.models.user import User, UserFB
-from app.DB.db import get_session
-from app.DB.querys_users import get_userDB_by_email
-from app.security.secureuser import get_current_user
+from app.models.user import User, UserClaims, UserFB, UserPage
+from app.DB.db import get_async_session
+from app.DB.querys_users import get_userDB_by_email_async, get_users_async, stream_users_async
+from app.security.secureuser import require_admin, revoke_tokens
+from app.dependencies.cache import render_cache
+from app.dependencies.jobs import job_queue
 
 router = APIRouter()
 
+EXPORT_CHUNK_ROWS = 500  # Users per chunk of the export stream
+
+
+class ExportFormat(str, Enum):
+    NDJSON = 'ndjson'
+    CSV = 'csv'
+
+
+def encode_user_cursor(user: User) -> str:
+    return base64.urlsafe_b64encode(f'{user.initDate.isoformat()}|{user.id}'.encode()).decode()
+
+
+def decode_user_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        initDate, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(initDate), UUID(user_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Invalid cursor")
+
+
+async def export_users(session: AsyncSession, format: ExportFormat, filters: dict) -> AsyncIterator[str]:
+    """
+    Yields the users matching `filters` as NDJSON or CSV, `EXPORT_CHUNK_ROWS`
+    at a time. The session of the request is closed after the response is sent,
+    so it can be used by the stream.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(UserFB.__fields__))
+    if format == ExportFormat.CSV:
+        writer.writeheader()
+    rows = 0
+    async for user in stream_users_async(session, **filters):
+        user_fb = UserFB(**user.dict())
+        if format == ExportFormat.CSV:
+            writer.writerow(user_fb.dict())
+        else:
+            buffer.write(user_fb.json() + '\n')
+        rows += 1
+        if rows % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
 @router.get(path='/allusers', 
-            response_model= List[UserFB], 
+            response_model=UserPage, 
             status_code=status.HTTP_200_OK
             )
-async def get_users(current_user: Annotated[User, Depends(get_current_user)],
-            #   offset: int = Query(description='Offset of the query',default=1,ge=1),
-              limit: int = Query(description='Limit of data per request',default=100, lte=100), 
-              session: Session = Depends(get_session)) -> dict:
+async def get_users(current_user: Annotated[UserClaims, Depends(require_admin)],
+              limit: int = Query(description='Limit of data per request',default=100, ge=1, le=100), 
+              cursor: Union[str, None] = Query(description='`next_cursor` of the previous page', default=None),
+              userType: Union[str, None] = Query(description='Only the users of this type', default=None),
+              is_active: Union[bool, None] = Query(description='Only the active or disabled users', default=None),
+              country: Union[str, None] = Query(description='Only the users of this country', default=None),
+              session: AsyncSession = Depends(get_async_session)) -> UserPage:
     """
-    Retrieve all users if the current user is an admin. Returns a list of UserFB objects.
+    Retrieve the users, oldest first, if the current user is an admin. Returns a page of UserFB objects.
     
     Args:
-        current_user (Annotated[User, Depends(get_current_user)]): The current user requesting data.
+        current_user (Annotated[UserClaims, Depends(require_admin)]): The current user requesting data.
         limit (int): Limit of data per request. Defaults to 100.
-        session (Session): A SQLAlchemy session object.
+        cursor (str, optional): The `next_cursor` of the previous page.
+        userType, is_active, country (optional): Filters of the users.
+        session (AsyncSession): A SQLAlchemy session object.
         
     Returns:
-        A list of UserFB objects.
+        A UserPage with the users and the cursor of the next page, null on the last one.
     
+    Raises:
+        HTTPException: If the current user is not an admin or the cursor is invalid.
+    """
+    users = await get_users_async(session,
+                                  limit=limit,
+                                  after=decode_user_cursor(cursor) if cursor is not None else None,
+                                  userType=userType,
+                                  is_active=is_active,
+                                  country=country)
+    return UserPage(users=[UserFB(**user.dict()) for user in users],
+                    next_cursor=encode_user_cursor(users[-1]) if len(users) == limit else None)
+
+
+@router.get(path='/allusers/export',
+            response_class=StreamingResponse,
+            status_code=status.HTTP_200_OK)
+async def export_all_users(current_user: Annotated[UserClaims, Depends(require_admin)],
+                           format: ExportFormat = Query(description='Format of the export', default=ExportFormat.NDJSON),
+                           userType: Union[str, None] = Query(description='Only the users of this type', default=None),
+                           is_active: Union[bool, None] = Query(description='Only the active or disabled users', default=None),
+                           country: Union[str, None] = Query(description='Only the users of this country', default=None),
+                           session: AsyncSession = Depends(get_async_session)):
+    """
+    Streams all the users matching the filters as NDJSON or CSV, in constant
+    memory no matter the size of the table.
+
     Raises:
         HTTPException: If the current user is not an admin.
     """
-    if(current_user.userType != 'admin'):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
-                            detail="User Unauthorized")
-    users = session.exec(select(User).limit(limit)).all()
-    # users = session.exec(select(User).offset(offset).limit(limit)).all() #Doesn't Work check it
-    return [UserFB(**user.dict()) for user in users]
+    filters = {'userType': userType, 'is_active': is_active, 'country': country}
+    media_type = 'text/csv' if format == ExportFormat.CSV else 'application/x-ndjson'
+    return StreamingResponse(export_users(session, format, filters),
+                             media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="users.{format.value}"'})
 
 
 @router.get(path='/getuser/email/{email}', 
             response_model=UserFB, 
             status_code=status.HTTP_200_OK
             )
-async def getUserbyEmail(current_user: Annotated[User, Depends(get_current_user)],
+async def getUserbyEmail(current_user: Annotated[UserClaims, Depends(require_admin)],
                    email: EmailStr = Path(description='e-mail of the user to get', 
                                           examples='user@example.com'),
                                         #   example='user@example.com'),
-                   session: Session = Depends(get_session)) -> User:
+                   session: AsyncSession = Depends(get_async_session)) -> User:
     """
     Retrieves a user from the database based on their email address.
     
     Args:
-        current_user (Annotated[User, Depends(get_current_user)]): The currently authenticated user.
+        current_user (Annotated[UserClaims, Depends(require_admin)]): The currently authenticated user.
         email (EmailStr): The email address of the user to retrieve.
-        session (Session): The database session to use.
+        session (AsyncSession): The database session to use.
     
     Returns:
         User: The requested user object.
@@ -71,12 +154,8 @@ async def getUserbyEmail(current_user: Annotated[User, Depends(get_current_user)
         HTTPException: If the current user is not an admin, or if the requested user is not found.
     """
 
-    if(current_user.userType != 'admin'):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
-                            detail="User Unauthorized")
-
     print(f'User id:{email}')
-    user = get_userDB_by_email(email,session=session)
+    user = await get_userDB_by_email_async(email,session=session)
     if user is not None:
         return UserFB(**user.dict())
     else:
@@ -87,16 +166,16 @@ async def getUserbyEmail(current_user: Annotated[User, Depends(get_current_user)
 @router.get(path='/getuser/{uuid}', 
             response_model=UserFB, 
             status_code=status.HTTP_200_OK)
-async def getUserbyUUID(current_user: Annotated[User, Depends(get_current_user)],
+async def getUserbyUUID(current_user: Annotated[UserClaims, Depends(require_admin)],
                   uuid: UUID = Path(description='UUID of the user to get'), 
-                  session: Session = Depends(get_session)) -> User:
+                  session: AsyncSession = Depends(get_async_session)) -> User:
     """
     Retrieves a user from the database by UUID.
 
     Args:
-        current_user (Annotated[User, Depends(get_current_user)]): The current user making the request.
+        current_user (Annotated[UserClaims, Depends(require_admin)]): The current user making the request.
         uuid (UUID, optional): The UUID of the user to retrieve. Defaults to Path(description='UUID of the user to get').
-        session (Session, optional): The database session. Defaults to Depends(get_session).
+        session (AsyncSession, optional): The database session. Defaults to Depends(get_async_session).
 
     Returns:
         User: The user object retrieved from the database.
@@ -105,10 +184,7 @@ async def getUserbyUUID(current_user: Annotated[User, Depends(get_current_user)]
         HTTPException: If the current user is not an admin or if the requested user is not found in the database.
     """
 
-    if(current_user.userType != 'admin'):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
-                            detail="User Unauthorized")
-    user = session.get(User, uuid)
+    user = await session.get(User, uuid)
     if user is not None:
         return UserFB(**user.dict())
     else:
@@ -118,19 +194,43 @@ async def getUserbyUUID(current_user: Annotated[User, Depends(get_current_user)]
 @router.delete(path='/deluser/{uuid}',
                response_model=dict,
                status_code=status.HTTP_200_OK)
-async def delete_user(current_user: Annotated[User, Depends(get_current_user)],
+async def delete_user(current_user: Annotated[UserClaims, Depends(require_admin)],
                 uuid: UUID = Path(description="User ID to delete"),
-                session: Session = Depends(get_session)) -> dict:
-    
-    if(current_user.userType != 'admin'):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
-                            detail="User Unauthorized")
+                session: AsyncSession = Depends(get_async_session)) -> dict:
     
-    user = session.get(User, uuid)
+    user = await session.get(User, uuid)
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail=f'Error. User uuid:{uuid} Not found')
-    session.delete(user)
-    session.commit()
+    await session.delete(user)
+    await session.commit()
+    revoke_tokens(user.email)
     return JSONResponse(content={'message':f'User uuid:{uuid} deleted'},
                         status_code=status.HTTP_200_OK)
+
+
+@router.get(path='/metrics/rendercache',
+            response_model=dict,
+            status_code=status.HTTP_200_OK)
+async def render_cache_metrics(current_user: Annotated[UserClaims, Depends(require_admin)]) -> dict:
+    """
+    Returns the hit/miss counters and the size of the render cache of this worker.
+
+    Raises:
+        HTTPException: If the current user is not an admin.
+    """
+    return render_cache.stats()
+
+
+@router.get(path='/metrics/jobs',
+            response_model=dict,
+            status_code=status.HTTP_200_OK)
+async def render_jobs_metrics(current_user: Annotated[UserClaims, Depends(require_admin)]) -> dict:
+    """
+    Returns the depth of the render job queue of this worker and the wait and
+    run times of its finished jobs, in seconds.
+
+    Raises:
+        HTTPException: If the current user is not an admin.
+    """
+    return job_queue.stats()
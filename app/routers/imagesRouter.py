@@ -1,27 +1,294 @@
 # FastAPI
 from fastapi import APIRouter, status, HTTPException, UploadFile, File, Request
-from fastapi import Path, Query, Depends
-from fastapi.responses import FileResponse
+from fastapi import Path, Query, Depends, Form
+from fastapi.responses import FileResponse, Response, StreamingResponse, JSONResponse
 # APP
-from app.models.user import User
-from app.models.picture import QualityType, FreeQualityType, Free_picture
-from app.DB.db import get_session
-from app.DB.querys_pictures import FreePictureDB
-from app.dependencies.service import MakePicture, NoFaceException
-from app.security.secureuser import get_current_user
+from app.models.user import UserClaims
+from app.models.picture import QualityType, FreeQualityType, Free_picture, RenderSpec, RenderJobFB, JobStatus
+from app.models.picture import Picture, PictureFB, PicturePage, PictureFormat
+from app.DB.db import get_async_session
+from app.DB.querys_pictures import PictureDB, RenderJobDB
+from app.dependencies.service import MakePicture, NoFaceException, FaceIndexException, RenderExpiredException, PictureNotSavedException, Render, RENDER_ID_REGEX
+from app.dependencies.engine import EngineBusyException, RenderCrashedException, RenderTimeoutException
+from app.dependencies.ingest import UploadTooLargeException, spool_upload, spooled_upload
+from app.dependencies.artifacts import temp_artifacts
+from app.dependencies.storage import is_content_key
+from app.dependencies.responses import RangeFileResponse, etag_matches
+from app.dependencies.jobs import JobQueueFullException, job_queue
+from app.dependencies.ratelimit import FREE_PICTURES_WINDOW, SlidingWindowLimiter, free_picture_log, get_backend
+from app.security.secureuser import get_token_claims
 # SQLModel
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 # Python
+from pydantic import ValidationError, parse_raw_as
 from pydantic.color import Color
-from typing import Annotated, Union
+from typing import Annotated, Iterator, List, Optional, Tuple, Union
+from contextlib import contextmanager
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from uuid import UUID
+import zipfile
+import base64
+import os
+import io
 
 router = APIRouter()
 
 LIMIT_SIZE_FREE = 15  # MB
 LIMIT_SIZE_USER = 30  # MB
 
-LIMIT_FREE_PICTURES = 60
+LIMIT_FREE_PICTURES = 60  # By IP in FREE_PICTURES_WINDOW
+LIMIT_BATCH_SPECS = 20
+# Room for the multipart boundaries and the other fields of an upload request
+MULTIPART_OVERHEAD = 64 * 1024  # Bytes
+# Longest time a client can wait for a render job on a single request
+LIMIT_JOB_WAIT = 60  # Seconds
+# Stored pictures never change, clients can keep them for a year
+STORED_PICTURE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+# The pictures of the user folders could be replaced, they are revalidated
+LEGACY_PICTURE_CACHE_CONTROL = 'private, no-cache'
+SUPPORTED_CONTENT_TYPES = ("image/jpeg", "image/png")
+
+# Status of the errors of the uploads, the render engine and the job queue
+ERROR_STATUS = {
+    UploadTooLargeException: status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    NoFaceException: status.HTTP_409_CONFLICT,
+    FaceIndexException: status.HTTP_422_UNPROCESSABLE_ENTITY,
+    RenderExpiredException: status.HTTP_404_NOT_FOUND,
+    EngineBusyException: status.HTTP_503_SERVICE_UNAVAILABLE,
+    RenderCrashedException: status.HTTP_503_SERVICE_UNAVAILABLE,
+    JobQueueFullException: status.HTTP_503_SERVICE_UNAVAILABLE,
+    RenderTimeoutException: status.HTTP_504_GATEWAY_TIMEOUT,
+    PictureNotSavedException: status.HTTP_500_INTERNAL_SERVER_ERROR,
+}
+
+
+free_limiter = SlidingWindowLimiter(get_backend(), LIMIT_FREE_PICTURES, FREE_PICTURES_WINDOW)
+
+
+def acquire_free_picture(request: Request) -> int:
+    """
+    Counts a free picture for the IP of the request.
+
+    Returns:
+        int: The free pictures left for the IP.
+
+    Raises:
+        HTTPException: 406 if the IP already got LIMIT_FREE_PICTURES pictures.
+    """
+    allowed, pics_left = free_limiter.acquire(request.client.host)
+    if not allowed:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                            detail=f'You have reached the limit of {LIMIT_FREE_PICTURES} pictures in {FREE_PICTURES_WINDOW // 3600} hours. Please register your user to get unlimited pictures',)
+    return pics_left
+
+
+@contextmanager
+def counted_free_picture(request: Request) -> Iterator[int]:
+    """
+    Counts a free picture for the IP of the request while the block runs, the
+    picture is not counted if the block fails.
+
+    Yields:
+        int: The free pictures left for the IP.
+    """
+    pics_left = acquire_free_picture(request)
+    try:
+        yield pics_left
+    except BaseException:
+        free_limiter.release(request.client.host)
+        raise
+
+
+@contextmanager
+def render_errors() -> Iterator[None]:
+    """
+    Turns the errors raised while a picture is uploaded or rendered into
+    their HTTPException, see ERROR_STATUS. Unexpected errors are a 500.
+    """
+    try:
+        yield
+    except HTTPException:
+        raise
+    except tuple(ERROR_STATUS) as e:
+        status_code = next(code for error, code in ERROR_STATUS.items() if isinstance(e, error))
+        headers = {'Retry-After': '5'} if status_code == status.HTTP_503_SERVICE_UNAVAILABLE else None
+        raise HTTPException(status_code=status_code,
+                            detail=e.message,
+                            headers=headers)
+    except Exception as e:
+        print(str(e))
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="there was an error processing your request. Try again later",)
+
+
+def check_content_type(picture_file: UploadFile) -> None:
+    if picture_file.content_type not in SUPPORTED_CONTENT_TYPES:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Unsupported content type. Supported content types are 'image/jpeg' or 'image/png'",)
+
+
+def check_active(current_user: UserClaims) -> None:
+    if current_user.is_active is False:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="User disabled, please contact admin")
+
+
+# On equal weights, for the formats named by the client and for the ones
+# only matched by a wildcard
+NAMED_FORMATS = (PictureFormat.WEBP, PictureFormat.PNG, PictureFormat.JPEG)
+WILDCARD_FORMATS = (PictureFormat.PNG, PictureFormat.WEBP, PictureFormat.JPEG)
+
+
+def negotiate_format(accept: Union[str, None]) -> PictureFormat:
+    """
+    Returns the format of the pictures for an `Accept` header. WebP and JPEG
+    are only sent to the clients that name them or refuse PNG, wildcards get
+    PNG. On equal weights WebP is preferred, then PNG.
+
+    Raises:
+        HTTPException: 406 if the header accepts none of the formats.
+    """
+    if not accept:
+        return PictureFormat.PNG
+    weights = {}
+    for part in accept.split(','):
+        media_type, *params = [param.strip() for param in part.split(';')]
+        weight = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    weight = float(param[2:])
+                except ValueError:
+                    weight = 0
+        weights[media_type.lower()] = weight
+    # the most specific range of every format gives its weight, q=0 refuses it
+    wildcard = weights.get('image/*', weights.get('*/*', 0))
+    ranks = {}
+    for format in PictureFormat:
+        if format.media_type in weights:
+            ranks[format] = (weights[format.media_type], True, -NAMED_FORMATS.index(format))
+        else:
+            ranks[format] = (wildcard, False, -WILDCARD_FORMATS.index(format))
+    format = max(ranks, key=ranks.get)
+    if ranks[format][0] <= 0:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                            detail="The pictures are available as 'image/png', 'image/webp' or 'image/jpeg'",)
+    return format
+
+
+def accepted_format(request: Request) -> PictureFormat:
+    """
+    The format of the pictures of a request, negotiated before anything is
+    rendered or counted.
+    """
+    return negotiate_format(request.headers.get('accept'))
+
+
+async def picture_response(render: Render, format: PictureFormat, headers: dict, filename: str) -> Response:
+    """
+    Returns a picture just rendered straight from memory, or from its file
+    when it comes from a cache or was stored for a user, as `format` (see
+    `accepted_format`).
+    """
+    if format != PictureFormat.PNG:
+        try:
+            render = await MakePicture.encode_picture(render, format)
+        except (EngineBusyException, RenderCrashedException, RenderTimeoutException):
+            # the PNG is ready, better than no picture
+            format = PictureFormat.PNG
+    filename = f'{os.path.splitext(filename)[0]}.{format.value}'
+    headers = {**headers, 'Vary': 'Accept'}
+    if render.data is not None:
+        headers = {**headers, 'Content-Disposition': f'attachment; filename="{filename}"'}
+        return Response(render.data, headers=headers, media_type=format.media_type)
+    return RangeFileResponse(render.path, headers=headers, media_type=format.media_type, filename=filename)
+
+
+def picture_url(request: Request, picture_id: int) -> str:
+    return str(request.url_for('get_stored_picture', picture_id=str(picture_id)))
+
+
+def encode_cursor(picture: Picture) -> str:
+    return base64.urlsafe_b64encode(f'{picture.initDate.isoformat()}|{picture.id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        initDate, picture_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(initDate), int(picture_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Invalid cursor")
+
+
+def stored_picture_response(request: Request, path: str, etag: Optional[str] = None) -> Response:
+    """
+    Serves a stored picture with validators. Pictures of the object store never
+    change, so `etag` is strong and they can be cached for long. Without
+    `etag`, for the files of the user folders, the ETag is weak and made from
+    the time and size of the file. Revalidations with `If-None-Match` or
+    `If-Modified-Since` are answered with a 304. `Range` requests get only
+    the bytes asked.
+    """
+    stat_result = os.stat(path)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        'ETag': etag or f'W/"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"',
+        'Last-Modified': last_modified,
+        'Cache-Control': STORED_PICTURE_CACHE_CONTROL if etag is not None else LEGACY_PICTURE_CACHE_CONTROL,
+    }
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        not_modified = etag_matches(if_none_match, headers['ETag'])
+    else:
+        if_modified_since = request.headers.get('if-modified-since')
+        try:
+            not_modified = (if_modified_since is not None and
+                            parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(last_modified))
+        except (TypeError, ValueError):
+            not_modified = False
+    if not_modified:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return RangeFileResponse(path, request_headers=request.headers, headers=headers,
+                             media_type="image/png", method=request.method)
+
+
+class _ZipStream(io.RawIOBase):
+    """
+    Write-only stream that keeps what zipfile writes until it is drained.
+    """
+
+    def __init__(self) -> None:
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def zip_pictures(renders: List[Render], names: List[str]) -> Iterator[bytes]:
+    """
+    Yields a zip file with the given pictures, one entry at a time. PNGs are
+    already compressed so they are stored as they are.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for render, name in zip(renders, names):
+            if render.data is not None:
+                archive.writestr(name, render.data)
+            else:
+                archive.write(render.path, arcname=name)
+            yield stream.drain()
+    yield stream.drain()
 
 
 @router.post('/example/{quality}',
@@ -29,8 +296,8 @@ LIMIT_FREE_PICTURES = 60
              status_code=status.HTTP_201_CREATED)
 async def example(
     request: Request,
+    format: Annotated[PictureFormat, Depends(accepted_format)],
     picture_file: Annotated[UploadFile, File(description='The uploaded picture file.')],
-    db: Session = Depends(get_session),
     index: int = Query(description='Which face in the picture will be used',
                        default=1, ge=1, le=10),
     quality: FreeQualityType = Path(description='Quality to use'),
@@ -55,54 +322,196 @@ async def example(
     Returns:
         - `FileResponse`: The response object containing the uploaded picture.
     """
+    check_content_type(picture_file)
 
-    nPics_ip = FreePictureDB.get_count_ip_date(ip=request.client.host,
-                                               date=datetime.now(),
-                                               db=db)
-    print(f'{request.client.host}: Number of pictures: {nPics_ip}')
-    if nPics_ip > LIMIT_FREE_PICTURES:
-        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
-                            detail=f'You have reached the limit of {LIMIT_FREE_PICTURES} pictures by day. Please register your user to get unlimited pictures',)
+    with counted_free_picture(request) as pics_left, render_errors():
+        async with spooled_upload(picture_file, 1024 * 1024 * LIMIT_SIZE_FREE) as upload:
+            render = await MakePicture.make_temp_picture(upload=upload,
+                                                         colorsModel=(colorCenter,
+                                                                      colorOuter),
+                                                         BorderColor=colorBorder,
+                                                         quality=quality,
+                                                         index=(index-1))
+    await free_picture_log.add(Free_picture(ip=request.client.host,
+                                            quality=quality))
+
+    headers = {
+        'Access-Control-Expose-Headers': 'Content-Disposition, picMaker-render-id',
+        'picMaker-pics-left-day': f'{pics_left}',
+        'picMaker-render-id': render.render_id,
+    }
+    return await picture_response(render, format, headers, filename='example.png')
 
-    if picture_file.content_type not in ("image/jpeg", "image/png"):
-        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-                            detail="Unsupported content type. Supported content types are 'image/jpeg' or 'image/png'",)
-    if picture_file.size > 1024 * 1024 * LIMIT_SIZE_FREE:     # 3MB
-        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                            detail=f'File size is too large, the limit is {LIMIT_SIZE_FREE}MB',)
 
+async def submit_render_job(current_user: UserClaims,
+                            pic_file: UploadFile,
+                            db: AsyncSession,
+                            colorsModel: tuple[Color],
+                            BorderColor: Union[Color, None],
+                            quality: QualityType,
+                            index: int) -> JSONResponse:
+    """
+    Queues an user picture to be rendered in the background and returns its
+    job with a 202 status.
+    """
+    with render_errors():
+        upload = await spool_upload(pic_file, 1024 * 1024 * LIMIT_SIZE_USER)
     try:
-        pic_path = await MakePicture.make_temp_picture(pic_file=picture_file,
-                                                       colorsModel=(colorCenter,
-                                                                    colorOuter),
-                                                       BorderColor=colorBorder,
-                                                       quality=quality,
-                                                       index=(index-1))
-    except NoFaceException as e:
+        with render_errors():
+            job = await job_queue.create_job(db=db,
+                                             user=current_user,
+                                             upload=upload,
+                                             colorsModel=colorsModel,
+                                             BorderColor=BorderColor,
+                                             quality=quality,
+                                             index=index)
+    finally:
+        temp_artifacts.release(upload.path)
+    return JSONResponse(RenderJobFB(**job.dict()).dict(),
+                        status_code=status.HTTP_202_ACCEPTED,
+                        headers={'Location': f'/pictures/jobs/{job.id}'})
+
+
+async def get_user_job(current_user: UserClaims, job_id: UUID, db: AsyncSession):
+    job = await RenderJobDB.get_job_async(job_id, db)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Job not found")
+    return job
+
+
+@router.get('/jobs/{job_id}',
+            response_model=RenderJobFB,
+            status_code=status.HTTP_200_OK)
+async def get_job(
+    current_user: Annotated[UserClaims, Depends(get_token_claims)],
+    job_id: UUID = Path(description='Id of the job'),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """
+    Returns the status of a render job of the user.
+    """
+    return RenderJobFB(**(await get_user_job(current_user, job_id, db)).dict())
+
+
+@router.get('/jobs/{job_id}/wait',
+            response_model=RenderJobFB,
+            status_code=status.HTTP_200_OK)
+async def wait_job(
+    current_user: Annotated[UserClaims, Depends(get_token_claims)],
+    job_id: UUID = Path(description='Id of the job'),
+    timeout: int = Query(description='Seconds to wait for the job to finish',
+                         default=30,
+                         ge=1, le=LIMIT_JOB_WAIT),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """
+    Long-poll version of `/jobs/{job_id}`, answers as soon as the job is
+    finished or after `timeout` seconds with its current status.
+    """
+    await get_user_job(current_user, job_id, db)
+    return RenderJobFB(**(await job_queue.wait(job_id, timeout)).dict())
+
+
+@router.get('/jobs/{job_id}/picture',
+            response_class=FileResponse,
+            status_code=status.HTTP_200_OK)
+async def get_job_picture(
+    request: Request,
+    current_user: Annotated[UserClaims, Depends(get_token_claims)],
+    job_id: UUID = Path(description='Id of the job'),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """
+    Returns the picture of a finished render job.
+
+    Raises:
+        HTTPException: 409 while the job is not done, or with the error of the job if it failed.
+    """
+    job = await get_user_job(current_user, job_id, db)
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=job.error_code or status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=job.error)
+    if job.status != JobStatus.DONE:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                            detail=e.message,)
-    except Exception as e:
-        print(str(e))
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail="there was an error processing your request. Try again later",)
-    FreePictureDB.add_freePicture_toDB(Free_picture(ip=request.client.host,
-                                                    quality=quality),
-                                       db=db)
+                            detail=f"The job is {job.status.value}, wait for it to finish")
+    headers = {
+        'Access-Control-Expose-Headers': 'Content-Disposition, picMaker-render-id',
+    }
+    if job.render_id is not None:
+        headers['picMaker-render-id'] = job.render_id
+    path = MakePicture(current_user).picture_path(job.filename)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Picture not found")
+    return RangeFileResponse(path, request_headers=request.headers, headers=headers,
+                             media_type="image/png", filename='example.png', method=request.method)
+
+
+@router.post('/mypicture/batch',
+             response_class=StreamingResponse,
+             status_code=status.HTTP_201_CREATED)
+async def get_my_pictures_batch(
+    current_user: Annotated[UserClaims, Depends(get_token_claims)],
+    pic_file: UploadFile,
+    specs: str = Form(description='JSON list of the pictures to render, every item has `quality` and optionally `colorCenter`, `colorOuter` and `colorBorder`',
+                      example='[{"quality": "thumbnail"}, {"quality": "high", "colorCenter": "navy", "colorOuter": "white"}]'),
+    db: AsyncSession = Depends(get_async_session),
+    index: int = Query(description='Which face in the picture will be used',
+                       default=1,
+                       ge=1, le=10),
+):
+    """
+    Endpoint for rendering several qualities and colors of an user picture with a single upload.  
+    The face is detected and segmented once and every picture is rendered from it.  
+
+    Parameters:  
+        - `pic_file` (UploadFile): The uploaded picture file.  
+        - `specs` (str, Form): JSON list of the pictures to render, at most `LIMIT_BATCH_SPECS`.  
+        - `index` (int, Query, optional): The index of the face in the picture to be used. Must be between 1 and 10. Defaults to 1.  
+
+    Returns:
+        - `StreamingResponse`: A zip file with one PNG per item of `specs`, named `<position>_<quality>.png`.
+    """
+    check_active(current_user)
+    check_content_type(pic_file)
+    try:
+        renderSpecs = parse_raw_as(List[RenderSpec], specs)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=e.errors(),)
+    if not 0 < len(renderSpecs) <= LIMIT_BATCH_SPECS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f'specs must have between 1 and {LIMIT_BATCH_SPECS} items',)
+
+    newPicture = MakePicture(current_user)
+
+    with render_errors():
+        async with spooled_upload(pic_file, 1024 * 1024 * LIMIT_SIZE_USER) as upload:
+            renders = await newPicture.make_user_pictures(db=db,
+                                                          upload=upload,
+                                                          specs=renderSpecs,
+                                                          index=(index-1))
 
     headers = {
-        'Access-Control-Expose-Headers': 'Content-Disposition',
-        'picMaker-pics-left-day': f'{LIMIT_FREE_PICTURES - nPics_ip}'
+        'Access-Control-Expose-Headers': 'Content-Disposition, picMaker-render-ids',
+        'Content-Disposition': 'attachment; filename="pictures.zip"',
+        'picMaker-render-ids': ','.join(dict.fromkeys(render.render_id for render in renders)),
     }
-    return FileResponse(pic_path, headers=headers, media_type="image/png", filename='example.png')
+    names = [f'{position}_{spec.quality.value}.png' for position, spec in enumerate(renderSpecs, start=1)]
+    return StreamingResponse(zip_pictures(renders, names), status_code=status.HTTP_201_CREATED,
+                             headers=headers, media_type='application/zip')
 
 
 @router.post('/mypicture/{quality}',
              response_class=FileResponse,
              status_code=status.HTTP_201_CREATED)
 async def get_my_picture(
-    current_user: Annotated[User, Depends(get_current_user)],
+    request: Request,
+    format: Annotated[PictureFormat, Depends(accepted_format)],
+    current_user: Annotated[UserClaims, Depends(get_token_claims)],
     pic_file: UploadFile,
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_async_session),
     index: int = Query(description='Which face in the picture will be used',
                        default=1,
                        ge=1, le=10),
@@ -112,7 +521,11 @@ async def get_my_picture(
     colorOuter: Color = Query(description='Outer Color, the value could be RGB or HEX as CSS3 standard https://www.w3.org/TR/css-color-3/#svg-color',
                               default='white'),
     colorBorder: Annotated[Union[Color, None],
-                           Query(description='Border Color to use, Default = None')] = None
+                           Query(description='Border Color to use, Default = None')] = None,
+    derive: List[QualityType] = Query(description='Other qualities to store, they are downsampled from a single render at the biggest quality',
+                                      default=[]),
+    asJob: bool = Query(description='Render in the background, the response is the job to follow',
+                        default=False),
 ):
     """
     Endpoint for uploading an user picture.  
@@ -123,48 +536,142 @@ async def get_my_picture(
         - `colorCenter` (Color, Query, optional): The center color. The value could be RGB or HEX as per the CSS3 standard. Defaults to 'black'.  
         - `colorOuter` (Color, Query, optional): The outer color. The value could be RGB or HEX as per the CSS3 standard. Defaults to 'white'.  
         - `colorBorder` (Union[Color, None], Query, optional): The border color to use. Defaults to None.  
+        - `derive` (List[QualityType], Query, optional): Other qualities to store along, rendered once and downsampled. Defaults to none.  
+        - `asJob` (bool, Query, optional): Render in the background. Defaults to False.  
         - `picture_file` (UploadFile): The uploaded picture file.  
 
     Returns:
-        - `FileResponse`: The response object containing the uploaded picture.
+        - `FileResponse`: The response object containing the uploaded picture.  
+        - `JSONResponse`: With `asJob`, a 202 response with the job, follow it on `/pictures/jobs/{job_id}`.
     """
-    if current_user.is_active is False:
+    check_active(current_user)
+    check_content_type(pic_file)
+
+    if asJob:
+        return await submit_render_job(current_user, pic_file, db,
+                                       (colorCenter, colorOuter), colorBorder,
+                                       quality, index-1)
+
+    newPicture = MakePicture(current_user)
+
+    with render_errors():
+        async with spooled_upload(pic_file, 1024 * 1024 * LIMIT_SIZE_USER) as upload:
+            render = await newPicture.make_user_picture(
+                db=db,
+                upload=upload,
+                colorsModel=(colorCenter,
+                             colorOuter),
+                BorderColor=colorBorder,
+                quality=quality,
+                index=(index-1),
+                derivatives=derive)
+
+    headers = {
+        'Access-Control-Expose-Headers': 'Content-Disposition, picMaker-render-id, picMaker-pic-url',
+    }
+    if render.picture_id is not None:
+        headers['picMaker-pic-url'] = picture_url(request, render.picture_id)
+    # derived pictures are recolored from the picture they come from
+    if render.render_id is not None:
+        headers['picMaker-render-id'] = render.render_id
+    return await picture_response(render, format, headers, filename='example.png')
+
+
+@router.post('/example/recolor/{render_id}',
+             response_class=FileResponse,
+             status_code=status.HTTP_201_CREATED)
+async def example_recolor(
+    request: Request,
+    format: Annotated[PictureFormat, Depends(accepted_format)],
+    render_id: str = Path(description='picMaker-render-id header of a previous picture',
+                          pattern=RENDER_ID_REGEX),
+    colorCenter: Color = Query(description='Center Color, the value could be RGB or HEX as CSS3 standard https://www.w3.org/TR/css-color-3/#svg-color',
+                               default='black'),
+    colorOuter: Color = Query(description='Outer Color, the value could be RGB or HEX as CSS3 standard https://www.w3.org/TR/css-color-3/#svg-color',
+                              default='white'),
+    colorBorder: Annotated[Union[Color, None],
+                           Query(description='Border Color to use, Default = None')] = None
+):
+    """
+    Renders again a previous example picture with other colors, without uploading it again.  
+
+    Parameters:  
+        - `render_id` (str, Path): The `picMaker-render-id` header returned with the previous picture.  
+        - `colorCenter` (Color, Query, optional): The center color. Defaults to 'black'.  
+        - `colorOuter` (Color, Query, optional): The outer color. Defaults to 'white'.  
+        - `colorBorder` (Union[Color, None], Query, optional): The border color to use. Defaults to None.  
+
+    Returns:
+        - `FileResponse`: The response object containing the picture.
+    """
+    quality = MakePicture.render_quality(render_id)
+    if quality not in list(FreeQualityType):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="User disabled, please contact admin")
-    if pic_file.content_type not in ("image/jpeg", "image/png"):
-        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-                            detail="Unsupported content type. Supported content types are 'image/jpeg' or 'image/png'",)
-    if pic_file.size > 1024 * 1024 * LIMIT_SIZE_USER:     # 15MB
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f'File size is too large, the limit is {LIMIT_SIZE_USER} MB',
-        )
+                            detail=f'The quality {quality.value} is only for registered users',)
+
+    with counted_free_picture(request) as pics_left, render_errors():
+        render = await MakePicture.recolor_picture(render_id=render_id,
+                                                   colorsModel=(colorCenter,
+                                                                colorOuter),
+                                                   BorderColor=colorBorder)
+    await free_picture_log.add(Free_picture(ip=request.client.host,
+                                            quality=FreeQualityType(quality.value)))
+
+    headers = {
+        'Access-Control-Expose-Headers': 'Content-Disposition, picMaker-render-id',
+        'picMaker-pics-left-day': f'{pics_left}',
+        'picMaker-render-id': render.render_id,
+    }
+    return await picture_response(render, format, headers, filename='example.png')
+
+
+@router.post('/mypicture/recolor/{render_id}',
+             response_class=FileResponse,
+             status_code=status.HTTP_201_CREATED)
+async def recolor_my_picture(
+    request: Request,
+    format: Annotated[PictureFormat, Depends(accepted_format)],
+    current_user: Annotated[UserClaims, Depends(get_token_claims)],
+    render_id: str = Path(description='picMaker-render-id header of a previous picture',
+                          pattern=RENDER_ID_REGEX),
+    db: AsyncSession = Depends(get_async_session),
+    colorCenter: Color = Query(description='Center Color, the value could be RGB or HEX as CSS3 standard https://www.w3.org/TR/css-color-3/#svg-color',
+                               default='black'),
+    colorOuter: Color = Query(description='Outer Color, the value could be RGB or HEX as CSS3 standard https://www.w3.org/TR/css-color-3/#svg-color',
+                              default='white'),
+    colorBorder: Annotated[Union[Color, None],
+                           Query(description='Border Color to use, Default = None')] = None
+):
+    """
+    Renders again a previous user picture with other colors, without uploading it again.  
+
+    Parameters:  
+        - `render_id` (str, Path): The `picMaker-render-id` header returned with the previous picture.  
+        - `colorCenter` (Color, Query, optional): The center color. Defaults to 'black'.  
+        - `colorOuter` (Color, Query, optional): The outer color. Defaults to 'white'.  
+        - `colorBorder` (Union[Color, None], Query, optional): The border color to use. Defaults to None.  
+
+    Returns:
+        - `FileResponse`: The response object containing the picture.
+    """
+    check_active(current_user)
 
     newPicture = MakePicture(current_user)
 
-    try:
-        pic_path = await newPicture.make_user_picture(
-            session=db,
-            pic_file=pic_file,
-            colorsModel=(colorCenter,
-                         colorOuter),
-            BorderColor=colorBorder,
-            quality=quality,
-            index=(index-1))
-
-        headers = {
-            'Access-Control-Expose-Headers': 'Content-Disposition',
-            'picMaker-pic-url': 'this will be the url of the picture on the Quality selected'
-        }
-        return FileResponse(pic_path, headers=headers, media_type="image/png", filename='example.png')
-
-    except NoFaceException as e:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                            detail=e.message,)
-    except Exception as e:
-        print(str(e))
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail="there was an error processing your request. Try again later",)
+    with render_errors():
+        render = await newPicture.recolor_user_picture(db=db,
+                                                       render_id=render_id,
+                                                       colorsModel=(colorCenter,
+                                                                    colorOuter),
+                                                       BorderColor=colorBorder)
+
+    headers = {
+        'Access-Control-Expose-Headers': 'Content-Disposition, picMaker-render-id, picMaker-pic-url',
+        'picMaker-render-id': render.render_id,
+    }
+    if render.picture_id is not None:
+        headers['picMaker-pic-url'] = picture_url(request, render.picture_id)
+    return await picture_response(render, format, headers, filename='example.png')
 
 
 @router.post('/removebg/{quality}',
@@ -172,9 +679,9 @@ async def get_my_picture(
              status_code=status.HTTP_201_CREATED)
 async def removeBG(
     request: Request,
+    format: Annotated[PictureFormat, Depends(accepted_format)],
     picture_file: UploadFile,
     quality: Annotated[FreeQualityType, Path(title="The ID of the item to get", description='Quality to use')],
-    db: Session = Depends(get_session)
     # qualityOld: FreeQualityType = Path(description='Quality to use'),
 ):
     """
@@ -194,33 +701,74 @@ async def removeBG(
         - HTTPException: If there is an error processing the picture file.
     """
 
-    nPics_ip = FreePictureDB.get_count_ip_date(ip=request.client.host,
-                                               date=datetime.now(),
-                                               db=db)
-    print(f'{request.client.host}: Number of pictures: {nPics_ip}')
-    if nPics_ip > LIMIT_FREE_PICTURES:
-        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
-                            detail=f'You have reached the limit of {LIMIT_FREE_PICTURES} pictures by day. Please register your user to get unlimited pictures',)
-
-    if picture_file.content_type not in ("image/jpeg", "image/png"):
-        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-                            detail="Unsupported content type. Supported content types are 'image/jpeg' or 'image/png'",)
-    if picture_file.size > 1024 * 1024 * LIMIT_SIZE_FREE:     # 3MB
-        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                            detail=f'File size is too large, the limit is {LIMIT_SIZE_FREE}MB',)
+    check_content_type(picture_file)
 
-    try:
-        pic_path = await MakePicture.removeBG_picture(pic_file=picture_file,
-                                                      quality=quality)
-    except Exception as e:
-        print(str(e))
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail="there was an error processing your request. Try again later",)
-    FreePictureDB.add_freePicture_toDB(Free_picture(ip=request.client.host,
-                                                    quality=quality),
-                                       db=db)
+    with counted_free_picture(request) as pics_left, render_errors():
+        async with spooled_upload(picture_file, 1024 * 1024 * LIMIT_SIZE_FREE) as upload:
+            render = await MakePicture.removeBG_picture(upload=upload,
+                                                        quality=quality)
+    await free_picture_log.add(Free_picture(ip=request.client.host,
+                                            quality=quality))
     headers = {
         'Access-Control-Expose-Headers': 'Content-Disposition, PicMaker-pics-left',
-        'PicMaker-pics-left': f'{(LIMIT_FREE_PICTURES - nPics_ip)}',
+        'PicMaker-pics-left': f'{pics_left}',
     }
-    return FileResponse(pic_path, headers=headers, media_type="image/png", filename='response.png')
+    return await picture_response(render, format, headers, filename='response.png')
+
+
+@router.get('/mine',
+            response_model=PicturePage,
+            status_code=status.HTTP_200_OK)
+async def get_my_pictures(
+    request: Request,
+    current_user: Annotated[UserClaims, Depends(get_token_claims)],
+    db: AsyncSession = Depends(get_async_session),
+    limit: int = Query(description='Pictures per page',
+                       default=50,
+                       ge=1, le=100),
+    cursor: Union[str, None] = Query(description='`next_cursor` of the previous page',
+                                     default=None),
+):
+    """
+    Lists the stored pictures of the user, newest first.  
+
+    Parameters:  
+        - `limit` (int, Query, optional): Pictures per page, at most 100. Defaults to 50.  
+        - `cursor` (str, Query, optional): The `next_cursor` of the previous page.  
+
+    Returns:
+        - `PicturePage`: The pictures with their urls and the cursor of the next page, null on the last one.
+    """
+    pictures = await PictureDB.get_user_pictures_async(current_user.id,
+                                                       db,
+                                                       limit=limit,
+                                                       before=decode_cursor(cursor) if cursor is not None else None)
+    return PicturePage(pictures=[PictureFB(id=picture.id,
+                                           type_picture=picture.type_picture,
+                                           initDate=picture.initDate,
+                                           url=picture_url(request, picture.id))
+                                 for picture in pictures],
+                       next_cursor=encode_cursor(pictures[-1]) if len(pictures) == limit else None)
+
+
+@router.get('/mine/{picture_id}',
+            response_class=FileResponse,
+            status_code=status.HTTP_200_OK)
+async def get_stored_picture(
+    request: Request,
+    current_user: Annotated[UserClaims, Depends(get_token_claims)],
+    picture_id: int = Path(description='Id of the picture'),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """
+    Returns a stored picture of the user. Responses carry an `ETag`, strong
+    for the pictures of the object store, and `Last-Modified`, revalidations
+    get a 304 without the picture.
+    """
+    picture = await PictureDB.get_user_picture_async(current_user.id, picture_id, db)
+    path = MakePicture(current_user).picture_path(picture.filename) if picture is not None else None
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Picture not found")
+    etag = f'"{picture.filename}"' if is_content_key(picture.filename) else None
+    return stored_picture_response(request, path, etag=etag)
@@ -3,15 +3,16 @@ from fastapi import APIRouter, status, HTTPException
 from fastapi import Depends, Body, Form
 from fastapi.responses import JSONResponse
 # SQLModel
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import IntegrityError
 #Python
 from typing import Annotated
 from pydantic import SecretStr
 # APP
 from app.models.user import User, UserCreate, UserUpdate, UserFB
-from app.DB.db import get_session
-from app.security.secureuser import verify_password, get_password_hash, get_current_user
+from app.DB.db import get_async_session
+from app.security.secureuser import get_current_user, forget_user, revoke_tokens, hasher_busy_exception
+from app.security.hasher import HasherBusyException, password_hasher
 
 router = APIRouter()
 
@@ -19,7 +20,7 @@ router = APIRouter()
                    response_model=UserFB, 
                    status_code=status.HTTP_201_CREATED)
 async def create_user(user: UserCreate = Body(), 
-                session: Session = Depends(get_session)) -> dict:
+                session: AsyncSession = Depends(get_async_session)) -> dict:
     """
     Creates a new user and adds it to the database. Accepts a user object as a Body parameter in the request. 
     The function returns a dictionary representation of the newly created user
@@ -27,23 +28,29 @@ async def create_user(user: UserCreate = Body(),
     If there is an internal error while creating the user, it raises an HTTPException with a status code of 400. 
 
     :param user: UserCreate object. Required. 
-    :param session: Session object. Required.
+    :param session: AsyncSession object. Required.
     :return: A dictionary representation of the newly created user
     :raises HTTPException 409: If the user already exists.
     :raises HTTPException 400: If there is an internal error while creating the user.
+    :raises HTTPException 429: If the server is busy hashing other passwords.
     """
     userDict = user.dict()
-    userDict.update({'pass_hash' : get_password_hash(user.password.get_secret_value())})
+    try:
+        userDict.update({'pass_hash' : await password_hasher.hash(user.password.get_secret_value())})
+    except HasherBusyException as e:
+        raise hasher_busy_exception(e)
 
     try:
         user_db = User.from_orm(User(**userDict))
         session.add(user_db)
-        session.commit()
-        session.refresh(user_db)
+        await session.commit()
+        await session.refresh(user_db)
         # print(str(user_db))
     except IntegrityError:
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User already exists")
     except Exception as e:
+        await session.rollback()
         print("Error Creating User:"+str(e))
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Internal Error")
     return UserFB(**user_db.dict())
@@ -65,7 +72,7 @@ async def info_User(current_user: Annotated[User, Depends(get_current_user)]):
                   status_code=status.HTTP_200_OK)
 async def update_user(current_user: Annotated[User, Depends(get_current_user)],
                 newData: UserUpdate = Body(),
-                session: Session = Depends(get_session)) -> dict:
+                session: AsyncSession = Depends(get_async_session)) -> dict:
     """
     Updates the user information for the user with the given user ID. 
 
@@ -77,13 +84,14 @@ async def update_user(current_user: Annotated[User, Depends(get_current_user)],
         A dictionary containing the updated user information.
     """
     newData_dict = newData.dict(exclude_unset=True)
-    user_db = session.get(User,current_user.id)
+    user_db = await session.get(User,current_user.id)
     for key, value in newData_dict.items():
         # print(f'key:{key} value:{value}')
         setattr(user_db,key,value)
     session.add(user_db)
-    session.commit()
-    session.refresh(user_db)
+    await session.commit()
+    await session.refresh(user_db)
+    forget_user(current_user.email)
     return UserFB(**user_db.dict())
     return JSONResponse(content={'message':f'User id:{id} updated correctly'},status_code=status.HTTP_200_OK)
 
@@ -91,20 +99,21 @@ async def update_user(current_user: Annotated[User, Depends(get_current_user)],
                response_model=dict,
                status_code=status.HTTP_200_OK)
 async def disable_user(current_user: Annotated[User, Depends(get_current_user)],
-                session: Session = Depends(get_session)) -> dict:
+                session: AsyncSession = Depends(get_async_session)) -> dict:
     """
     Deletes a user from the database by setting their 'is_active' attribute to False.
     
     Args:
         current_user (Annotated[User, Depends(get_current_user)]): The current user making the request.
-        session (Session, optional): The SQLAlchemy session object. Defaults to Depends(get_session).
+        session (AsyncSession, optional): The SQLAlchemy session object. Defaults to Depends(get_async_session).
         
     Returns:
         dict: A JSON response containing a message indicating the user was deleted, and a 200 HTTP status code.
     """
-    user_db = session.get(User, current_user.id)
+    user_db = await session.get(User, current_user.id)
     setattr(user_db,'is_active',False)
-    session.commit()
+    await session.commit()
+    revoke_tokens(current_user.email)
     return JSONResponse(content={'message':f'User id:{str(current_user.id)} disabled'},status_code=status.HTTP_200_OK)
 
 @router.put(path='/myuser/changepassword', 
@@ -113,7 +122,7 @@ async def disable_user(current_user: Annotated[User, Depends(get_current_user)],
 async def update_password_user(current_user: Annotated[User, Depends(get_current_user)],
                          actual_password: SecretStr = Form(min_length=8, max_length=35),
                          new_password: SecretStr = Form(min_length=8, max_length=35),
-                         session: Session = Depends(get_session)) -> dict:
+                         session: AsyncSession = Depends(get_async_session)) -> dict:
     """
     Updates the password of the current user.
 
@@ -121,20 +130,28 @@ async def update_password_user(current_user: Annotated[User, Depends(get_current
         current_user (Annotated[User, Depends(get_current_user)]): The current user.
         actual_password (SecretStr, optional): The current password. Defaults to Form(min_length=8, max_length=35).
         new_password (SecretStr, optional): The new password. Defaults to Form(min_length=8, max_length=35).
-        session (Session, optional): The database session. Defaults to Depends(get_session).
+        session (AsyncSession, optional): The database session. Defaults to Depends(get_async_session).
 
     Returns:
         dict: A JSON response with a message and status code.
     Raises:
-        HTTPException: If there is an error updating the password or if the actual password is incorrect.
+        HTTPException: If there is an error updating the password, if the actual password is incorrect
+            or if the server is busy hashing other passwords.
     """
-    if (verify_password(actual_password.get_secret_value(), current_user.pass_hash)):
+    try:
+        valid = await password_hasher.verify(actual_password.get_secret_value(), current_user.pass_hash)
+        if valid:
+            new_hash = await password_hasher.hash(new_password.get_secret_value())
+    except HasherBusyException as e:
+        raise hasher_busy_exception(e)
+    if valid:
         try:
-            user_db = session.get(User,current_user.id)
-            setattr(user_db,'pass_hash',get_password_hash(new_password.get_secret_value()))
+            user_db = await session.get(User,current_user.id)
+            setattr(user_db,'pass_hash',new_hash)
             session.add(user_db)
-            session.commit()
-            session.refresh(user_db)
+            await session.commit()
+            await session.refresh(user_db)
+            forget_user(current_user.email)
             return JSONResponse(content={'message':f'User id:{str(current_user.id)} password updated'},
                                 status_code=status.HTTP_200_OK)
         except IntegrityError:
@@ -0,0 +1,81 @@
+# PassLib
+from passlib.context import CryptContext
+# Python
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+import asyncio
+import os
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))  # Cost factor, every +1 doubles the time of a hash
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', 2))  # Hashes computed at the same time
+HASH_QUEUE_SIZE = int(os.getenv('HASH_QUEUE_SIZE', 16))  # Hashes waiting or running
+
+
+class HasherBusyException(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords on a thread pool, bcrypt releases the GIL so
+    the event loop keeps serving other requests meanwhile.
+
+    At most `queue_size` passwords can be waiting or running, the next ones fail
+    at once with HasherBusyException instead of piling up behind a burst of logins.
+    """
+
+    def __init__(self,
+                 context: CryptContext,
+                 workers: int = HASH_WORKERS,
+                 queue_size: int = HASH_QUEUE_SIZE) -> None:
+        self.context = context
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _run(self, func: Callable, *args):
+        if self._pending >= self.queue_size:
+            raise HasherBusyException("The server is busy processing other logins. Try again later")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='hasher')
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password.encode('utf-8'))
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password.encode('utf-8'),
+                               hashed_password.encode('utf-8'))
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifies the password and, if the hash is outdated (e.g. BCRYPT_ROUNDS
+        changed), hashes it again with the current settings.
+
+        Returns:
+            Tuple[bool, Optional[str]]: If the password is valid and the new hash,
+            None if the hash is up to date.
+        """
+        return await self._run(self.context.verify_and_update, password.encode('utf-8'),
+                               hashed_password.encode('utf-8'))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+password_hasher = PasswordHasher(pwd_context)
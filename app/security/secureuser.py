@@ -3,26 +3,70 @@ from fastapi import APIRouter, HTTPException, status
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 # SQLModel
-from sqlmodel import Session
-# PassLib
-from passlib.context import CryptContext
+from sqlmodel.ext.asyncio.session import AsyncSession
 # Jose
 from jose import jwt, JWTError
+# SQLAlchemy
+from sqlalchemy.orm import make_transient_to_detached
 # Pyhon
 from typing import Annotated, Union
 from datetime import datetime, timedelta
+import time
+import os
 # APP
 from app.security import URL_USER_LOGIN, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from app.DB.querys_users import get_userDB_by_email
-from app.DB.db import get_session
+from app.models.user import User, UserClaims
+from app.DB.querys_users import get_userDB_by_email_async
+from app.DB.db import get_async_session
+from app.dependencies.cache import TTLCache
+from app.security.hasher import HasherBusyException, password_hasher, pwd_context
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))  # Users
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))  # Seconds
+# Older claims are checked against the user, so a demoted or disabled user
+# loses its rights on every worker after CLAIMS_TTL + USER_CACHE_TTL at most
+CLAIMS_TTL = int(os.getenv('CLAIMS_TTL', 60))  # Seconds
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_User_scheme = OAuth2PasswordBearer(tokenUrl=URL_USER_LOGIN)
 
 router = APIRouter()
 
+# Users by token subject (e-mail), so authenticated requests don't query the DB
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# Claims of the tokens already decoded, kept until the token expires
+claims_cache = TTLCache(USER_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# Time the tokens of an e-mail were revoked, no token issued before lives longer
+revoked_tokens = TTLCache(USER_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                      detail="Could not validate credentials",
+                                      headers={"WWW-Authenticate": "Bearer"},)
+disabled_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                   detail="User disabled, please contact admin")
+
+
+def forget_user(email: str) -> None:
+    """
+    Drops the cached user of `email`, it must be called when the user is
+    updated or deleted.
+    """
+    user_cache.pop(email)
+
+
+def revoke_tokens(email: str) -> None:
+    """
+    Rejects on `get_token_claims` the tokens of `email` issued until now, for
+    users that were disabled or deleted. The denylist is kept by every worker
+    process, the other ones notice the change when they check the claims
+    against the user, see CLAIMS_TTL.
+    """
+    revoked_tokens.set(email, time.time())
+    forget_user(email)
+
+
 def verify_password(plain_password: str, hashed_password: str):
     """
+    Blocking, on requests use `password_hasher.verify`.
     Verify if a given plain password matches a hashed password using the PyJWT password context.
 
     :param plain_password: A string representing the plain password to be verified.
@@ -37,6 +81,7 @@ def verify_password(plain_password: str, hashed_password: str):
 
 def get_password_hash(password: str):
     """
+    Blocking, on requests use `password_hasher.hash`.
     Generates a hash of the input string password using the password hashing framework 
     pwd_context. 
 
@@ -47,10 +92,98 @@ def get_password_hash(password: str):
     """
     return pwd_context.hash(password.encode('utf-8'))
 
+def hasher_busy_exception(e: HasherBusyException) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                         detail=e.message,
+                         headers={"Retry-After": "1"})
+
+def decode_token(token: str) -> dict:
+    """
+    Returns the claims of a valid token. The tokens are only decoded the first
+    time they are seen.
+
+    :raises HTTPException: If the token could not be validated.
+    """
+    payload = claims_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise credentials_exception
+        if payload.get("sub") is None:
+            raise credentials_exception
+        claims_cache.set(token, payload, ttl=payload["exp"] - time.time())
+    return payload
+
+async def load_user(email: str, session: AsyncSession) -> User:
+    """
+    Returns the user of `email` from the cache or the database.
+
+    :raises HTTPException: If the user does not exist.
+    """
+    user = user_cache.get(email)
+    if user is None:
+        user_db = await get_userDB_by_email_async(username=email, session=session)
+        if user_db is None:
+            raise credentials_exception
+        # a copy, the cached user is shared by requests with different sessions
+        user = User(**user_db.dict())
+        make_transient_to_detached(user)
+        user_cache.set(email, user)
+    return user
+
+async def get_token_claims(token: Annotated[str, Depends(oauth2_User_scheme)],
+                           session: AsyncSession = Depends(get_async_session)) -> UserClaims:
+    """
+    Authorizes a request with the claims of its bearer token. The claims of
+    tokens older than CLAIMS_TTL are checked against the cached user, the
+    database is only queried when the user is not cached. Use
+    `get_current_user` when the user itself is needed.
+
+    :param token: The bearer token used to authenticate the request.
+    :type token: Annotated[str, Depends(oauth2_User_scheme)]
+    :raises HTTPException: If the token could not be validated, has no role claims,
+                           was revoked or its user is disabled.
+    :return: The user as the token tells it.
+    :rtype: UserClaims
+    """
+    payload = decode_token(token)
+    if "uid" not in payload or "role" not in payload:
+        # issued before the tokens had the claims, the user must log in again
+        raise credentials_exception
+    # the claims can be older than the user, the users disabled or deleted since are denied here
+    revoked = revoked_tokens.get(payload["sub"])
+    if revoked is not None and payload.get("iat", 0) <= revoked:
+        raise credentials_exception
+    claims = UserClaims(id=payload["uid"],
+                        email=payload["sub"],
+                        userType=payload["role"],
+                        is_active=payload.get("active", True))
+    if time.time() - payload.get("iat", 0) > CLAIMS_TTL:
+        # the role or the status may have changed on another worker
+        user = await load_user(claims.email, session)
+        claims.userType, claims.is_active = user.userType, user.is_active
+    if not claims.is_active:
+        raise disabled_exception
+    return claims
+
+async def require_admin(claims: Annotated[UserClaims, Depends(get_token_claims)]) -> UserClaims:
+    """
+    Authorizes the admin routes from the token claims.
+
+    :raises HTTPException: If the user of the token is not an active admin.
+    """
+    if claims.userType != 'admin' or not claims.is_active:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
+                            detail="User Unauthorized")
+    return claims
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_User_scheme)], 
-                           session: Session = Depends(get_session)):
+                           session: AsyncSession = Depends(get_async_session)):
     """
     Asynchronously retrieves a user object from the database based on the provided bearer token.
+    The decoded token and the user are cached, so most requests don't query the database.
+    The user returned is detached from the session, use `session.get` to update it.
 
     :param token: The bearer token used to authenticate the request.
     :type token: Annotated[str, Depends(oauth2_User_scheme)]
@@ -58,20 +191,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_User_scheme)],
     :return: A User object representing the authenticated user.
     :rtype: User
     """
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                          detail="Could not validate credentials",
-                                          headers={"WWW-Authenticate": "Bearer"},)
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = get_userDB_by_email(username=username,session=session)
-    if user is None:
-        raise credentials_exception
-    return user
+    return await load_user(decode_token(token)["sub"], session)
 
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
     """
@@ -89,7 +209,7 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=5)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": time.time()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -98,7 +218,7 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
                   response_model=dict,
                   tags=["Users"])
 async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-          session: Session = Depends(get_session)):
+          session: AsyncSession = Depends(get_async_session)):
     """
     Authenticates a user by checking the validity of their provided credentials 
     and returns an access token if successful.
@@ -106,19 +226,32 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     :param form_data: The OAuth2PasswordRequestForm containing the user's login 
                       credentials.
     :type form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
-    :raises HTTPException: If the user's credentials are invalid.
+    :raises HTTPException: If the user's credentials are invalid, the user is disabled
+                           or the server is busy hashing passwords.
     :return: A dictionary containing the user's access token and its bearer type.
     :rtype: Dict[str, str]
     """
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                          detail="Could not validate credentials",
-                                          headers={"WWW-Authenticate": "Bearer"},)
-    user_db = get_userDB_by_email(form_data.username, session)
+    user_db = await get_userDB_by_email_async(form_data.username, session)
 
     if user_db is None:
         raise credentials_exception
-    if not verify_password(form_data.password, user_db.pass_hash):
+    try:
+        valid, new_hash = await password_hasher.verify_and_update(form_data.password, user_db.pass_hash)
+    except HasherBusyException as e:
+        raise hasher_busy_exception(e)
+    if not valid:
         raise credentials_exception
-    access_token = create_access_token(data={"sub": user_db.email}, 
+    if not user_db.is_active:
+        raise disabled_exception
+    if new_hash is not None:
+        # the hash was made with older settings, the password is only known now
+        user_db.pass_hash = new_hash
+        session.add(user_db)
+        await session.commit()
+        forget_user(user_db.email)
+    access_token = create_access_token(data={"sub": user_db.email,
+                                             "uid": str(user_db.id),
+                                             "role": user_db.userType,
+                                             "active": user_db.is_active}, 
                                        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""
+Time of every compositing step after the segmentation and of the fused
+`compose` for every QualityType size. `cold` is the first render of a size,
+when its gradient and masks are built, `warm` the next ones.
+
+    python -m benchmarks.bench_compositing [--runs 20]
+"""
+# APP
+from app.dependencies import compositing
+from benchmarks.bench_encode import SIZES, synthetic_face
+# Python
+import argparse
+import time
+
+COLORS = ((0, 0, 0), (255, 255, 255))
+BORDER = (200, 30, 30)
+
+
+def clear_caches() -> None:
+    for field in (compositing.gradient_field, compositing.contour_mask, compositing.ring_pixels,
+                  compositing.blur_mask, compositing.composed_alpha):
+        field.cache_clear()
+
+
+def time_step(step, runs: int):
+    clear_caches()
+    start = time.perf_counter()
+    step()
+    cold = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for _ in range(runs):
+        step()
+    return cold, (time.perf_counter() - start) / runs * 1000
+
+
+def main(runs: int) -> None:
+    print(f"{'quality':<10} {'step':<16} {'cold ms':>9} {'warm ms':>9}")
+    for quality, size in SIZES.items():
+        face = synthetic_face(size)
+        background = compositing.add_background(face, *COLORS)
+        contour = compositing.set_contour(background)
+        inset = compositing.edge_width(face.size, compositing.BLUR) // 2
+        bordered = compositing.set_border(contour, BORDER, inset=inset)
+        steps = [
+            ('add_background', lambda: compositing.add_background(face, *COLORS)),
+            ('set_contour', lambda: compositing.set_contour(background)),
+            ('set_border', lambda: compositing.set_border(contour, BORDER, inset=inset)),
+            ('set_blur', lambda: compositing.set_blur(bordered)),
+            ('steps', lambda: compositing.set_blur(compositing.set_border(compositing.set_contour(
+                compositing.add_background(face, *COLORS)), BORDER, inset=inset))),
+            ('compose', lambda: compositing.compose(face, COLORS, BORDER)),
+        ]
+        for name, step in steps:
+            cold, warm = time_step(step, runs)
+            print(f'{quality.value:<10} {name:<16} {cold:>9.2f} {warm:>9.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=20)
+    main(parser.parse_args().runs)
@@ -0,0 +1,68 @@
+"""
+Compares the responses used to send pictures: the FileResponse of Starlette,
+RangeFileResponse and a Response with the picture in memory. Every response
+is sent to a no-op ASGI `send`, so only the cost of producing the body is
+measured, not the network. The zero-copy path is not measured: uvicorn never
+offers it and a no-op `send` would not transfer its bytes.
+
+    python -m benchmarks.bench_responses [--size-mb 8] [--runs 50]
+"""
+# Starlette
+from starlette.responses import FileResponse, Response
+# APP
+from app.dependencies.responses import RangeFileResponse
+# Python
+import argparse
+import tempfile
+import asyncio
+import time
+import os
+
+
+async def receive() -> dict:
+    return {'type': 'http.disconnect'}
+
+
+async def send_response(response, scope: dict) -> int:
+    sent = 0
+
+    async def send(message: dict) -> None:
+        nonlocal sent
+        sent += len(message.get('body', b''))
+    await response(scope, receive, send)
+    return sent
+
+
+async def bench(name: str, make_response, runs: int, scope: dict) -> None:
+    sent = 0
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(runs):
+        sent += await send_response(make_response(), scope)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    print(f'{name:<28} {sent / wall / 1024 / 1024:>10.1f} MB/s {cpu / runs * 1000:>10.2f} ms CPU/response')
+
+
+async def main(size_mb: int, runs: int) -> None:
+    data = os.urandom(size_mb * 1024 * 1024)
+    fd, path = tempfile.mkstemp(suffix='.png')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    scope = {'type': 'http', 'method': 'GET', 'headers': [], 'extensions': {}}
+    try:
+        print(f'{size_mb} MB picture, {runs} responses each')
+        await bench('FileResponse', lambda: FileResponse(path, media_type='image/png'), runs, scope)
+        await bench('RangeFileResponse', lambda: RangeFileResponse(path, media_type='image/png'), runs, scope)
+        await bench('RangeFileResponse range 1MB',
+                    lambda: RangeFileResponse(path, {'range': 'bytes=0-1048575'}, media_type='image/png'),
+                    runs, scope)
+        await bench('Response in memory', lambda: Response(data, media_type='image/png'), runs, scope)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size-mb', type=int, default=8)
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.size_mb, args.runs))
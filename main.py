@@ -4,14 +4,30 @@ from fastapi.responses import HTMLResponse,JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 # APP
 from app.routers import imagesRouter, usersRouter, adminRouter
+from app.middlewares.limits import BodySizeLimitMiddleware
 from app.security import secureuser
+from app.security.hasher import password_hasher
 from app.DB.db import create_db_table
+from app.dependencies.engine import render_engine
+from app.dependencies.jobs import job_queue
+from app.dependencies.ratelimit import free_picture_log
+from app.dependencies.retention import retention_job
+from app.dependencies.artifacts import temp_artifacts
 # Python
 
 app = FastAPI()
 app.title = "Pic Profile Maker"
 app.version = "0.1.0"
 
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        '/pictures/example': 1024 * 1024 * imagesRouter.LIMIT_SIZE_FREE + imagesRouter.MULTIPART_OVERHEAD,
+        '/pictures/removebg': 1024 * 1024 * imagesRouter.LIMIT_SIZE_FREE + imagesRouter.MULTIPART_OVERHEAD,
+        '/pictures/mypicture': 1024 * 1024 * imagesRouter.LIMIT_SIZE_USER + imagesRouter.MULTIPART_OVERHEAD,
+    },
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -34,11 +50,43 @@ app.include_router(secureuser.router)
 @app.on_event('startup')
 async def on_startup():
     """
-    Initializes the app on startup and creates a database table.
+    Initializes the app on startup, creates a database table, removes the
+    temporary files of previous runs, starts the render workers with their
+    rembg models loaded and the render jobs.
     :param: None
     :return: None
     """
     create_db_table()
+    orphans = temp_artifacts.start()
+    if orphans:
+        print(f"Temporary files left by a previous run removed: {orphans}")
+    workers = await render_engine.start()
+    for worker in workers:
+        print(f"Render worker {worker['pid']}: models {worker['models']} "
+              f"loaded in {worker['seconds']:.2f}s, RSS {worker['rss_mb']:.0f} MB")
+    free_picture_log.start()
+    imagesRouter.free_limiter.start()
+    retention_job.start()
+    requeued = await job_queue.start()
+    if requeued:
+        print(f"Render jobs queued again: {requeued}")
+
+@app.on_event('shutdown')
+async def on_shutdown():
+    """
+    Stops the render jobs, the worker processes of the render engine and the
+    password hashers, writes the pending free picture records and rate limit
+    counters and removes the temporary files.
+    :param: None
+    :return: None
+    """
+    await job_queue.shutdown()
+    await free_picture_log.shutdown()
+    await imagesRouter.free_limiter.shutdown()
+    await retention_job.shutdown()
+    render_engine.shutdown()
+    password_hasher.shutdown()
+    await temp_artifacts.shutdown()
 
 @app.get(path="/",tags=["Home"])
 async def home():
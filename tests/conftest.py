@@ -1,18 +1,33 @@
 # pytest
 import pytest
+# Python
+import tempfile
+import shutil
+import os
+
+# The files written by the app during the tests (stored pictures, caches, jobs)
+# go to a temporary folder, it must be set before the app is imported
+TEST_OUTPUT_DIR = tempfile.mkdtemp(prefix='picmaker-tests-')
+for name, folder in [('STORAGE_DIR', 'storage'), ('STORAGE_CACHE_DIR', 'objects'), ('JOBS_DIR', 'jobs'),
+                     ('TEMP_DIR', 'tmp'), ('RENDER_CACHE_DIR', 'renders'), ('STAGE_CACHE_DIR', 'stages')]:
+    os.environ.setdefault(name, os.path.join(TEST_OUTPUT_DIR, folder))
+os.environ.setdefault('RATE_LIMIT_DB', os.path.join(TEST_OUTPUT_DIR, 'ratelimit.sqlite'))
+# ProfilePicMaker is not installed on the test runs, the app runs the native pipeline
+os.environ.setdefault('PICTURE_PIPELINE', 'native')
+
 # FastAPI
 from fastapi.testclient import TestClient
 # from httpx import AsyncClient
 # APP
 from app.models import MyModels
 from app.models.user import User, UserBase, UserFB, UserUpdate
-from app.security.secureuser import get_password_hash
-from app.DB.db import get_session
+from app.security.secureuser import get_password_hash, user_cache, claims_cache, revoked_tokens
+from app.DB.db import get_session, get_async_session
 from app.DB.querys_users import add_user_to_db
 # SQLModel
 from sqlmodel import Session, create_engine
-# Python
-import os
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 
 from main import app
 
@@ -24,6 +39,11 @@ test_engine = create_engine(DATABASE_URL,
                             connect_args={'check_same_thread': False}, 
                             echo = False)
 MyModels.metadata.create_all(test_engine)
+test_async_engine = create_async_engine(f'sqlite+aiosqlite:///{os.path.join(BASE_DIR,TEST_SQLITE_FILENAME)}',
+                                        echo = False)
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_OUTPUT_DIR, ignore_errors=True)
 
 def delete_db_file():
     os.remove(os.path.join(BASE_DIR, TEST_SQLITE_FILENAME))
@@ -32,7 +52,12 @@ def get_test_session():
     with Session(test_engine) as session:
         yield session
 
+async def get_test_async_session():
+    async with AsyncSession(test_async_engine, expire_on_commit=False) as session:
+        yield session
+
 app.dependency_overrides[get_session] = get_test_session
+app.dependency_overrides[get_async_session] = get_test_async_session
 
 @pytest.fixture(scope="class")
 def client() -> TestClient:
@@ -40,6 +65,9 @@ def client() -> TestClient:
     MyModels.metadata.create_all(test_engine)
     yield TestClient(app)
     delete_db_file()
+    # the users of the deleted DB must not outlive it
+    for cache in (user_cache, claims_cache, revoked_tokens):
+        cache.clear()
 
 @pytest.fixture(scope="class")
 def setUp_users():
@@ -0,0 +1,47 @@
+# pytest
+import pytest
+# APP
+from app.dependencies.artifacts import TempArtifacts
+# Python
+import time
+import os
+
+
+class TestTempArtifacts:
+    def test_released_files_are_removed(self, tmp_path):
+        artifacts = TempArtifacts(str(tmp_path), ttl=60)
+        fd, path = artifacts.new_file(suffix='.jpg')
+        os.close(fd)
+        artifacts.release(path)
+        assert not os.path.exists(path), "Released files must be removed"
+        assert artifacts.stats()['tracked'] == 0
+
+    def test_expired_files_are_swept(self, tmp_path):
+        artifacts = TempArtifacts(str(tmp_path), ttl=60)
+        fd, old_path = artifacts.new_file()
+        os.close(fd)
+        assert artifacts.sweep() == 0, "Files must live until they expire"
+        assert artifacts.sweep(now=time.monotonic() + 61) == 1
+        assert not os.path.exists(old_path), "Expired files must be removed"
+
+    def test_orphans_are_swept(self, tmp_path):
+        orphan = tmp_path / 'orphan.jpg'
+        orphan.write_bytes(b'x')
+        os.utime(orphan, (time.time() - 120, time.time() - 120))
+        recent = tmp_path / 'recent.jpg'
+        recent.write_bytes(b'x')
+        artifacts = TempArtifacts(str(tmp_path), ttl=60)
+        fd, tracked = artifacts.new_file()
+        os.close(fd)
+        os.utime(tracked, (time.time() - 120, time.time() - 120))
+        assert artifacts.sweep_orphans() == 1, "Only old files nobody tracks are orphans"
+        assert not orphan.exists() and recent.exists() and os.path.exists(tracked)
+
+    @pytest.mark.asyncio
+    async def test_shutdown_removes_tracked_files(self, tmp_path):
+        artifacts = TempArtifacts(str(tmp_path), ttl=60)
+        artifacts.start()
+        fd, path = artifacts.new_file()
+        os.close(fd)
+        await artifacts.shutdown()
+        assert not os.path.exists(path), "Tracked files must be removed on shutdown"
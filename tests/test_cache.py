@@ -0,0 +1,102 @@
+# APP
+from app.dependencies.cache import RenderCache, TTLCache
+# Python
+import time
+import os
+
+
+def write_file(path, size: int) -> str:
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+
+class TestRenderCache:
+    def test_hit_and_miss(self, tmp_path):
+        cache = RenderCache(str(tmp_path / 'cache'), max_bytes=1024)
+        key = RenderCache.make_key('hash', 'face', 'preview', 0, '#000', '#fff', None)
+        assert cache.get(key) is None, "Empty cache must miss"
+        cached_path = cache.put(key, write_file(tmp_path / 'pic.png', 10))
+        assert cache.get(key) == cached_path, "Cached render must hit"
+        assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    def test_lru_eviction(self, tmp_path):
+        cache = RenderCache(str(tmp_path / 'cache'), max_bytes=250, hold=0)
+        src = write_file(tmp_path / 'pic.png', 100)
+        cache.put('a', src)
+        time.sleep(0.02)  # mtimes have a few ms of resolution
+        cache.put('b', src)
+        time.sleep(0.02)
+        cache.get('a')
+        time.sleep(0.02)
+        cache.put('c', src)
+        assert cache.get('b') is None, "Least recently used entry must be evicted"
+        assert cache.get('a') is not None and cache.get('c') is not None
+        assert not os.path.exists(cache.path('b')), "Evicted file must be removed"
+
+    def test_entries_keep_their_suffix(self, tmp_path):
+        cache = RenderCache(str(tmp_path / 'cache'), max_bytes=1024)
+        path = cache.put_bytes('a', b'webp', suffix='.webp')
+        assert path.endswith('a.webp'), "Entries must be named after their format"
+        assert cache.get('a') is None and cache.get('a', '.webp') == path
+        cache = RenderCache(str(tmp_path / 'cache'), max_bytes=1024)
+        assert cache.stats()['entries'] == 1, "Entries of any suffix must count towards the size"
+        cache.delete('a', '.webp')
+        assert not os.path.exists(path)
+
+    def test_index_rebuilt_from_disk(self, tmp_path):
+        cache = RenderCache(str(tmp_path / 'cache'), max_bytes=1024)
+        cache.put('a', write_file(tmp_path / 'pic.png', 10))
+        cache = RenderCache(str(tmp_path / 'cache'), max_bytes=1024)
+        assert cache.get('a') is not None, "Entries must survive a restart"
+
+    def test_budget_is_shared_by_workers(self, tmp_path):
+        caches = [RenderCache(str(tmp_path / 'cache'), max_bytes=250, hold=0) for _ in range(2)]
+        src = write_file(tmp_path / 'pic.png', 100)
+        for key in 'abcd':
+            caches[ord(key) % 2].put(key, src)
+            time.sleep(0.02)
+        files = os.listdir(tmp_path / 'cache')
+        assert sum(os.path.getsize(tmp_path / 'cache' / name) for name in files) <= 250, \
+            "The entries of every worker must count towards the size"
+        assert caches[0].get('d') is not None, "Entries of other workers must hit"
+        assert caches[1].get('a') is None, "Least recently used entry of any worker must be evicted"
+
+    def test_used_entries_are_held(self, tmp_path):
+        cache = RenderCache(str(tmp_path / 'cache'), max_bytes=150, hold=60)
+        src = write_file(tmp_path / 'pic.png', 100)
+        path = cache.put('a', src)
+        cache.put('b', src)
+        assert os.path.exists(path), "Entries used within the hold period must not be evicted"
+        assert cache.stats()['size_bytes'] == 200
+
+    def test_leftovers_are_removed(self, tmp_path):
+        directory = tmp_path / 'cache'
+        directory.mkdir()
+        old = write_file(directory / 'tmpold', 10)
+        os.utime(old, (time.time() - 120, time.time() - 120))
+        recent = write_file(directory / 'tmprecent', 10)
+        RenderCache(str(directory), max_bytes=1024, hold=60)
+        assert not os.path.exists(old), "Leftovers of interrupted puts must be removed"
+        assert os.path.exists(recent), "Puts of other workers in progress must be kept"
+
+
+class TestTTLCache:
+    def test_lru_eviction(self):
+        cache = TTLCache(max_items=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None, "Least recently used entry must be evicted"
+        assert cache.get('a') == 1 and cache.get('c') == 3
+
+    def test_entries_expire(self):
+        cache = TTLCache(max_items=10, ttl=60)
+        cache.set('a', 1, ttl=0.01)
+        cache.set('b', 2, ttl=3600)
+        time.sleep(0.02)
+        assert cache.get('a') is None, "Entries must expire after their ttl"
+        assert cache._entries['b'][0] <= time.monotonic() + 60, "The ttl can't be longer than the cache one"
+        cache.pop('b')
+        assert cache.get('b') is None, "Popped entries must be dropped"
@@ -0,0 +1,49 @@
+# pytest
+import pytest
+# APP
+from app.dependencies import compositing
+# Python
+from PIL import Image
+import numpy as np
+import os
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'images', 'golden')
+# Colors and border of the golden pictures, rendered with the Pillow steps of
+# the native pipeline that came before the cached masks, they don't show
+# parity with ProfilePicMaker. 300x200 is a crop of segment_300.png
+GOLDEN_COLORS = {
+    '150': (((0, 0, 0), (255, 255, 255)), None),
+    '300': (((0, 0, 128), (255, 255, 255)), (255, 0, 0)),
+    '300x200': (((250, 3, 40), (7, 180, 99)), (200, 30, 30)),
+}
+
+
+def golden(name: str) -> Image.Image:
+    with Image.open(os.path.join(GOLDEN_DIR, name)) as image:
+        return image.convert('RGBA')
+
+
+class TestCompositing:
+    @pytest.mark.parametrize('size', sorted(GOLDEN_COLORS))
+    def test_compose_matches_golden(self, size):
+        colors, border = GOLDEN_COLORS[size]
+        picture = compositing.compose(golden(f'segment_{size}.png'), colors, border)
+        assert np.array_equal(np.asarray(picture), np.asarray(golden(f'compose_{size}.png'))), \
+            "Pictures must not change"
+
+    @pytest.mark.parametrize('size', sorted(GOLDEN_COLORS))
+    def test_steps_match_golden(self, size):
+        colors, border = GOLDEN_COLORS[size]
+        face = golden(f'segment_{size}.png')
+        picture = compositing.set_contour(compositing.add_background(face, *colors))
+        if border is not None:
+            picture = compositing.set_border(picture, border,
+                                             inset=compositing.edge_width(face.size, compositing.BLUR) // 2)
+        picture = compositing.set_blur(picture)
+        assert np.array_equal(np.asarray(picture), np.asarray(golden(f'compose_{size}.png'))), \
+            "Pictures must not change"
+
+    def test_fields_are_cached_and_read_only(self):
+        alpha = compositing.composed_alpha(300, 300, None)
+        assert compositing.composed_alpha(300, 300, None) is alpha, "The masks must be built once per size"
+        assert not alpha.flags.writeable, "Renders must not change the shared masks"
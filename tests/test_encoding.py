@@ -0,0 +1,63 @@
+# pytest
+import pytest
+# FastAPI
+from fastapi import HTTPException
+# APP
+from app.models.picture import PictureFormat, QualityType
+from app.dependencies.pipeline import QUALITY_SIZES, encode, quality_of, transcode
+from app.routers.imagesRouter import negotiate_format
+# Python
+from PIL import Image
+import io
+
+
+@pytest.fixture
+def transparent_png() -> bytes:
+    image = Image.new('RGBA', (QUALITY_SIZES[QualityType.THUMBNAIL], 64), (0, 0, 0, 0))
+    image.paste((200, 30, 30, 255), (16, 16, 48, 48))
+    return encode(image)
+
+
+class TestEncoding:
+    @pytest.mark.parametrize('accept, expected', [
+        (None, PictureFormat.PNG),
+        ('*/*', PictureFormat.PNG),
+        ('image/*', PictureFormat.PNG),
+        ('image/webp,image/png,*/*;q=0.8', PictureFormat.WEBP),
+        ('image/png;q=1, image/webp;q=0.5', PictureFormat.PNG),
+        ('image/jpeg', PictureFormat.JPEG),
+        ('image/webp;q=0, image/jpeg;q=0.9', PictureFormat.JPEG),
+        ('image/png;q=0, */*', PictureFormat.WEBP),
+        ('image/png;q=0, image/webp;q=0, */*;q=0.5', PictureFormat.JPEG),
+        ('image/*;q=0, */*', None),
+        ('text/html', None),
+        ('image/png;q=0', None),
+    ])
+    def test_negotiate_format(self, accept, expected):
+        if expected is None:
+            with pytest.raises(HTTPException) as error:
+                negotiate_format(accept)
+            assert error.value.status_code == 406, "Refused formats must not be sent"
+        else:
+            assert negotiate_format(accept) == expected
+
+    def test_quality_of(self):
+        for quality, size in QUALITY_SIZES.items():
+            assert quality_of(Image.new('RGB', (size, 10))) == quality
+        assert quality_of(Image.new('RGB', (max(QUALITY_SIZES.values()) + 1, 10))) == QualityType.FULLSIZE
+
+    def test_transcode_webp_keeps_alpha(self, transparent_png):
+        image = Image.open(io.BytesIO(transcode(transparent_png, PictureFormat.WEBP)))
+        assert image.format == 'WEBP'
+        assert image.mode == 'RGBA', "WebP must keep the transparency"
+
+    def test_transcode_jpeg_flattens_alpha(self, transparent_png):
+        image = Image.open(io.BytesIO(transcode(transparent_png, PictureFormat.JPEG)))
+        assert image.format == 'JPEG' and image.mode == 'RGB'
+        assert image.getpixel((0, 0)) == (255, 255, 255), "Transparent pixels must be white"
+
+    def test_fullsize_webp_is_lossless(self):
+        image = Image.new('RGBA', (QUALITY_SIZES[QualityType.HIGH] + 1, 8), (10, 200, 30, 255))
+        image.putpixel((0, 0), (255, 0, 0, 128))
+        decoded = Image.open(io.BytesIO(encode(image, PictureFormat.WEBP)))
+        assert decoded.tobytes() == image.tobytes(), "FULLSIZE must be encoded without loss"
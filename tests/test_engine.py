@@ -0,0 +1,113 @@
+# pytest
+import pytest
+# APP
+from app.dependencies.engine import RenderEngine, EngineBusyException, RenderCrashedException, RenderTimeoutException
+# Python
+import asyncio
+import time
+import os
+
+# Sessions built on the worker that imports this module
+_builds = []
+
+
+def fake_build_session(model_name: str, *args, **kwargs) -> object:
+    _builds.append(model_name)
+    return object()
+
+
+def preload_fake_sessions() -> None:
+    from app.dependencies import sessions
+    sessions.build_session = fake_build_session
+    sessions.preload()
+
+
+def slow_square(seconds: float, x: int) -> int:
+    time.sleep(seconds)
+    return x * x
+
+
+def worker_session() -> tuple:
+    from app.dependencies import sessions
+    import rembg.bg
+    return os.getpid(), id(sessions.get_session()), id(rembg.bg.new_session('u2net')), len(_builds)
+
+
+class TestRenderEngine:
+    @pytest.mark.asyncio
+    async def test_run_on_worker(self):
+        engine = RenderEngine(workers=2, queue_size=4, job_timeout=10)
+        assert await engine.run(pow, 2, 10) == 1024, "Job result must be returned"
+        assert engine.pending == 0, "No jobs must be pending after the run"
+        engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_queue_is_bounded(self):
+        engine = RenderEngine(workers=1, queue_size=1, job_timeout=10)
+        slow = asyncio.ensure_future(engine.run(time.sleep, 0.5))
+        await asyncio.sleep(0)
+        with pytest.raises(EngineBusyException):
+            await engine.run(pow, 2, 2)
+        await slow
+        engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_job_timeout(self):
+        engine = RenderEngine(workers=1, queue_size=2, job_timeout=0.2)
+        with pytest.raises(RenderTimeoutException):
+            await engine.run(time.sleep, 2)
+        engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_workers_are_recycled(self):
+        engine = RenderEngine(workers=1, queue_size=2, job_timeout=10, max_jobs_per_worker=2)
+        await engine.run(pow, 2, 2)
+        first_pool = engine._executor
+        await engine.run(pow, 2, 2)
+        await engine.run(pow, 2, 2)
+        assert engine._executor is not first_pool, "Pool must be replaced after max jobs"
+        engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_stuck_worker_is_terminated(self):
+        engine = RenderEngine(workers=1, queue_size=2, job_timeout=0.5)
+        await engine.run(pow, 2, 2)
+        processes = list(engine._executor._processes.values())
+        with pytest.raises(RenderTimeoutException):
+            await engine.run(time.sleep, 30)
+        for process in processes:
+            process.join(timeout=5)
+            assert not process.is_alive(), "The process of a stuck job must be terminated"
+        assert await engine.run(pow, 2, 3) == 8, "New jobs must run on a fresh pool"
+        engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_other_jobs_survive_a_timeout(self):
+        engine = RenderEngine(workers=2, queue_size=4, job_timeout=3)
+        await asyncio.gather(engine.run(pow, 2, 2), engine.run(pow, 2, 2))
+        stuck = asyncio.ensure_future(engine.run(time.sleep, 30))
+        await asyncio.sleep(2)
+        # still running when the stuck job times out and its pool is killed
+        other = asyncio.ensure_future(engine.run(slow_square, 1.5, 3))
+        with pytest.raises(RenderTimeoutException):
+            await stuck
+        assert await other == 9, "Jobs killed by the timeout of another one must be submitted again"
+        engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_crashed_worker(self):
+        engine = RenderEngine(workers=1, queue_size=2, job_timeout=10)
+        with pytest.raises(RenderCrashedException):
+            await engine.run(os._exit, 1)
+        assert await engine.run(pow, 2, 3) == 8, "New jobs must run on a fresh pool"
+        engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_session_is_built_once_per_worker(self):
+        engine = RenderEngine(workers=1, queue_size=2, job_timeout=30, initializer=preload_fake_sessions)
+        results = [await engine.run(worker_session) for _ in range(3)]
+        assert len({pid for pid, *_ in results}) == 1, "Jobs must run on the same worker"
+        assert len({session for _, session, _, _ in results}) == 1, "Jobs must reuse the session"
+        assert all(session == new for _, session, new, _ in results), "rembg must use the registry"
+        assert all(builds == 1 for *_, builds in results), "The session must be built only once"
+        engine.shutdown()
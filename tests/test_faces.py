@@ -0,0 +1,100 @@
+# pytest
+import pytest
+# APP
+from app.dependencies.faces import FACE_MARGIN, Box, crop_face, detect_faces, detect_faces_proxy, face_crop_box
+from app.dependencies.faces import LazyFaces, open_oriented
+# Python
+from PIL import Image
+import os
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+# Two copies of the same face, the second one mirrored
+FACES_PATH = os.path.join(TEST_DIR, 'images', 'faces.png')
+FACES_BOXES = [Box(61, 5, 163, 107), Box(346, 4, 452, 110)]
+
+
+def big_faces(tmp_path, scale: int = 4, orientation: int = 1) -> str:
+    """
+    Writes images/faces.png `scale` times bigger as a JPEG, stored rotated for
+    the EXIF `orientation` 6 so it is upright once its rotation is applied.
+    """
+    with Image.open(FACES_PATH) as image:
+        image = image.convert('RGB').resize((image.width * scale, image.height * scale), Image.LANCZOS)
+    exif = Image.Exif()
+    if orientation == 6:
+        image = image.transpose(Image.ROTATE_90)
+        exif[0x0112] = 6
+    path = str(tmp_path / f'faces_{scale}_{orientation}.jpg')
+    image.save(path, quality=95, exif=exif)
+    return path
+
+
+def assert_close(boxes, expected, tolerance: int) -> None:
+    assert len(boxes) == len(expected), "Every face must be found"
+    for box, expected_box in zip(boxes, expected):
+        assert all(abs(a - b) <= tolerance for a, b in zip(box, expected_box)), f"{box} is not {expected_box}"
+
+
+class TestFaceCropBox:
+    def test_margin_around_the_face(self):
+        box = face_crop_box(400, 300, 100, 100, 1000, 1000)
+        assert box == Box(350, 250, 550, 450), "The crop must be FACE_MARGIN times the face"
+        assert box.right - box.left == 100 * FACE_MARGIN
+
+    @pytest.mark.parametrize('x, y', [(0, 0), (900, 900), (0, 900), (450, 0)])
+    def test_edges_keep_the_size(self, x, y):
+        left, top, right, bottom = face_crop_box(x, y, 100, 100, 1000, 1000)
+        assert right - left == bottom - top == 200, "Faces on the edges must keep their margin"
+        assert 0 <= left and 0 <= top and right <= 1000 and bottom <= 1000, "The crop must stay inside"
+        assert left <= x and top <= y and x + 100 <= right and y + 100 <= bottom, "The face must be whole"
+
+    def test_small_image(self):
+        left, top, right, bottom = face_crop_box(10, 20, 100, 100, 150, 120)
+        assert right - left == bottom - top == 120, "The crop can only be as big as the image"
+        assert 0 <= left and right <= 150 and top == 0 and bottom == 120
+
+
+class TestDetection:
+    def test_faces_left_to_right(self):
+        assert detect_faces_proxy(FACES_PATH) == FACES_BOXES, "Faces must be found left to right"
+
+    def test_crop_size(self):
+        face = crop_face(FACES_PATH, FACES_BOXES[1], 300)
+        assert face.size == (300, 300), "The crop must be resized to the quality"
+
+    @pytest.mark.parametrize('orientation', [1, 6])
+    def test_proxy_boxes_are_full_resolution(self, tmp_path, orientation):
+        path = big_faces(tmp_path, orientation=orientation)
+        boxes = detect_faces_proxy(path, max_side=512)
+        # the proxy is images/faces.png again
+        assert_close(boxes, [box.scale(4) for box in FACES_BOXES], tolerance=4 * 3)
+
+    def test_proxy_matches_full_detection(self, tmp_path):
+        path = big_faces(tmp_path, scale=2)
+        full = detect_faces(open_oriented(path))
+        assert_close(detect_faces_proxy(path, max_side=512), full, tolerance=full[0].right - full[0].left)
+        # without downsampling only the grayscale decode differs
+        assert_close(detect_faces_proxy(path, max_side=4096), full, tolerance=3)
+
+    def test_boxes_stay_inside(self, tmp_path):
+        path = big_faces(tmp_path, scale=3)
+        for left, top, right, bottom in detect_faces_proxy(path, max_side=300):
+            assert 0 <= left < right <= 1536 and 0 <= top < bottom <= 768, "Boxes must be inside the picture"
+
+
+class TestLazyFaces:
+    def test_indexing(self):
+        faces = LazyFaces(FACES_PATH, size=150)
+        assert len(faces) == 2
+        assert faces[0].size == (150, 150), "Faces must be cropped to `size`"
+        assert faces[-1].tobytes() == faces[1].tobytes(), "Negative indexes must work"
+        with pytest.raises(IndexError):
+            faces[2]
+
+    def test_slices(self):
+        faces = LazyFaces(FACES_PATH, size=150)
+        crops = faces[::-1]
+        assert isinstance(crops, list) and len(crops) == 2, "Slices must be a list of faces"
+        assert crops[0].tobytes() == faces[1].tobytes()
+        assert faces[5:] == [], "Empty slices must be empty"
+        assert len(list(faces)) == 2, "Faces must be iterable"
@@ -0,0 +1,41 @@
+# pytest
+import pytest
+# APP
+from app.security.hasher import HasherBusyException, PasswordHasher
+# PassLib
+from passlib.context import CryptContext
+# Python
+import asyncio
+
+
+def make_context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+class TestPasswordHasher:
+    @pytest.mark.asyncio
+    async def test_hash_and_verify(self):
+        hasher = PasswordHasher(make_context(4))
+        hashed = await hasher.hash('password1234')
+        assert await hasher.verify('password1234', hashed)
+        assert not await hasher.verify('wrong password', hashed), "Wrong passwords must not be valid"
+        hasher.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_outdated_hash_is_updated(self):
+        hashed = make_context(4).hash('password1234')
+        hasher = PasswordHasher(make_context(5))
+        valid, new_hash = await hasher.verify_and_update('password1234', hashed)
+        assert valid and new_hash.startswith('$2b$05$'), "Hashes of older settings must be made again"
+        assert (await hasher.verify_and_update('password1234', new_hash))[1] is None
+        hasher.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_busy_hasher_fails_fast(self):
+        hasher = PasswordHasher(make_context(10), workers=1, queue_size=1)
+        running = asyncio.create_task(hasher.hash('password1234'))
+        await asyncio.sleep(0)
+        with pytest.raises(HasherBusyException):
+            await hasher.hash('password1234')
+        await running
+        hasher.shutdown()
@@ -8,13 +8,53 @@ from sqlmodel import Session
 # APP
 from app.DB.querys_pictures import PictureDB as PicDB
 from app.DB.querys_pictures import FreePictureDB as FreePicDB
+from app.routers.imagesRouter import free_limiter
+from app.dependencies.cache import stage_cache
+from app.dependencies.engine import render_engine
+from app.dependencies.service import MakePicture
+from app.models.picture import QualityType
+from app.security import secureuser
 # from app.models.user import User, UserBase, UserFB, UserUpdate
 # Testing
-from .conftest import app, client, test_engine
+from .conftest import app, client, setUp_users, test_engine
 # Python
+from PIL import Image
+import zipfile
+import hashlib
+import json
+import io
 import os
 
 TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FACES_PATH = os.path.join(TEST_DIR, 'images', 'faces.png')
+SEGMENTS = {
+    QualityType.THUMBNAIL: os.path.join(TEST_DIR, 'images', 'golden', 'segment_150.png'),
+    QualityType.PREVIEW: os.path.join(TEST_DIR, 'images', 'golden', 'segment_300.png'),
+}
+
+
+@pytest.fixture
+def faces_upload(monkeypatch):
+    """
+    The bytes of images/faces.png with the segments of its first face on the
+    stage cache, its pictures are composed without rembg.
+    """
+    with open(FACES_PATH, 'rb') as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    for quality, path in SEGMENTS.items():
+        stage_cache.put(MakePicture.make_render_id(sha256, quality, 0), path)
+    render_engine.shutdown()
+    monkeypatch.setattr(render_engine, 'initializer', None)
+    yield data
+    render_engine.shutdown()
+    for quality in SEGMENTS:
+        stage_cache.delete(MakePicture.make_render_id(sha256, quality, 0))
+
+
+def login(client, user: dict) -> dict:
+    response = client.post("/userlogin", data={"username": user['email'], "password": user['password']})
+    return {"Authorization": "Bearer " + response.json()['access_token']}
 
 
 class TestFreePicture:
@@ -22,6 +62,37 @@ class TestFreePicture:
         response = client.post("/pictures/example")
         assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, "Route whitout Picture"  # noqa: E501
 
+    def test_getFreePicture_too_large(self, client: client):
+        files = {'picture_file': ('big.jpg', b'0' * (1024 * 1024 * 16), 'image/jpeg')}
+        response = client.post("/pictures/example/preview", files=files)
+        assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Upload over the free limit must be rejected"  # noqa: E501
+
+    def test_myPictures_whitout_token(self, client: client):
+        response = client.get("/pictures/mine")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED, "Stored pictures need a logged user"  # noqa: E501
+
+    def test_recolor_expired_render(self, client: client):
+        used = free_limiter.count('testclient')
+        response = client.post(f"/pictures/example/recolor/preview-{'0' * 64}")
+        assert response.status_code == status.HTTP_404_NOT_FOUND, "Unknown renders must be a 404"  # noqa: E501
+        assert free_limiter.count('testclient') == used, "Failed pictures must not be counted"  # noqa: E501
+
+    def test_recolor_invalid_render_id(self, client: client):
+        response = client.post("/pictures/example/recolor/preview-nothex")
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, "Render ids must match their pattern"  # noqa: E501
+
+    def test_refused_formats_are_not_counted(self, client: client, faces_upload):
+        used = free_limiter.count('testclient')
+        response = client.post("/pictures/example/preview", headers={'Accept': 'image/*;q=0'},
+                               files={'picture_file': ('faces.png', faces_upload, 'image/png')})
+        assert response.status_code == status.HTTP_406_NOT_ACCEPTABLE, "No format is acceptable"
+        assert free_limiter.count('testclient') == used, "Refused pictures must not be counted"
+        response = client.post("/pictures/example/preview", headers={'Accept': 'image/webp'},
+                               files={'picture_file': ('faces.png', faces_upload, 'image/png')})
+        assert response.status_code == status.HTTP_200_OK, "Status code not 200 on path POST /pictures/example"
+        assert response.headers['content-type'] == 'image/webp', "The acceptable format must be returned"
+        assert free_limiter.count('testclient') == used + 1, "Returned pictures must be counted"
+
     # @pytest.mark.anyio
     # def test_getFreePicture(self, client: client):
     #     # data = {'message': 'Hello, world!'}
@@ -53,6 +124,78 @@ class TestFreePicture:
         # print(str(response.))
         # assert response.json() == {"message": "Tomato"}, "Error to print stout"
 
+class TestUserPictures:
+    def test_batch_zip(self, client: client, setUp_users: setUp_users, faces_upload):
+        headers = login(client, setUp_users[1])
+        specs = [{"quality": "thumbnail"},
+                 {"quality": "preview"},
+                 {"quality": "preview", "colorCenter": "navy", "colorBorder": "red"}]
+        response = client.post("/pictures/mypicture/batch", headers=headers,
+                               files={'pic_file': ('faces.png', faces_upload, 'image/png')},
+                               data={'specs': json.dumps(specs)})
+        assert response.status_code == status.HTTP_201_CREATED, response.text
+        assert response.headers['content-type'] == 'application/zip'
+        assert len(response.headers['picMaker-render-ids'].split(',')) == 2, "One render id by quality"
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            assert archive.namelist() == ['1_thumbnail.png', '2_preview.png', '3_preview.png']
+            pictures = [Image.open(io.BytesIO(archive.read(name))) for name in archive.namelist()]
+        assert [picture.size for picture in pictures] == [(150, 150), (300, 300), (300, 300)]
+        assert pictures[1].tobytes() != pictures[2].tobytes(), "Every spec must have its colors"
+        response = client.get("/pictures/mine", headers=headers)
+        assert len(response.json()['pictures']) == 3, "Every picture of the batch must be stored"
+
+    def test_derive_smaller_qualities(self, client: client, setUp_users: setUp_users, faces_upload):
+        headers = login(client, setUp_users[2])
+        response = client.post("/pictures/mypicture/thumbnail?derive=preview&derive=thumbnail", headers=headers,
+                               files={'pic_file': ('faces.png', faces_upload, 'image/png')})
+        assert response.status_code == status.HTTP_200_OK, response.text
+        assert Image.open(io.BytesIO(response.content)).size == (150, 150), "The picture of the path quality is returned"
+        assert 'picMaker-render-id' not in response.headers, "Derivatives are recolored from their render"
+        pictures = client.get("/pictures/mine", headers=headers).json()['pictures']
+        assert sorted(picture['type_picture'] for picture in pictures) == ['preview', 'thumbnail'], \
+            "Every quality must be stored once"
+        sizes = {picture['type_picture']: Image.open(io.BytesIO(client.get(picture['url'], headers=headers).content)).size
+                 for picture in pictures}
+        assert sizes == {'preview': (300, 300), 'thumbnail': (150, 150)}
+
+    def test_batch_invalid_specs(self, client: client, setUp_users: setUp_users, faces_upload):
+        headers = login(client, setUp_users[1])
+        for specs in ('[]', '[{"quality": "huge"}]', json.dumps([{"quality": "thumbnail"}] * 21)):
+            response = client.post("/pictures/mypicture/batch", headers=headers,
+                                   files={'pic_file': ('faces.png', faces_upload, 'image/png')},
+                                   data={'specs': specs})
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, specs
+
+    def test_unsaved_pictures_fail(self, client: client, setUp_users: setUp_users, faces_upload, monkeypatch):
+        async def failing_add(pictures, db):
+            return None
+        monkeypatch.setattr(PicDB, 'add_pictures_toDB_async', failing_add)
+        headers = login(client, setUp_users[2])
+        count = len(client.get("/pictures/mine", headers=headers).json()['pictures'])
+        response = client.post("/pictures/mypicture/preview", headers=headers,
+                               files={'pic_file': ('faces.png', faces_upload, 'image/png')})
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR, "Unsaved pictures must not be returned"
+        assert len(client.get("/pictures/mine", headers=headers).json()['pictures']) == count
+
+    def test_pictures_are_made_with_the_claims(self, client: client, setUp_users: setUp_users, faces_upload,
+                                               monkeypatch):
+        headers = login(client, setUp_users[1])
+
+        async def no_user(email, session):
+            raise AssertionError('The user must not be loaded')
+        monkeypatch.setattr(secureuser, 'load_user', no_user)
+        response = client.post("/pictures/mypicture/preview", headers=headers,
+                               files={'pic_file': ('faces.png', faces_upload, 'image/png')})
+        assert response.status_code == status.HTTP_200_OK, response.text
+        response = client.post(f"/pictures/mypicture/recolor/{response.headers['picMaker-render-id']}?colorCenter=navy",
+                               headers=headers)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        response = client.post("/pictures/mypicture/batch", headers=headers,
+                               files={'pic_file': ('faces.png', faces_upload, 'image/png')},
+                               data={'specs': json.dumps([{"quality": "thumbnail"}])})
+        assert response.status_code == status.HTTP_201_CREATED, response.text
+
+
 class TestHome:
     def test_home_item(self, client: client): 
         # response = client.get("/items/foo", headers={"X-Token": "coneofsilence"})
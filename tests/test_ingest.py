@@ -0,0 +1,38 @@
+# pytest
+import pytest
+# FastAPI
+from fastapi import UploadFile
+# APP
+from app.dependencies.artifacts import temp_artifacts
+from app.dependencies.ingest import UploadTooLargeException, spool_upload, spooled_upload
+# Python
+import hashlib
+import io
+import os
+
+DATA = os.urandom(3 * 1024 * 1024 + 17)
+
+
+class TestSpoolUpload:
+    @pytest.mark.asyncio
+    async def test_copy_and_hash(self):
+        async with spooled_upload(UploadFile(io.BytesIO(DATA), filename='pic.png'), len(DATA)) as upload:
+            assert upload.path.endswith('.png')
+            with open(upload.path, 'rb') as f:
+                assert f.read() == DATA, "The upload must be copied whole"
+            assert upload.sha256 == hashlib.sha256(DATA).hexdigest()
+            assert upload.size == len(DATA)
+        assert not os.path.exists(upload.path), "The copy must be removed on exit"
+
+    @pytest.mark.asyncio
+    async def test_too_large_is_removed(self):
+        tracked = temp_artifacts.stats()['tracked']
+        with pytest.raises(UploadTooLargeException):
+            await spool_upload(UploadFile(io.BytesIO(DATA), filename='pic.png'), len(DATA) - 1)
+        assert temp_artifacts.stats()['tracked'] == tracked, "A rejected upload must leave no file"
+
+    @pytest.mark.asyncio
+    async def test_known_size_is_rejected_early(self):
+        upload = UploadFile(io.BytesIO(b''), filename='pic.png', size=len(DATA))
+        with pytest.raises(UploadTooLargeException):
+            await spool_upload(upload, len(DATA) - 1)
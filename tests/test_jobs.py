@@ -0,0 +1,137 @@
+# pytest
+import pytest
+# APP
+from app.models import MyModels
+from app.models.picture import JobStatus, QualityType, RenderJob
+from app.models.user import User
+from app.dependencies import jobs
+from app.dependencies.jobs import JobQueue, JobQueueFullException
+from app.dependencies.ingest import SpooledUpload
+# SQLModel
+from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+# Python
+from pydantic.color import Color
+from datetime import datetime, timedelta
+import os
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "jobs.sqlite"}',
+                           connect_args={'check_same_thread': False})
+    MyModels.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def session_factory(engine, tmp_path):
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "jobs.sqlite"}')
+    return lambda: AsyncSession(async_engine, expire_on_commit=False)
+
+
+def add_job(engine, tmp_path, **values) -> RenderJob:
+    with Session(engine) as db:
+        user = db.query(User).filter(User.email == 'job@example.com').first()
+        if user is None:
+            user = User(name='Job user', email='job@example.com', pass_hash='hash')
+            db.add(user)
+            db.commit()
+        job = RenderJob(user_id=user.id,
+                        quality=QualityType.PREVIEW,
+                        colorCenter='#000000',
+                        colorOuter='#ffffff',
+                        upload_path=str(tmp_path / 'missing.jpg'),
+                        upload_sha256='0' * 64,
+                        **values)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+
+
+class TestJobQueue:
+    @pytest.mark.asyncio
+    async def test_failed_job_is_recorded(self, engine, session_factory, tmp_path):
+        queue = JobQueue(workers=1, queue_size=2, session_factory=session_factory)
+        await queue.start()
+        job = add_job(engine, tmp_path)
+        queue.submit(job)
+        finished = await queue.wait(job.id, timeout=5)
+        assert finished.status == JobStatus.FAILED, "A job without upload must fail"
+        assert finished.error_code == 500, "The error of the job must be kept"
+        stats = queue.stats()
+        assert stats['failed'] == 1 and stats['depth'] == 0, "Metrics must count the job"
+        await queue.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_stale_jobs_are_requeued(self, engine, session_factory, tmp_path):
+        queued = add_job(engine, tmp_path)
+        stale = add_job(engine, tmp_path, status=JobStatus.RUNNING,
+                        startDate=datetime.now() - timedelta(seconds=120))
+        running = add_job(engine, tmp_path, status=JobStatus.RUNNING, startDate=datetime.now())
+        queue = JobQueue(workers=1, queue_size=4, session_factory=session_factory, stale_after=60)
+        assert await queue.start() == 2, "Queued and stale jobs must be queued again on start"
+        assert (await queue.wait(queued.id, timeout=5)).status == JobStatus.FAILED
+        assert (await queue.wait(stale.id, timeout=5)).status == JobStatus.FAILED, "Stale jobs must run again"
+        assert (await queue.wait(running.id, timeout=0.1)).status == JobStatus.RUNNING, \
+            "Jobs running on other processes must be left alone"
+        await queue.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_job_runs_once(self, engine, session_factory, tmp_path):
+        queue = JobQueue(workers=2, queue_size=4, session_factory=session_factory)
+        other = JobQueue(workers=1, queue_size=4, session_factory=session_factory)
+        await queue.start()
+        await other.start()
+        job = add_job(engine, tmp_path)
+        queue.submit(job)
+        queue.submit(job)
+        other.submit(job)
+        await queue._queue.join()
+        await other._queue.join()
+        assert queue.stats()['failed'] + other.stats()['failed'] == 1, "Only one worker must claim the job"
+        await queue.shutdown()
+        await other.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_job_not_queued_is_failed(self, engine, session_factory, tmp_path, monkeypatch):
+        monkeypatch.setattr(jobs, 'JOBS_DIR', str(tmp_path / 'jobs'))
+        user_id = add_job(engine, tmp_path).user_id
+        upload_path = tmp_path / 'upload.jpg'
+        upload_path.write_bytes(b'picture')
+        queue = JobQueue(workers=1, queue_size=1, session_factory=session_factory)
+        async with session_factory() as db:
+            with pytest.raises(JobQueueFullException):
+                await queue.create_job(db, await db.get(User, user_id),
+                                       SpooledUpload(str(upload_path), '0' * 64, 7),
+                                       (Color('black'), Color('white')))
+        with Session(engine) as db:
+            job = db.query(RenderJob).filter(RenderJob.status != JobStatus.QUEUED,
+                                             RenderJob.upload_path.contains('jobs')).one()
+        assert job.status == JobStatus.FAILED and job.error_code == 503, "A job not queued must not wait forever"
+        assert not os.listdir(tmp_path / 'jobs'), "The upload of the failed job must be removed"
+
+    @pytest.mark.asyncio
+    async def test_job_of_deleted_user_fails(self, engine, session_factory, tmp_path):
+        upload_path = tmp_path / 'upload.jpg'
+        upload_path.write_bytes(b'picture')
+        job = add_job(engine, tmp_path)
+        with Session(engine) as db:
+            db.query(RenderJob).filter(RenderJob.id == job.id).update({'upload_path': str(upload_path)})
+            db.delete(db.get(User, job.user_id))
+            db.commit()
+        queue = JobQueue(workers=1, queue_size=2, session_factory=session_factory)
+        await queue.start()
+        queue.submit(job)
+        finished = await queue.wait(job.id, timeout=5)
+        assert finished.status == JobStatus.FAILED and finished.error_code == 410, \
+            "The job of a deleted user must fail explicitly"
+        assert not upload_path.exists(), "The upload of the failed job must be removed"
+        await queue.shutdown()
+
+    def test_submit_needs_started_queue(self, engine, session_factory, tmp_path):
+        queue = JobQueue(workers=1, queue_size=1, session_factory=session_factory)
+        with pytest.raises(JobQueueFullException):
+            queue.submit(add_job(engine, tmp_path))
@@ -0,0 +1,60 @@
+# pytest
+import pytest
+# APP
+from app.dependencies import pipeline
+from app.models.picture import QualityType
+# Python
+from pydantic.color import Color
+from PIL import Image
+import numpy as np
+import io
+import os
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'images', 'golden')
+# Colors of the golden pictures by size, the segments are a face of images/faces.png with a soft matte.
+# They were rendered by the native pipeline, they pin it and don't show parity with ProfilePicMaker
+GOLDEN_COLORS = {
+    150: ((Color('black'), Color('white')), None),
+    300: ((Color('navy'), Color('white')), Color('red')),
+}
+
+
+def golden(name: str) -> np.ndarray:
+    with Image.open(os.path.join(GOLDEN_DIR, name)) as image:
+        return np.asarray(image.convert('RGBA'))
+
+
+def decode(data: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGBA'))
+
+
+def premultiplied(picture: np.ndarray) -> np.ndarray:
+    # the color of transparent pixels does not show
+    return picture[..., :3] * (picture[..., 3:] / 255)
+
+
+class TestComposeFace:
+    @pytest.mark.parametrize('size', sorted(GOLDEN_COLORS))
+    def test_matches_golden(self, size):
+        colors, border = GOLDEN_COLORS[size]
+        data = pipeline.compose_face(os.path.join(GOLDEN_DIR, f'segment_{size}.png'), colors, border)
+        picture = np.asarray(Image.open(io.BytesIO(data)).convert('RGBA'))
+        assert np.array_equal(picture, golden(f'compose_{size}.png')), "Pictures must not change"
+
+
+class TestDerivePictures:
+    def test_sizes(self):
+        colors, border = GOLDEN_COLORS[300]
+        picture = pipeline.compose_face(os.path.join(GOLDEN_DIR, 'segment_300.png'), colors, border)
+        derived = pipeline.derive_pictures(picture, [QualityType.THUMBNAIL, QualityType.PREVIEW])
+        assert [decode(data).shape for data in derived] == [(150, 150, 4), (300, 300, 4)]
+        assert [pipeline.quality_of(Image.open(io.BytesIO(data))) for data in derived] == \
+            [QualityType.THUMBNAIL, QualityType.PREVIEW], "Derivatives must have the size of their quality"
+
+    def test_looks_like_a_render(self):
+        colors, border = GOLDEN_COLORS[300]
+        picture = pipeline.compose_face(os.path.join(GOLDEN_DIR, 'segment_300.png'), colors, border)
+        derived = decode(pipeline.derive_pictures(picture, [QualityType.THUMBNAIL])[0])
+        rendered = decode(pipeline.compose_face(os.path.join(GOLDEN_DIR, 'segment_150.png'), colors, border))
+        difference = np.abs(premultiplied(derived) - premultiplied(rendered)).mean()
+        assert difference < 6, "A derivative must look like a render at its quality"
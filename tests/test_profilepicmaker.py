@@ -0,0 +1,111 @@
+# pytest
+import pytest
+# APP
+from app.dependencies import pipeline, profilepicmaker, service
+from app.dependencies.pipeline import FaceIndexException, NoFaceException
+from app.models.picture import QualityType
+# Python
+from pydantic.color import Color
+import tempfile
+import types
+import sys
+import os
+
+calls = []
+
+
+class FakeFacePic:
+    """
+    Records the calls of the adapters, its saved picture is the content of its
+    source file read on save, as a FacePic that loads its picture lazily.
+    """
+
+    def __init__(self, path: str) -> None:
+        calls.append(('FacePic', os.path.basename(path)))
+        self.path = path
+        self.saved_path = None
+
+    def __getattr__(self, name: str):
+        return lambda *args: calls.append((name, *args))
+
+    def save(self) -> None:
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        fd, self.saved_path = tempfile.mkstemp(suffix='.png')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'saved:' + data)
+        calls.append(('save',))
+
+    def get_path(self) -> str:
+        return self.saved_path
+
+
+class FakeBigPic:
+    faces = 2
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def get_faces(self) -> list:
+        return [FakeFacePic(self.path) for _ in range(self.faces)]
+
+
+@pytest.fixture
+def library(monkeypatch):
+    pictures = types.ModuleType('ProfilePicMaker.app.models.pictures')
+    pictures.BigPic, pictures.FacePic = FakeBigPic, FakeFacePic
+    for name in ('ProfilePicMaker', 'ProfilePicMaker.app', 'ProfilePicMaker.app.models'):
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.setitem(sys.modules, 'ProfilePicMaker.app.models.pictures', pictures)
+    calls.clear()
+    yield calls
+    FakeBigPic.faces = 2
+
+
+@pytest.fixture
+def upload(tmp_path) -> str:
+    path = tmp_path / 'upload.png'
+    path.write_bytes(b'upload')
+    return str(path)
+
+
+class TestProfilePicMakerAdapters:
+    def test_segment_faces(self, library, upload):
+        segments = profilepicmaker.segment_faces(upload, [QualityType.THUMBNAIL, QualityType.FULLSIZE], 1)
+        assert segments == [b'saved:upload', b'saved:upload']
+        assert [call for call in library if call[0] != 'FacePic'] == [
+            ('resize', 150), ('removeBG',), ('save',),
+            ('removeBG',), ('save',),
+        ], "The face must be resized and segmented like the original pipeline did"
+
+    def test_face_errors(self, library, upload):
+        with pytest.raises(FaceIndexException):
+            profilepicmaker.segment_face(upload, QualityType.PREVIEW, 2)
+        FakeBigPic.faces = 0
+        with pytest.raises(NoFaceException):
+            profilepicmaker.segment_face(upload)
+
+    def test_compose_face_from_bytes(self, library):
+        tracked = set(os.listdir(tempfile.gettempdir()))
+        colors = (Color('black'), 'white')
+        picture = profilepicmaker.compose_face(b'segment', colors, 'red')
+        assert picture == b'saved:segment', "The segment must be readable until the picture is saved"
+        assert [call[0] for call in library] == ['FacePic', 'addBG', 'set_contour', 'setBorder', 'setBlur', 'save']
+        assert library[1][1] == (Color('black'), Color('white')) and library[3][1] == Color('red')
+        assert library[4][1] == 30
+        assert set(os.listdir(tempfile.gettempdir())) == tracked, "Temporary files must be removed"
+
+    def test_compose_face_without_border(self, library, upload):
+        profilepicmaker.compose_face(upload, (Color('black'), Color('white')))
+        assert 'setBorder' not in [call[0] for call in library]
+
+    def test_removeBG_picture(self, library, upload):
+        assert profilepicmaker.removeBG_picture(upload, QualityType.MEDIUM) == b'saved:upload'
+        assert library == [('FacePic', 'upload.png'), ('resize', 600), ('removeBG',), ('save',)]
+
+    def test_service_stages(self, monkeypatch):
+        assert service.stages is pipeline, "The tests run the native pipeline"
+        native = service.MakePicture.make_render_id('0' * 64, QualityType.PREVIEW, 0)
+        monkeypatch.setattr(service, 'PICTURE_PIPELINE', 'profilepicmaker')
+        assert service.MakePicture.make_render_id('0' * 64, QualityType.PREVIEW, 0) != native, \
+            "The pictures of each pipeline must not share their ids"
@@ -0,0 +1,124 @@
+# pytest
+import pytest
+# APP
+from app.dependencies.ratelimit import BatchedBackend, MemoryBackend, SQLiteBackend, SlidingWindowLimiter
+# Python
+import asyncio
+import time
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'ratelimit.sqlite'))
+
+
+class TestSlidingWindowLimiter:
+    def test_limit_is_enforced(self, backend):
+        limiter = SlidingWindowLimiter(backend, limit=3, window=100)
+        assert [limiter.acquire('ip', now=1000)[0] for _ in range(4)] == [True, True, True, False], "Only 3 hits must pass"  # noqa: E501
+        assert limiter.count('ip', now=1000) == 3, "Denied hits must not be counted"
+        assert limiter.acquire('other', now=1000) == (True, 2), "Keys must be independent"
+
+    def test_release_gives_hit_back(self, backend):
+        limiter = SlidingWindowLimiter(backend, limit=1, window=100)
+        assert limiter.acquire('ip', now=1000)[0]
+        limiter.release('ip', now=1000)
+        assert limiter.acquire('ip', now=1000)[0], "Released hits must not be counted"
+
+    def test_previous_window_slides_out(self, backend):
+        limiter = SlidingWindowLimiter(backend, limit=4, window=100)
+        for _ in range(4):
+            limiter.acquire('ip', now=1050)
+        assert limiter.count('ip', now=1150) == 2, "Half of the previous window must be counted"
+        assert limiter.count('ip', now=1200) == 0, "Windows older than the previous one must be ignored"
+
+    def test_sqlite_is_shared(self, tmp_path):
+        path = str(tmp_path / 'ratelimit.sqlite')
+        first = SlidingWindowLimiter(SQLiteBackend(path), limit=2, window=100)
+        second = SlidingWindowLimiter(SQLiteBackend(path), limit=2, window=100)
+        assert first.acquire('ip', now=1000)[0] and second.acquire('ip', now=1000)[0]
+        assert not first.acquire('ip', now=1000)[0], "Workers sharing the file must share the limit"
+
+
+class TestBatchedBackend:
+    @pytest.mark.asyncio
+    async def test_hits_are_written_on_flush(self, tmp_path):
+        shared = SQLiteBackend(str(tmp_path / 'ratelimit.sqlite'))
+        backend = BatchedBackend(shared, interval=3600)
+        backend.start()
+        limiter = SlidingWindowLimiter(backend, limit=2, window=100)
+        assert [limiter.acquire('ip', now=1000)[0] for _ in range(3)] == [True, True, False], "The limit must be enforced in memory"  # noqa: E501
+        assert shared.get('ip', [10]) == [0], "Hits must not be written before the flush"
+        backend.flush()
+        assert shared.get('ip', [10]) == [2], "Denied hits must not be written"
+        await backend.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_workers_see_each_other_after_flush(self, tmp_path):
+        path = str(tmp_path / 'ratelimit.sqlite')
+        first, second = BatchedBackend(SQLiteBackend(path), interval=3600), BatchedBackend(SQLiteBackend(path), interval=3600)  # noqa: E501
+        first.start()
+        second.start()
+        first_limiter = SlidingWindowLimiter(first, limit=2, window=100)
+        second_limiter = SlidingWindowLimiter(second, limit=2, window=100)
+        assert first_limiter.acquire('ip', now=1000)[0] and second_limiter.acquire('ip', now=1000)[0]
+        first.flush()
+        second.flush()
+        first.flush()
+        assert not first_limiter.acquire('ip', now=1000)[0], "Flushed hits of other workers must be counted"
+        await first.shutdown()
+        await second.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_idle_counters_are_read_again(self, tmp_path):
+        shared = SQLiteBackend(str(tmp_path / 'ratelimit.sqlite'))
+        backend = BatchedBackend(shared, interval=3600, keep=0.05)
+        backend.start()
+        limiter = SlidingWindowLimiter(backend, limit=3, window=100)
+        allowed = []
+        for _ in range(6):
+            allowed.append(limiter.acquire('ip', now=1000)[0])
+            backend.flush()
+            time.sleep(0.1)
+            # idle for longer than keep
+            backend.flush()
+        assert allowed == [True, True, True, False, False, False], "Idle counters must keep their hits"
+        assert shared.get('ip', [10]) == [3]
+        await backend.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_new_worker_sees_past_hits(self, tmp_path):
+        path = str(tmp_path / 'ratelimit.sqlite')
+        SlidingWindowLimiter(SQLiteBackend(path), limit=2, window=100).acquire('ip', now=1000)
+        SlidingWindowLimiter(SQLiteBackend(path), limit=2, window=100).acquire('ip', now=1000)
+        backend = BatchedBackend(SQLiteBackend(path), interval=3600)
+        backend.start()
+        assert not SlidingWindowLimiter(backend, limit=2, window=100).acquire('ip', now=1000)[0], \
+            "The first hit of a worker must count the hits before it"
+        await backend.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_background_flush_and_shutdown(self, tmp_path):
+        shared = SQLiteBackend(str(tmp_path / 'ratelimit.sqlite'))
+        backend = BatchedBackend(shared, interval=0.01)
+        backend.start()
+        backend.incr('ip', 10, 1, 200)
+        await asyncio.sleep(0.2)
+        assert shared.get('ip', [10]) == [1], "The background task must write the hits"
+        backend.incr('ip', 10, 1, 200)
+        await backend.shutdown()
+        assert shared.get('ip', [10]) == [2], "Shutdown must write the pending hits"
+        assert backend.incr('ip', 10, 1, 200) == 3, "After shutdown hits must go to the shared backend"
+
+    def test_failed_flush_keeps_hits(self, tmp_path):
+        class FailingBackend(MemoryBackend):
+            def incr_many(self, amounts):
+                raise OSError('disk full')
+        backend = BatchedBackend(FailingBackend(), interval=3600)
+        backend._task = object()  # counted in memory, as if started
+        backend.incr('ip', 10, 1, 200)
+        with pytest.raises(OSError):
+            backend.flush()
+        assert backend.get('ip', [10]) == [1], "Hits must be kept for the next flush"
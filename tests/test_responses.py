@@ -0,0 +1,104 @@
+# pytest
+import pytest
+# FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.testclient import TestClient
+# APP
+from app.dependencies.responses import RangeFileResponse, etag_matches, parse_range
+from app.routers.imagesRouter import stored_picture_response
+
+
+@pytest.fixture
+def range_client(tmp_path):
+    path = tmp_path / 'picture.png'
+    path.write_bytes(bytes(range(100)))
+    app = FastAPI()
+
+    @app.get('/picture')
+    async def picture(request: Request):
+        return RangeFileResponse(str(path), request_headers=request.headers,
+                                 headers={'ETag': '"v1"'}, media_type='image/png', method=request.method)
+    return TestClient(app)
+
+
+@pytest.fixture
+def stored_client(tmp_path):
+    path = tmp_path / 'picture.png'
+    path.write_bytes(bytes(range(100)))
+    app = FastAPI()
+
+    @app.get('/stored')
+    async def stored(request: Request):
+        return stored_picture_response(request, str(path), etag=f'"{"a" * 64}"')
+
+    @app.get('/legacy')
+    async def legacy(request: Request):
+        return stored_picture_response(request, str(path))
+    return TestClient(app)
+
+
+class TestRangeFileResponse:
+    def test_parse_range(self):
+        assert parse_range('bytes=0-9', 100) == (0, 9)
+        assert parse_range('bytes=90-', 100) == (90, 99)
+        assert parse_range('bytes=-10', 100) == (90, 99), "Suffix ranges are the last bytes"
+        assert parse_range('bytes=0-999', 100) == (0, 99), "Ranges are clipped to the file"
+        assert parse_range('bytes=0-1,5-6', 100) is None, "Several ranges get the whole file"
+        with pytest.raises(ValueError):
+            parse_range('bytes=100-', 100)
+
+    def test_ranges_are_served(self, range_client):
+        response = range_client.get('/picture')
+        assert response.status_code == status.HTTP_200_OK and len(response.content) == 100
+        assert response.headers['accept-ranges'] == 'bytes'
+        response = range_client.get('/picture', headers={'Range': 'bytes=10-19'})
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.content == bytes(range(10, 20)), "Only the range must be sent"
+        assert response.headers['content-range'] == 'bytes 10-19/100'
+        response = range_client.get('/picture', headers={'Range': 'bytes=200-'})
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        response = range_client.get('/picture', headers={'Range': 'bytes=10-19', 'If-Range': '"v0"'})
+        assert response.status_code == status.HTTP_200_OK, "Changed files must be sent whole"
+
+    def test_weak_etags_never_match_if_range(self, tmp_path):
+        path = tmp_path / 'picture.png'
+        path.write_bytes(bytes(range(100)))
+        app = FastAPI()
+
+        @app.get('/picture')
+        async def picture(request: Request):
+            return RangeFileResponse(str(path), request_headers=request.headers,
+                                     headers={'ETag': 'W/"v1"'}, media_type='image/png', method=request.method)
+        response = TestClient(app).get('/picture', headers={'Range': 'bytes=10-19', 'If-Range': 'W/"v1"'})
+        assert response.status_code == status.HTTP_200_OK, "If-Range needs a strong ETag"
+
+
+class TestStoredPictureResponse:
+    def test_etag_matches(self):
+        assert etag_matches('"v1"', '"v1"')
+        assert etag_matches('W/"v1"', '"v1"') and etag_matches('"v1"', 'W/"v1"'), "The comparison is weak"
+        assert etag_matches('"v0", W/"v1" ,"v2"', '"v1"'), "Any tag of the list can match"
+        assert etag_matches(' * ', '"v1"')
+        assert not etag_matches('"v0", "v2"', '"v1"')
+        assert not etag_matches('v1', '"v1"'), "Tags are quoted"
+        assert not etag_matches('"v1,v2"', '"v1"'), "Commas can be part of a tag"
+
+    def test_revalidations(self, stored_client):
+        response = stored_client.get('/stored')
+        etag = response.headers['etag']
+        assert etag == f'"{"a" * 64}"' and 'immutable' in response.headers['cache-control']
+        for if_none_match in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+            response = stored_client.get('/stored', headers={'If-None-Match': if_none_match})
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED, if_none_match
+        response = stored_client.get('/stored', headers={'If-None-Match': '"other"'})
+        assert response.status_code == status.HTTP_200_OK and len(response.content) == 100
+
+    def test_legacy_pictures_get_weak_etags(self, stored_client):
+        response = stored_client.get('/legacy')
+        etag = response.headers['etag']
+        assert etag.startswith('W/"'), "Files that could be replaced must not get a strong ETag"
+        assert 'immutable' not in response.headers['cache-control']
+        response = stored_client.get('/legacy', headers={'If-None-Match': etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        response = stored_client.get('/legacy', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+        assert response.status_code == status.HTTP_200_OK and len(response.content) == 100
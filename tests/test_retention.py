@@ -0,0 +1,39 @@
+# pytest
+import pytest
+# APP
+from app.models import MyModels
+from app.models.picture import Free_picture, Free_picture_day, FreeQualityType
+from app.models.user import User  # noqa: F401 the tables of MyModels need it
+from app.dependencies.retention import RetentionJob
+# SQLModel
+from sqlmodel import Session, create_engine, select
+# Python
+from datetime import datetime, timedelta
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "retention.sqlite"}',
+                           connect_args={'check_same_thread': False})
+    MyModels.metadata.create_all(engine)
+    return lambda: Session(engine)
+
+
+class TestRetentionJob:
+    def test_old_free_pictures_are_rolled_up(self, session_factory):
+        now = datetime.now()
+        old = now - timedelta(days=10)
+        with session_factory() as db:
+            db.add_all([Free_picture(ip='1.1.1.1', quality=FreeQualityType.PREVIEW, date=old),
+                        Free_picture(ip='1.1.1.1', quality=FreeQualityType.PREVIEW, date=old),
+                        Free_picture(ip='2.2.2.2', quality=FreeQualityType.MEDIUM, date=old - timedelta(days=1)),
+                        Free_picture(ip='1.1.1.1', quality=FreeQualityType.PREVIEW, date=now)])
+            db.commit()
+
+        assert RetentionJob(days=7, session_factory=session_factory).run_once() == 3, "Old rows must be deleted"  # noqa: E501
+        with session_factory() as db:
+            assert len(db.exec(select(Free_picture)).all()) == 1, "Recent rows must be kept"
+            days = {(day.ip, day.count) for day in db.exec(select(Free_picture_day)).all()}
+        assert days == {('1.1.1.1', 2), ('2.2.2.2', 1)}, "Old rows must be counted by day and ip"
+
+        assert RetentionJob(days=7, session_factory=session_factory).run_once() == 0, "A second run must do nothing"  # noqa: E501
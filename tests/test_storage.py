@@ -0,0 +1,53 @@
+# pytest
+import pytest
+# APP
+from app.dependencies.cache import RenderCache
+from app.dependencies.storage import LocalObjectStore, S3ObjectStore, is_content_key
+# Python
+import os
+
+
+class FakeS3Client:
+    def __init__(self) -> None:
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise KeyError(Key)
+
+    def get_object(self, Bucket, Key):
+        import io
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+@pytest.fixture(params=['local', 's3'])
+def store(request, tmp_path):
+    if request.param == 'local':
+        return LocalObjectStore(str(tmp_path / 'store'))
+    return S3ObjectStore(FakeS3Client(), 'bucket', RenderCache(str(tmp_path / 'cache'), 1024 * 1024))
+
+
+class TestObjectStore:
+    def test_equal_pictures_are_stored_once(self, store, tmp_path):
+        key = store.put_bytes(b'picture')
+        assert is_content_key(key), "Keys must be the sha256 of the content"
+        src = tmp_path / 'picture.png'
+        src.write_bytes(b'picture')
+        assert store.put_file(str(src)) == key, "Equal contents must get equal keys"
+        with open(store.get_path(key), 'rb') as f:
+            assert f.read() == b'picture'
+        store.delete(key)
+        assert store.get_path(key) is None, "Deleted objects must be missing"
+
+    def test_local_store_is_sharded(self, tmp_path):
+        store = LocalObjectStore(str(tmp_path / 'store'))
+        key = store.put_bytes(b'picture')
+        assert store.get_path(key) == os.path.join(str(tmp_path / 'store'), key[:2], key[2:4], key)
+        assert [name for name in os.listdir(tmp_path / 'store') if name.endswith('.tmp')] == [], \
+            "Temporary files must be renamed into place"
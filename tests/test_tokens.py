@@ -0,0 +1,95 @@
+# pytest
+import pytest
+# FastAPI
+from fastapi import HTTPException
+# APP
+from app.models.user import User
+from app.security import secureuser
+from app.security.secureuser import create_access_token, forget_user, get_token_claims, require_admin, revoke_tokens
+from .conftest import client, setUp_users, test_engine, test_async_engine
+# SQLModel
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+# Python
+from datetime import timedelta
+from uuid import uuid4
+
+
+def make_token(email: str, role: str = 'free', active: bool = True, uid: str = None) -> str:
+    return create_access_token(data={"sub": email, "uid": uid or str(uuid4()), "role": role, "active": active},
+                               expires_delta=timedelta(minutes=5))
+
+
+def update_user(email: str, **values) -> User:
+    with Session(test_engine) as session:
+        user = session.exec(select(User).where(User.email == email)).one()
+        for key, value in values.items():
+            setattr(user, key, value)
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+    # as another worker would, without revoking the tokens
+    forget_user(email)
+    return user
+
+
+class TestTokenClaims:
+    @pytest.mark.asyncio
+    async def test_claims_authorize_admin(self):
+        claims = await get_token_claims(make_token('admin@example.com', role='admin'))
+        assert claims.email == 'admin@example.com' and claims.userType == 'admin'
+        assert await require_admin(claims) is claims, "Active admins must be authorized"
+        with pytest.raises(HTTPException):
+            await require_admin(await get_token_claims(make_token('free@example.com')))
+        with pytest.raises(HTTPException):
+            await require_admin(await get_token_claims(make_token('off@example.com', role='admin', active=False)))
+
+    @pytest.mark.asyncio
+    async def test_inactive_claims_are_rejected(self):
+        with pytest.raises(HTTPException) as error:
+            await get_token_claims(make_token('off@example.com', active=False))
+        assert error.value.status_code == 401 and error.value.detail == "User disabled, please contact admin"
+
+    @pytest.mark.asyncio
+    async def test_tokens_without_claims_are_rejected(self):
+        token = create_access_token(data={"sub": "old@example.com"})
+        with pytest.raises(HTTPException):
+            await get_token_claims(token)
+
+    @pytest.mark.asyncio
+    async def test_revoked_tokens_are_rejected(self):
+        token = make_token('revoked@example.com')
+        await get_token_claims(token)
+        revoke_tokens('revoked@example.com')
+        with pytest.raises(HTTPException):
+            await get_token_claims(token)
+        assert (await get_token_claims(make_token('revoked@example.com'))).email == 'revoked@example.com', \
+            "Tokens issued after the revocation must be accepted"
+
+
+class TestOldClaims:
+    @pytest.mark.asyncio
+    async def test_demoted_admin_is_rejected(self, client, setUp_users, monkeypatch):
+        user = update_user('one@example.com')
+        token = make_token(user.email, role='admin', uid=str(user.id))
+        async with AsyncSession(test_async_engine, expire_on_commit=False) as session:
+            assert await require_admin(await get_token_claims(token, session))
+            update_user(user.email, userType='free')
+            assert await require_admin(await get_token_claims(token, session)), \
+                "Recent claims must be trusted without querying the user"
+            monkeypatch.setattr(secureuser, 'CLAIMS_TTL', -1)
+            with pytest.raises(HTTPException):
+                await require_admin(await get_token_claims(token, session))
+
+    @pytest.mark.asyncio
+    async def test_disabled_user_is_rejected(self, client, setUp_users, monkeypatch):
+        user = update_user('tree@example.com')
+        token = make_token(user.email, uid=str(user.id))
+        monkeypatch.setattr(secureuser, 'CLAIMS_TTL', -1)
+        async with AsyncSession(test_async_engine, expire_on_commit=False) as session:
+            assert (await get_token_claims(token, session)).is_active
+            update_user(user.email, is_active=False)
+            with pytest.raises(HTTPException) as error:
+                await get_token_claims(token, session)
+        assert error.value.detail == "User disabled, please contact admin", \
+            "Users disabled on another worker must be rejected"
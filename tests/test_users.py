@@ -74,15 +74,9 @@ class TestLogin:
 
     def test_check_login_USER_Delete_ChangePassword(self, client: client, setUp_users: setUp_users):
         user1,user2,user3 = setUp_users
-        #Test Info DELETE /users/myuser
+        #Test Info LOGIN /userlogin
         response = client.post("/userlogin",data= {"username": user2['email'], "password": user2['password']})
         header_user2 = {"Authorization" : "Bearer " + response.json()['access_token']}
-        response = client.delete("/users/myuser",)
-        assert response.status_code == status.HTTP_401_UNAUTHORIZED, "Status code not 401_UNAUTHORIZED on path DELETE /users/myuser whitout headers"
-        response = client.delete("/users/myuser", headers=header_user2)
-        assert response.status_code == status.HTTP_200_OK, "Status code not 200 OK on path DELETE /users/myuser whit headers"
-        assert 'disabled' in response.json()['message'], "User must be disabled after deletion"
-
         #Test Info CHANGE PASSWORD /users/myuser
         new_password_User2 = "newPassword_User2"
         response = client.put("/users/myuser/changepassword",)
@@ -97,4 +91,44 @@ class TestLogin:
         assert response.status_code == status.HTTP_401_UNAUTHORIZED, "Status code not 401_UNAUTHORIZED on path LOGIN whit old password"
         response = client.post("/userlogin",data= {"username": user2['email'], "password": new_password_User2})
         assert response.status_code == status.HTTP_200_OK, "Status code not 200 OK on path on  LOGIN whit new password"
+        #Test Info DELETE /users/myuser
+        response = client.delete("/users/myuser",)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED, "Status code not 401_UNAUTHORIZED on path DELETE /users/myuser whitout headers"
+        response = client.delete("/users/myuser", headers=header_user2)
+        assert response.status_code == status.HTTP_200_OK, "Status code not 200 OK on path DELETE /users/myuser whit headers"
+        assert 'disabled' in response.json()['message'], "User must be disabled after deletion"
+
+        response = client.post("/userlogin",data= {"username": user2['email'], "password": new_password_User2})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED, "Status code not 401_UNAUTHORIZED on path LOGIN whit a disabled user"
+        assert response.json()['detail'] == "User disabled, please contact admin"
     
+
+class TestAdminUsers:
+    def test_users_pages_and_export(self, client: client, setUp_users: setUp_users):
+        user1,user2,user3 = setUp_users
+        response = client.post("/userlogin",data= {"username": user1['email'], "password": user1['password']})
+        header_admin = {"Authorization" : "Bearer " + response.json()['access_token']}
+        emails, cursor = [], None
+        while True:
+            params = {'limit': 1, **({'cursor': cursor} if cursor else {})}
+            response = client.get("/admin/allusers", params=params, headers=header_admin)
+            assert response.status_code == status.HTTP_200_OK, "Status code not 200 on path GET /admin/allusers"
+            emails += [user['email'] for user in response.json()['users']]
+            cursor = response.json()['next_cursor']
+            if cursor is None:
+                break
+        assert len(emails) == len(set(emails)) and {user['email'] for user in setUp_users} <= set(emails), "Pages must have every user once"  # noqa: E501
+        response = client.get("/admin/allusers", params={'country': 'Treeland'}, headers=header_admin)
+        assert [user['email'] for user in response.json()['users']] == [user3['email']], "Filters must be applied"
+        response = client.get("/admin/allusers", params={'limit': 101}, headers=header_admin)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, "Limit must be at most 100"
+        for limit in (0, -1):
+            response = client.get("/admin/allusers", params={'limit': limit}, headers=header_admin)
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, "Limit must be at least 1"
+
+        response = client.get("/admin/allusers/export", params={'userType': 'test'}, headers=header_admin)
+        assert response.status_code == status.HTTP_200_OK, "Status code not 200 on path GET /admin/allusers/export"
+        assert len(response.text.splitlines()) == 2, "NDJSON export must have a line per user"
+        response = client.get("/admin/allusers/export", params={'format': 'csv', 'userType': 'test'}, headers=header_admin)
+        assert response.text.splitlines()[0].startswith('name,email'), "CSV export must have a header"
+        assert len(response.text.splitlines()) == 3, "CSV export must have a row per user"
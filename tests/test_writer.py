@@ -0,0 +1,101 @@
+# pytest
+import pytest
+# APP
+from app.models import MyModels
+from app.models.picture import Free_picture, QualityType
+from app.models.user import User  # noqa: F401
+from app.DB.db import set_sqlite_pragmas
+from app.DB.querys_pictures import FreePictureDB
+from app.DB.writer import BatchWriter
+# SQLModel
+from sqlmodel import Session, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import event
+# Python
+import asyncio
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "writer.sqlite"}')
+    event.listen(engine, 'connect', set_sqlite_pragmas)
+    MyModels.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def session_factory(engine, tmp_path):
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "writer.sqlite"}')
+    event.listen(async_engine.sync_engine, 'connect', set_sqlite_pragmas)
+    return lambda: AsyncSession(async_engine)
+
+
+def count_rows(engine) -> int:
+    with Session(engine) as db:
+        return len(db.exec(select(Free_picture)).all())
+
+
+class TestBatchWriter:
+    def test_pragmas_are_set(self, engine):
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 1, "synchronous must be NORMAL"
+
+    @pytest.mark.asyncio
+    async def test_rows_are_batched(self, engine, session_factory):
+        writer = BatchWriter(FreePictureDB.add_freePictures_toDB_async,
+                             batch_delay=0.05, session_factory=session_factory)
+        writer.start()
+        for i in range(10):
+            await writer.add(Free_picture(ip=f'10.0.0.{i}', quality=QualityType.PREVIEW))
+        await asyncio.sleep(0.3)
+        assert count_rows(engine) == 10, "Every queued row must be written"
+        assert writer.stats()['batches'] == 1, "The rows must be written in one transaction"
+        await writer.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_shutdown_writes_queued_rows(self, engine, session_factory):
+        writer = BatchWriter(FreePictureDB.add_freePictures_toDB_async,
+                             batch_delay=10, session_factory=session_factory)
+        writer.start()
+        for i in range(3):
+            await writer.add(Free_picture(ip=f'10.0.0.{i}', quality=QualityType.PREVIEW))
+        await writer.shutdown()
+        assert count_rows(engine) == 3, "Queued rows must not be lost on shutdown"
+
+    @pytest.mark.asyncio
+    async def test_shutdown_during_write(self, engine, session_factory):
+        writing = asyncio.Event()
+
+        async def slow_write(rows, db):
+            # copies, rows written twice would be inserted twice
+            await FreePictureDB.add_freePictures_toDB_async([Free_picture(ip=row.ip, quality=row.quality)
+                                                             for row in rows], db)
+            writing.set()
+            await asyncio.sleep(0.2)
+        writer = BatchWriter(slow_write, batch_delay=0, session_factory=session_factory)
+        writer.start()
+        for i in range(3):
+            await writer.add(Free_picture(ip=f'10.0.0.{i}', quality=QualityType.PREVIEW))
+        await writing.wait()
+        await writer.shutdown()
+        assert count_rows(engine) == 3, "A batch committed while stopping must not be written again"
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_kept(self, engine, session_factory):
+        failures = []
+
+        async def flaky_write(rows, db):
+            if not failures:
+                failures.append(len(rows))
+                raise Exception('database is locked')
+            await FreePictureDB.add_freePictures_toDB_async(rows, db)
+        writer = BatchWriter(flaky_write, batch_delay=0, session_factory=session_factory)
+        writer.start()
+        await writer.add(Free_picture(ip='10.0.0.1', quality=QualityType.PREVIEW))
+        await asyncio.sleep(0.1)
+        await writer.add(Free_picture(ip='10.0.0.2', quality=QualityType.PREVIEW))
+        await asyncio.sleep(0.1)
+        await writer.shutdown()
+        assert failures == [1] and count_rows(engine) == 2, "The rows of a failed batch must be written later"